@@ -19,15 +19,18 @@ from invokeai.backend.util.logging import InvokeAILogger
 from invokeai.version.invokeai_version import __version__
 
 from ..services.default_graphs import create_system_graphs
+from ..services.intermediates_sweeper import IntermediatesSweeper
+from ..services.invocation_cache import DEFAULT_CACHED_TYPES, MemoryInvocationCache
 from ..services.latent_storage import DiskLatentsStorage, ForwardCacheLatentsStorage
 from ..services.restoration_services import RestorationServices
-from ..services.graph import GraphExecutionState, LibraryGraph
+from ..services.graph import LibraryGraph
+from ..services.graph_execution_storage import SqliteGraphExecutionStateStorage
 from ..services.image_file_storage import DiskImageFileStorage
-from ..services.invocation_queue import MemoryInvocationQueue
+from ..services.invocation_queue import SqliteInvocationQueue
 from ..services.invocation_services import InvocationServices
 from ..services.invoker import Invoker
 from ..services.processor import DefaultInvocationProcessor
-from ..services.sqlite import SqliteItemStorage
+from ..services.sqlite import SqliteItemStorage, get_database
 from ..services.model_manager_service import ModelManagerService
 from .events import FastAPIEventService
 
@@ -69,7 +72,14 @@ class ApiDependencies:
         db_location = config.db_path
         db_location.parent.mkdir(parents=True, exist_ok=True)
 
-        graph_execution_manager = SqliteItemStorage[GraphExecutionState](
+        # The storages below share the connections to the database
+        get_database(
+            db_location,
+            synchronous=config.db_synchronous,
+            cache_size=config.db_cache_size,
+        )
+
+        graph_execution_manager = SqliteGraphExecutionStateStorage(
             filename=db_location, table_name="graph_executions"
         )
 
@@ -78,7 +88,8 @@ class ApiDependencies:
         image_file_storage = DiskImageFileStorage(f"{output_folder}/images")
         names = SimpleNameService()
         latents = ForwardCacheLatentsStorage(
-            DiskLatentsStorage(f"{output_folder}/latents")
+            DiskLatentsStorage(f"{output_folder}/latents"),
+            max_cache_size=int(config.latents_cache_size * 2**30),
         )
 
         board_record_storage = SqliteBoardRecordStorage(db_location)
@@ -123,13 +134,22 @@ class ApiDependencies:
             images=images,
             boards=boards,
             board_images=board_images,
-            queue=MemoryInvocationQueue(),
+            queue=SqliteInvocationQueue(
+                filename=db_location, max_size=config.max_queue_size
+            ),
             graph_library=SqliteItemStorage[LibraryGraph](
                 filename=db_location, table_name="graphs"
             ),
             graph_execution_manager=graph_execution_manager,
             processor=DefaultInvocationProcessor(),
             restoration=RestorationServices(config, logger),
+            sweeper=IntermediatesSweeper(
+                delay=config.intermediates_sweep_delay, ttl=config.intermediates_ttl
+            ) if config.sweep_intermediates else None,
+            invocation_cache=MemoryInvocationCache(
+                max_entries=config.invocation_cache_size,
+                node_types=config.invocation_cache_types or DEFAULT_CACHED_TYPES,
+            ) if config.invocation_cache_size else None,
             configuration=config,
             logger=logger,
         )
@@ -2,51 +2,197 @@
 
 import asyncio
 import threading
-from queue import Empty, Queue
-from typing import Any
+import time
+from collections import deque
+from typing import Any, Optional
 
 from fastapi_events.dispatcher import dispatch
+from pydantic import BaseModel, Field
 
+import invokeai.backend.util.logging as logger
 from ..services.events import EventServiceBase
 
+# Session events that are superseded by the next one of the same node
+COALESCED_EVENTS = {"generator_progress"}
+
+
+class EventQueueStats(BaseModel):
+    """How far behind the dispatch of events to clients is"""
+    #fmt: off
+    depth: int = Field(default=0, description="Number of events waiting to be dispatched")
+    max_depth: int = Field(default=0, description="Largest number of events that waited to be dispatched at once")
+    max_queue_size: int = Field(default=0, description="Number of waiting events beyond which senders wait, or progress events are dropped")
+    dispatched: int = Field(default=0, description="Number of events dispatched")
+    coalesced: int = Field(default=0, description="Number of progress events replaced by a later one before being dispatched")
+    dropped: int = Field(default=0, description="Number of progress events dropped because the queue was full")
+    last_lag: float = Field(default=0.0, description="Seconds the last dispatched event waited in the queue")
+    max_lag: float = Field(default=0.0, description="Longest time an event waited in the queue, in seconds")
+    #fmt: on
+
 
 class FastAPIEventService(EventServiceBase):
+    """Dispatches events from any thread on the event loop of the API.
+
+    Events are queued with the time they were sent. The first event of a
+    batch schedules a drain on the event loop, which dispatches every event
+    queued by then, so events reach clients without polling and in the
+    order they were sent.
+
+    Progress events of a node that was not dispatched yet are replaced by
+    the latest one. Beyond `max_queue_size` waiting events, the oldest
+    progress events are dropped, and threads sending other events wait
+    until the loop catches up: completion and error events are never lost.
+    """
+
     event_handler_id: int
-    __queue: Queue
-    __stop_event: threading.Event
+    __loop: asyncio.AbstractEventLoop
+    __queue: deque[list]
+    __coalesced: dict[tuple[str, str], list]
+    __depth: int
+    __max_queue_size: int
+    __max_batch_size: int
+    __drain_scheduled: bool
+    __stopped: bool
+    __stats: EventQueueStats
+    __condition: threading.Condition
+    __subscribers: dict[str, set[str]]
+    __subscribers_lock: threading.Lock
 
-    def __init__(self, event_handler_id: int) -> None:
+    def __init__(self, event_handler_id: int, max_queue_size: int = 1000, max_batch_size: int = 100) -> None:
         self.event_handler_id = event_handler_id
-        self.__queue = Queue()
-        self.__stop_event = threading.Event()
-        asyncio.create_task(self.__dispatch_from_queue(stop_event=self.__stop_event))
+        self.__loop = asyncio.get_running_loop()
+        self.__queue = deque()
+        self.__coalesced = dict()
+        self.__depth = 0
+        self.__max_queue_size = max_queue_size
+        self.__max_batch_size = max_batch_size
+        self.__drain_scheduled = False
+        self.__stopped = False
+        self.__stats = EventQueueStats(max_queue_size=max_queue_size)
+        self.__condition = threading.Condition()
+        self.__subscribers = dict()
+        self.__subscribers_lock = threading.Lock()
 
         super().__init__()
 
     def stop(self, *args, **kwargs):
-        self.__stop_event.set()
-        self.__queue.put(None)
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
 
     def dispatch(self, event_name: str, payload: Any) -> None:
-        self.__queue.put(dict(event_name=event_name, payload=payload))
+        key = self.__get_coalescing_key(payload)
+        with self.__condition:
+            if self.__stopped:
+                return
 
-    async def __dispatch_from_queue(self, stop_event: threading.Event):
-        """Get events on from the queue and dispatch them, from the correct thread"""
-        while not stop_event.is_set():
-            try:
-                event = self.__queue.get(block=False)
-                if not event:  # Probably stopping
+            # the latest progress of a node replaces the progress waiting to be dispatched
+            entry = self.__coalesced.get(key) if key is not None else None
+            if entry is not None:
+                entry[1] = payload
+                self.__stats.coalesced += 1
+                return
+
+            if self.__depth >= self.__max_queue_size:
+                self.__drop_progress()
+            if key is not None and self.__depth >= self.__max_queue_size:
+                self.__stats.dropped += 1
+                return
+            # the event loop would wait for itself
+            if not self.__is_loop_thread():
+                self.__condition.wait_for(
+                    lambda: self.__depth < self.__max_queue_size or self.__stopped
+                )
+
+            entry = [event_name, payload, key, time.monotonic()]
+            self.__queue.append(entry)
+            self.__depth += 1
+            self.__stats.max_depth = max(self.__stats.max_depth, self.__depth)
+            if key is not None:
+                self.__coalesced[key] = entry
+            self.__schedule_drain()
+
+    def get_stats(self) -> EventQueueStats:
+        with self.__condition:
+            return self.__stats.copy(update=dict(depth=self.__depth))
+
+    def add_session_subscriber(self, sid: str, graph_execution_state_id: str) -> None:
+        with self.__subscribers_lock:
+            self.__subscribers.setdefault(graph_execution_state_id, set()).add(sid)
+
+    def remove_session_subscriber(self, sid: str, graph_execution_state_id: Optional[str] = None) -> None:
+        """Removes a client from the subscribers of a session, or of every session"""
+        with self.__subscribers_lock:
+            sessions = [graph_execution_state_id] if graph_execution_state_id else list(self.__subscribers)
+            for session in sessions:
+                sids = self.__subscribers.get(session, set())
+                sids.discard(sid)
+                if not sids:
+                    self.__subscribers.pop(session, None)
+
+    def has_session_subscribers(self, graph_execution_state_id: str) -> bool:
+        with self.__subscribers_lock:
+            return graph_execution_state_id in self.__subscribers
+
+    def __drain(self) -> None:
+        """Dispatches the queued events, from the event loop"""
+        with self.__condition:
+            batch = list()
+            while self.__queue and len(batch) < self.__max_batch_size:
+                entry = self.__queue.popleft()
+                if entry[1] is None:  # dropped
                     continue
+                if entry[2] is not None:
+                    self.__coalesced.pop(entry[2], None)
+                batch.append(entry)
+            self.__depth -= len(batch)
+            self.__drain_scheduled = False
+            # let other tasks run between batches
+            if self.__queue:
+                self.__schedule_drain()
+            self.__condition.notify_all()
 
+        now = time.monotonic()
+        for event_name, payload, *_ in batch:
+            try:
                 dispatch(
-                    event.get("event_name"),
-                    payload=event.get("payload"),
+                    event_name,
+                    payload=payload,
                     middleware_id=self.event_handler_id,
                 )
+            except Exception as e:
+                logger.error(f"Could not dispatch {event_name}: {e}")
+
+        if batch:
+            with self.__condition:
+                self.__stats.dispatched += len(batch)
+                self.__stats.last_lag = now - batch[-1][3]
+                self.__stats.max_lag = max(self.__stats.max_lag, now - batch[0][3])
+
+    def __schedule_drain(self) -> None:
+        if not self.__drain_scheduled:
+            self.__drain_scheduled = True
+            self.__loop.call_soon_threadsafe(self.__drain)
+
+    def __drop_progress(self) -> None:
+        """Drops the oldest waiting progress event to make room"""
+        for entry in self.__queue:
+            if entry[2] is not None and entry[1] is not None:
+                entry[1] = None
+                self.__coalesced.pop(entry[2], None)
+                self.__depth -= 1
+                self.__stats.dropped += 1
+                return
 
-            except Empty:
-                await asyncio.sleep(0.1)
-                pass
+    def __is_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.__loop
+        except RuntimeError:
+            return False
 
-            except asyncio.CancelledError as e:
-                raise e  # Raise a proper error
+    @staticmethod
+    def __get_coalescing_key(payload: Any) -> Optional[tuple[str, str]]:
+        if not isinstance(payload, dict) or payload.get("event") not in COALESCED_EVENTS:
+            return None
+        data = payload.get("data", {})
+        return (data.get("graph_execution_state_id"), data.get("source_node_id"))
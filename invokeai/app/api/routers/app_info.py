@@ -4,6 +4,10 @@ from pydantic import BaseModel, Field
 from invokeai.backend.image_util.patchmatch import PatchMatch
 from invokeai.version import __version__
 
+from ...services.invocation_cache import InvocationCacheStats
+from ..dependencies import ApiDependencies
+from ..events import EventQueueStats
+
 app_router = APIRouter(prefix="/v1/app", tags=["app"])
 
 
@@ -34,3 +38,28 @@ async def get_config() -> AppConfig:
     if PatchMatch.patchmatch_available():
         infill_methods.append('patchmatch')
     return AppConfig(infill_methods=infill_methods)
+
+
+@app_router.get(
+    "/invocation_cache_stats",
+    operation_id="get_invocation_cache_stats",
+    status_code=200,
+    response_model=InvocationCacheStats,
+)
+async def get_invocation_cache_stats() -> InvocationCacheStats:
+    """Gets how many invocations reused the outputs of identical earlier invocations"""
+    invocation_cache = ApiDependencies.invoker.services.invocation_cache
+    if invocation_cache is None:
+        return InvocationCacheStats()
+    return invocation_cache.get_stats()
+
+
+@app_router.get(
+    "/event_queue_stats",
+    operation_id="get_event_queue_stats",
+    status_code=200,
+    response_model=EventQueueStats,
+)
+async def get_event_queue_stats() -> EventQueueStats:
+    """Gets how many events wait to be sent to clients, and for how long they waited"""
+    return ApiDependencies.invoker.services.events.get_stats()
@@ -14,7 +14,7 @@ from invokeai.backend.model_management.models import (
     OPENAPI_MODEL_CONFIGS,
     SchedulerPredictionType,
 )
-from invokeai.backend.model_management import MergeInterpolationMethod
+from invokeai.backend.model_management import MergeInterpolationMethod, PrefetchStats
 from ..dependencies import ApiDependencies
 
 models_router = APIRouter(prefix="/v1/models", tags=["models"])
@@ -42,6 +42,24 @@ async def list_models(
     models = parse_obj_as(ModelsList, { "models": models_raw })
     return models
 
+@models_router.get(
+    "/prefetch_stats",
+    operation_id="get_prefetch_stats",
+    response_model=PrefetchStats,
+)
+async def get_prefetch_stats() -> PrefetchStats:
+    """Gets how many model requests were served by prefetching models, and the loading time saved"""
+    return ApiDependencies.invoker.services.model_manager.get_prefetch_stats()
+
+@models_router.get(
+    "/duplicates",
+    operation_id="find_duplicate_models",
+    response_model=List[List[str]],
+)
+async def find_duplicate_models() -> List[List[str]]:
+    """Gets the keys of the installed models that have the same contents, grouped by model. Models are hashed the first time, which can take a while"""
+    return ApiDependencies.invoker.services.model_manager.find_duplicate_models()
+
 @models_router.patch(
     "/{base_model}/{model_type}/{model_name}",
     operation_id="update_model",
@@ -15,7 +15,7 @@ from ...services.graph import (
     GraphExecutionState,
     NodeAlreadyExecutedError,
 )
-from ...services.item_storage import PaginatedResults
+from ...services.item_storage import CursorPaginatedResults, ItemSummary, PaginatedResults
 from ..dependencies import ApiDependencies
 
 session_router = APIRouter(prefix="/v1/sessions", tags=["sessions"])
@@ -61,6 +61,22 @@ async def list_sessions(
     return result
 
 
+@session_router.get(
+    "/summaries",
+    operation_id="list_session_summaries",
+    responses={200: {"model": CursorPaginatedResults[ItemSummary]}},
+)
+async def list_session_summaries(
+    after: Optional[str] = Query(default=None, description="The cursor returned with the previous page"),
+    per_page: int = Query(default=10, description="The number of results per page"),
+    query: str = Query(default="", description="The query string to search for"),
+) -> CursorPaginatedResults[ItemSummary]:
+    """Gets summaries of sessions ordered by id, optionally searching. Summaries are not parsed, so this is cheaper than listing sessions"""
+    return ApiDependencies.invoker.services.graph_execution_manager.list_summaries(
+        after, per_page, query
+    )
+
+
 @session_router.get(
     "/{session_id}",
     operation_id="get_session",
@@ -251,6 +267,7 @@ async def delete_edge(
         202: {"description": "The invocation is queued"},
         400: {"description": "The session has no invocations ready to invoke"},
         404: {"description": "Session not found"},
+        503: {"description": "The invocation queue is full, retry later"},
     },
 )
 async def invoke_session(
@@ -258,6 +275,9 @@ async def invoke_session(
     all: bool = Query(
         default=False, description="Whether or not to invoke all remaining invocations"
     ),
+    priority: int = Query(
+        default=0, description="The priority of the invocations, higher priorities are invoked first"
+    ),
 ) -> Response:
     """Invokes a session"""
     session = ApiDependencies.invoker.services.graph_execution_manager.get(session_id)
@@ -267,7 +287,14 @@ async def invoke_session(
     if session.is_complete():
         raise HTTPException(status_code=400)
 
-    ApiDependencies.invoker.invoke(session, invoke_all=all)
+    if ApiDependencies.invoker.services.queue.is_full():
+        raise HTTPException(
+            status_code=503,
+            detail="The invocation queue is full",
+            headers={"Retry-After": "10"},
+        )
+
+    ApiDependencies.invoker.invoke(session, invoke_all=all, priority=priority)
     return Response(status_code=202)
 
 
@@ -6,6 +6,7 @@ from fastapi_events.typing import Event
 from fastapi_socketio import SocketManager
 
 from ..services.events import EventServiceBase
+from .dependencies import ApiDependencies
 
 
 class SocketIO:
@@ -15,10 +16,14 @@ class SocketIO:
         self.__sio = SocketManager(app=app)
         self.__sio.on("subscribe", handler=self._handle_sub)
         self.__sio.on("unsubscribe", handler=self._handle_unsub)
+        self.__sio.on("disconnect", handler=self._handle_disconnect)
 
         local_handler.register(
             event_name=EventServiceBase.session_event, _func=self._handle_session_event
         )
+        local_handler.register(
+            event_name=EventServiceBase.model_event, _func=self._handle_model_event
+        )
 
     async def _handle_session_event(self, event: Event):
         await self.__sio.emit(
@@ -27,12 +32,24 @@ class SocketIO:
             room=event[1]["data"]["graph_execution_state_id"],
         )
 
+    async def _handle_model_event(self, event: Event):
+        # models are shared by every session
+        await self.__sio.emit(
+            event=event[1]["event"],
+            data=event[1]["data"],
+        )
+
     async def _handle_sub(self, sid, data, *args, **kwargs):
         if "session" in data:
             self.__sio.enter_room(sid, data["session"])
+            ApiDependencies.invoker.services.events.add_session_subscriber(sid, data["session"])
 
         # @app.sio.on('unsubscribe')
 
     async def _handle_unsub(self, sid, data, *args, **kwargs):
         if "session" in data:
             self.__sio.leave_room(sid, data["session"])
+            ApiDependencies.invoker.services.events.remove_session_subscriber(sid, data["session"])
+
+    async def _handle_disconnect(self, sid, *args, **kwargs):
+        ApiDependencies.invoker.services.events.remove_session_subscriber(sid)
@@ -38,6 +38,8 @@ from invokeai.app.services.resource_name import SimpleNameService
 from invokeai.app.services.urls import LocalUrlService
 from .services.default_graphs import (default_text_to_image_graph_id,
                                       create_system_graphs)
+from .services.intermediates_sweeper import IntermediatesSweeper
+from .services.invocation_cache import DEFAULT_CACHED_TYPES, MemoryInvocationCache
 from .services.latent_storage import DiskLatentsStorage, ForwardCacheLatentsStorage
 
 from .cli.commands import (BaseCommand, CliContext, ExitCli,
@@ -48,6 +50,7 @@ from .services.events import EventServiceBase
 from .services.graph import (Edge, EdgeConnection, GraphExecutionState,
                              GraphInvocation, LibraryGraph,
                              are_connection_types_compatible)
+from .services.graph_execution_storage import SqliteGraphExecutionStateStorage
 from .services.image_file_storage import DiskImageFileStorage
 from .services.invocation_queue import MemoryInvocationQueue
 from .services.invocation_services import InvocationServices
@@ -55,7 +58,7 @@ from .services.invoker import Invoker
 from .services.model_manager_service import ModelManagerService
 from .services.processor import DefaultInvocationProcessor
 from .services.restoration_services import RestorationServices
-from .services.sqlite import SqliteItemStorage
+from .services.sqlite import SqliteItemStorage, get_database
 
 import torch
 if torch.backends.mps.is_available():
@@ -238,7 +241,10 @@ def invoke_cli():
 
     logger.info(f'InvokeAI database location is "{db_location}"')
 
-    graph_execution_manager = SqliteItemStorage[GraphExecutionState](
+    # The storages below share the connections to the database
+    get_database(db_location, synchronous=config.db_synchronous, cache_size=config.db_cache_size)
+
+    graph_execution_manager = SqliteGraphExecutionStateStorage(
             filename=db_location, table_name="graph_executions"
         )
 
@@ -285,7 +291,10 @@ def invoke_cli():
     services = InvocationServices(
         model_manager=model_manager,
         events=events,
-        latents = ForwardCacheLatentsStorage(DiskLatentsStorage(f'{output_folder}/latents')),
+        latents = ForwardCacheLatentsStorage(
+            DiskLatentsStorage(f'{output_folder}/latents'),
+            max_cache_size=int(config.latents_cache_size * 2**30),
+        ),
         images=images,
         boards=boards,
         board_images=board_images,
@@ -296,6 +305,14 @@ def invoke_cli():
         graph_execution_manager=graph_execution_manager,
         processor=DefaultInvocationProcessor(),
         restoration=RestorationServices(config,logger=logger),
+        # commands link to the outputs of earlier ones, so only expired intermediates are swept
+        sweeper=IntermediatesSweeper(
+            delay=None, ttl=config.intermediates_ttl
+        ) if config.sweep_intermediates else None,
+        invocation_cache=MemoryInvocationCache(
+            max_entries=config.invocation_cache_size,
+            node_types=config.invocation_cache_types or DEFAULT_CACHED_TYPES,
+        ) if config.invocation_cache_size else None,
         logger=logger,
         configuration=config,
     )
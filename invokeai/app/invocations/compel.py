@@ -1,12 +1,14 @@
-from typing import Literal, Optional, Union, List
+from typing import Literal, Optional, Tuple, Union, List
 from pydantic import BaseModel, Field
+import hashlib
+import json
 import re
 import torch
 from compel import Compel
 from compel.prompt_parser import (Blend, Conjunction,
                                   CrossAttentionControlSubstitute,
                                   FlattenedPrompt, Fragment)
-from ...backend.util.devices import torch_dtype
+from ...backend.util.devices import choose_torch_device, torch_dtype
 from ...backend.model_management import ModelType
 from ...backend.model_management.models import ModelNotFoundException
 from ...backend.model_management.lora import ModelPatcher
@@ -56,78 +58,235 @@ class CompelInvocation(BaseInvocation):
 
     @torch.no_grad()
     def invoke(self, context: InvocationContext) -> CompelOutput:
-        tokenizer_info = context.services.model_manager.get_model(
-            **self.clip.tokenizer.dict(),
+        conditioning_name, = encode_prompts(context, self.clip, [self.prompt])
+
+        return CompelOutput(
+            conditioning=ConditioningField(
+                conditioning_name=conditioning_name,
+            ),
         )
-        text_encoder_info = context.services.model_manager.get_model(
-            **self.clip.text_encoder.dict(),
+
+
+class ConditioningCollectionOutput(BaseInvocationOutput):
+    """Compel parser output for a collection of prompts"""
+
+    #fmt: off
+    type: Literal["conditioning_collection_output"] = "conditioning_collection_output"
+
+    collection: List[ConditioningField] = Field(default_factory=list, description="The conditioning of each prompt")
+    #fmt: on
+
+    class Config:
+        schema_extra = {"required": ["type", "collection"]}
+
+
+class CompelCollectionInvocation(BaseInvocation):
+    """Parse a collection of prompts using compel package to conditioning, encoding them together."""
+
+    type: Literal["compel_collection"] = "compel_collection"
+
+    prompts: List[str] = Field(default_factory=list, description="Prompts")
+    clip: ClipField = Field(None, description="Clip to use")
+
+    # Schema customisation
+    class Config(InvocationConfig):
+        schema_extra = {
+            "ui": {
+                "title": "Prompts (Compel)",
+                "tags": ["prompt", "compel"],
+                "type_hints": {
+                    "model": "model"
+                }
+            },
+        }
+
+    @torch.no_grad()
+    def invoke(self, context: InvocationContext) -> ConditioningCollectionOutput:
+        conditioning_names = encode_prompts(context, self.clip, self.prompts)
+
+        return ConditioningCollectionOutput(
+            collection=[ConditioningField(conditioning_name=name) for name in conditioning_names],
         )
 
-        def _lora_loader():
-            for lora in self.clip.loras:
-                lora_info = context.services.model_manager.get_model(
-                    **lora.dict(exclude={"weight"}))
-                yield (lora_info.context.model, lora.weight)
-                del lora_info
-            return
-
-        #loras = [(context.services.model_manager.get_model(**lora.dict(exclude={"weight"})).context.model, lora.weight) for lora in self.clip.loras]
-
-        ti_list = []
-        for trigger in re.findall(r"<[a-zA-Z0-9., _-]+>", self.prompt):
-            name = trigger[1:-1]
-            try:
-                ti_list.append(
-                    context.services.model_manager.get_model(
-                        model_name=name,
-                        base_model=self.clip.text_encoder.base_model,
-                        model_type=ModelType.TextualInversion,
-                    ).context.model
-                )
-            except ModelNotFoundException:
-                # print(e)
-                #import traceback
-                #print(traceback.format_exc())
-                print(f"Warn: trigger: \"{trigger}\" not found")
-
-        with ModelPatcher.apply_lora_text_encoder(text_encoder_info.context.model, _lora_loader()),\
-                ModelPatcher.apply_ti(tokenizer_info.context.model, text_encoder_info.context.model, ti_list) as (tokenizer, ti_manager),\
-                ModelPatcher.apply_clip_skip(text_encoder_info.context.model, self.clip.skipped_layers),\
-                text_encoder_info as text_encoder:
-
-            compel = Compel(
-                tokenizer=tokenizer,
-                text_encoder=text_encoder,
-                textual_inversion_manager=ti_manager,
-                dtype_for_device_getter=torch_dtype,
-                truncate_long_prompts=False,
+
+def get_trigger_names(prompt: str) -> List[str]:
+    """Gets the names of the textual inversion embeddings a prompt refers to"""
+    return [trigger[1:-1] for trigger in re.findall(r"<[a-zA-Z0-9., _-]+>", prompt)]
+
+
+def get_conditioning_name(context: InvocationContext, clip: ClipField, prompt: str) -> str:
+    """
+    Names the conditioning of a prompt after what it depends on: the prompt,
+    the contents of the text encoder, LoRAs and embeddings, and the skipped
+    layers. A prompt is then only encoded once, whatever the session.
+    """
+    model_manager = context.services.model_manager
+    text_encoder = clip.text_encoder
+    embeddings = [
+        model_manager.get_model_hash(name, text_encoder.base_model, ModelType.TextualInversion)
+        for name in get_trigger_names(prompt)
+        if model_manager.model_exists(name, text_encoder.base_model, ModelType.TextualInversion)
+    ]
+    key = dict(
+        prompt=prompt,
+        text_encoder=model_manager.get_model_hash(
+            text_encoder.model_name, text_encoder.base_model, text_encoder.model_type
+        ),
+        loras=[
+            (model_manager.get_model_hash(lora.model_name, lora.base_model, lora.model_type), lora.weight)
+            for lora in clip.loras
+        ],
+        embeddings=embeddings,
+        skipped_layers=clip.skipped_layers,
+        dtype=str(torch_dtype(choose_torch_device())),
+    )
+    return "conditioning_" + hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def encode_prompts(context: InvocationContext, clip: ClipField, prompts: List[str]) -> List[str]:
+    """
+    Gets the names of the conditioning of prompts, encoding the prompts that
+    were not encoded before.
+    """
+    conditioning_names = [get_conditioning_name(context, clip, prompt) for prompt in prompts]
+    missing = dict()
+    for name, prompt in zip(conditioning_names, prompts):
+        if context.services.latents.get_size(name) == 0:
+            missing[name] = prompt
+        else:
+            # conditioning is shared by sessions, and only expires once it is no longer reused
+            context.services.latents.touch(name)
+    if missing:
+        conditionings = build_conditionings(context, clip, list(missing.values()))
+        for name, conditioning in zip(missing, conditionings):
+            context.services.latents.save(name, conditioning)
+    return conditioning_names
+
+
+def build_conditionings(
+    context: InvocationContext, clip: ClipField, prompts: List[str]
+) -> List[Tuple[torch.Tensor, InvokeAIDiffuserComponent.ExtraConditioningInfo]]:
+    """Encodes prompts, loading and patching the text encoder once for all of them"""
+    tokenizer_info = context.services.model_manager.get_model(
+        **clip.tokenizer.dict(),
+    )
+    text_encoder_info = context.services.model_manager.get_model(
+        **clip.text_encoder.dict(),
+    )
+
+    def _lora_loader():
+        for lora in clip.loras:
+            lora_info = context.services.model_manager.get_model(
+                **lora.dict(exclude={"weight"}))
+            yield (lora_info.context.model, lora.weight)
+            del lora_info
+        return
+
+    ti_list = []
+    for name in dict.fromkeys(n for prompt in prompts for n in get_trigger_names(prompt)):
+        try:
+            ti_list.append(
+                context.services.model_manager.get_model(
+                    model_name=name,
+                    base_model=clip.text_encoder.base_model,
+                    model_type=ModelType.TextualInversion,
+                ).context.model
             )
+        except ModelNotFoundException:
+            context.services.logger.warning(f'trigger: "<{name}>" not found')
+
+    with ModelPatcher.apply_lora_text_encoder(text_encoder_info.context.model, _lora_loader()),\
+            ModelPatcher.apply_ti(tokenizer_info.context.model, text_encoder_info.context.model, ti_list) as (tokenizer, ti_manager),\
+            ModelPatcher.apply_clip_skip(text_encoder_info.context.model, clip.skipped_layers),\
+            text_encoder_info as text_encoder:
+
+        compel = Compel(
+            tokenizer=tokenizer,
+            text_encoder=text_encoder,
+            textual_inversion_manager=ti_manager,
+            dtype_for_device_getter=torch_dtype,
+            truncate_long_prompts=False,
+        )
 
-            conjunction = Compel.parse_prompt_string(self.prompt)
+        conjunctions = [Compel.parse_prompt_string(prompt) for prompt in prompts]
+        plain_prompts = dict()
+        conditionings = list()
+        for i, conjunction in enumerate(conjunctions):
             prompt: Union[FlattenedPrompt, Blend] = conjunction.prompts[0]
 
             if context.services.configuration.log_tokenization:
                 log_tokenization_for_prompt_object(prompt, tokenizer)
 
-            c, options = compel.build_conditioning_tensor_for_prompt_object(
-                prompt)
+            if is_plain_prompt(prompt):
+                plain_prompts[i] = prompt
+                c, options = None, dict()
+            else:
+                c, options = compel.build_conditioning_tensor_for_prompt_object(
+                    prompt)
 
             ec = InvokeAIDiffuserComponent.ExtraConditioningInfo(
                 tokens_count_including_eos_bos=get_max_token_count(
                     tokenizer, conjunction),
                 cross_attention_control_args=options.get(
                     "cross_attention_control", None),)
+            conditionings.append((c, ec))
 
-        conditioning_name = f"{context.graph_execution_state_id}_{self.id}_conditioning"
+        # the plain prompts go through the text encoder together
+        if plain_prompts:
+            for i, c in zip(plain_prompts, encode_plain_prompts(compel, list(plain_prompts.values()))):
+                conditionings[i] = (c, conditionings[i][1])
 
-        # TODO: hacky but works ;D maybe rename latents somehow?
-        context.services.latents.save(conditioning_name, (c, ec))
+    return conditionings
 
-        return CompelOutput(
-            conditioning=ConditioningField(
-                conditioning_name=conditioning_name,
-            ),
+
+def is_plain_prompt(prompt: Union[FlattenedPrompt, Blend]) -> bool:
+    """Whether Compel encodes a prompt in a single pass of the text encoder"""
+    return (
+        type(prompt) is FlattenedPrompt
+        and not prompt.wants_cross_attention_control
+        and all(fragment.weight >= 1 for fragment in prompt.children)
+    )
+
+
+def encode_plain_prompts(compel: Compel, prompts: List[FlattenedPrompt]) -> List[torch.Tensor]:
+    """
+    Encodes several plain prompts (see is_plain_prompt()) in a single forward
+    pass of the text encoder, and weights their tokens as Compel does: the
+    embedding of each token is moved away from that of an empty prompt by
+    its weight.
+    """
+    provider = compel.conditioning_provider
+    tokenizer = provider.tokenizer
+    max_token_count = provider.max_token_count
+    device = compel.device
+
+    empty_token_ids = torch.tensor(
+        [[tokenizer.bos_token_id, tokenizer.eos_token_id] + [tokenizer.pad_token_id] * (max_token_count - 2)],
+        dtype=torch.long, device=device,
+    )
+    token_ids = [empty_token_ids]
+    masks = [torch.ones_like(empty_token_ids)]
+    weights = []
+    for prompt in prompts:
+        # long prompts are split into several chunks
+        prompt_token_ids, prompt_weights, prompt_mask = provider.get_token_ids_and_expand_weights(
+            [fragment.text for fragment in prompt.children],
+            [fragment.weight for fragment in prompt.children],
+            device=device,
         )
+        token_ids.append(prompt_token_ids.reshape(-1, max_token_count))
+        masks.append(prompt_mask.reshape(-1, max_token_count))
+        weights.append(prompt_weights.reshape(-1, max_token_count))
+
+    z = provider._encode_token_ids_to_embeddings(torch.cat(token_ids), torch.cat(masks))
+    empty_z, z = z[:1], z[1:]
+
+    conditionings = []
+    for prompt_weights in weights:
+        chunks, z = z[:len(prompt_weights)], z[len(prompt_weights):]
+        weighted = empty_z + (chunks - empty_z) * prompt_weights.unsqueeze(-1).to(chunks)
+        conditionings.append(weighted.reshape(1, -1, weighted.shape[-1]))
+    return conditionings
 
 class ClipSkipInvocationOutput(BaseInvocationOutput):
     """Clip skip node output"""
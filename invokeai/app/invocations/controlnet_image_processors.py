@@ -191,6 +191,21 @@ class ControlNetInvocation(BaseInvocation):
         )
 
 
+def load_annotator(
+    context: InvocationContext,
+    detector_class: type,
+    pretrained_model_or_path: str = "lllyasviel/Annotators",
+    gpu_load: bool = True,
+    **kwargs,
+):
+    """Gets a detector from the model cache, where it stays between invocations"""
+    return context.services.model_manager.get_annotator(
+        f"{pretrained_model_or_path}:{detector_class.__name__}",
+        lambda: detector_class.from_pretrained(pretrained_model_or_path, **kwargs),
+        gpu_load=gpu_load,
+    )
+
+
 class ImageProcessorInvocation(BaseInvocation, PILInvocationConfig):
     """Base class for invocations that preprocess images for ControlNet"""
 
@@ -201,14 +216,14 @@ class ImageProcessorInvocation(BaseInvocation, PILInvocationConfig):
     # fmt: on
 
 
-    def run_processor(self, image):
+    def run_processor(self, image, context: InvocationContext):
         # superclass just passes through image without processing
         return image
 
     def invoke(self, context: InvocationContext) -> ImageOutput:
         raw_image = context.services.images.get_pil_image(self.image.image_name)
         # image type should be PIL.PngImagePlugin.PngImageFile ?
-        processed_image = self.run_processor(raw_image)
+        processed_image = self.run_processor(raw_image, context)
 
         # FIXME: what happened to image metadata?
         # metadata = context.services.metadata.build_metadata(
@@ -247,7 +262,7 @@ class CannyImageProcessorInvocation(ImageProcessorInvocation, PILInvocationConfi
     high_threshold: int = Field(default=200, ge=0, le=255, description="The high threshold of the Canny pixel gradient (0-255)")
     # fmt: on
 
-    def run_processor(self, image):
+    def run_processor(self, image, context: InvocationContext):
         canny_processor = CannyDetector()
         processed_image = canny_processor(image, self.low_threshold, self.high_threshold)
         return processed_image
@@ -265,15 +280,15 @@ class HedImageProcessorInvocation(ImageProcessorInvocation, PILInvocationConfig)
     scribble: bool = Field(default=False, description="Whether to use scribble mode")
     # fmt: on
 
-    def run_processor(self, image):
-        hed_processor = HEDdetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = hed_processor(image,
-                                        detect_resolution=self.detect_resolution,
-                                        image_resolution=self.image_resolution,
-                                        # safe not supported in controlnet_aux v0.0.3
-                                        # safe=self.safe,
-                                        scribble=self.scribble,
-                                        )
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, HEDdetector) as hed_processor:
+            processed_image = hed_processor(image,
+                                            detect_resolution=self.detect_resolution,
+                                            image_resolution=self.image_resolution,
+                                            # safe not supported in controlnet_aux v0.0.3
+                                            # safe=self.safe,
+                                            scribble=self.scribble,
+                                            )
         return processed_image
 
 
@@ -287,12 +302,12 @@ class LineartImageProcessorInvocation(ImageProcessorInvocation, PILInvocationCon
     coarse: bool = Field(default=False, description="Whether to use coarse mode")
     # fmt: on
 
-    def run_processor(self, image):
-        lineart_processor = LineartDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = lineart_processor(image,
-                                            detect_resolution=self.detect_resolution,
-                                            image_resolution=self.image_resolution,
-                                            coarse=self.coarse)
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, LineartDetector) as lineart_processor:
+            processed_image = lineart_processor(image,
+                                                detect_resolution=self.detect_resolution,
+                                                image_resolution=self.image_resolution,
+                                                coarse=self.coarse)
         return processed_image
 
 
@@ -305,12 +320,12 @@ class LineartAnimeImageProcessorInvocation(ImageProcessorInvocation, PILInvocati
     image_resolution: int = Field(default=512, ge=0, description="The pixel resolution for the output image")
     # fmt: on
 
-    def run_processor(self, image):
-        processor = LineartAnimeDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = processor(image,
-                                    detect_resolution=self.detect_resolution,
-                                    image_resolution=self.image_resolution,
-                                    )
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, LineartAnimeDetector) as processor:
+            processed_image = processor(image,
+                                        detect_resolution=self.detect_resolution,
+                                        image_resolution=self.image_resolution,
+                                        )
         return processed_image
 
 
@@ -324,13 +339,13 @@ class OpenposeImageProcessorInvocation(ImageProcessorInvocation, PILInvocationCo
     image_resolution: int = Field(default=512, ge=0, description="The pixel resolution for the output image")
     # fmt: on
 
-    def run_processor(self, image):
-        openpose_processor = OpenposeDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = openpose_processor(image,
-                                             detect_resolution=self.detect_resolution,
-                                             image_resolution=self.image_resolution,
-                                             hand_and_face=self.hand_and_face,
-                                             )
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, OpenposeDetector) as openpose_processor:
+            processed_image = openpose_processor(image,
+                                                 detect_resolution=self.detect_resolution,
+                                                 image_resolution=self.image_resolution,
+                                                 hand_and_face=self.hand_and_face,
+                                                 )
         return processed_image
 
 
@@ -345,14 +360,14 @@ class MidasDepthImageProcessorInvocation(ImageProcessorInvocation, PILInvocation
     # depth_and_normal: bool = Field(default=False, description="whether to use depth and normal mode")
     # fmt: on
 
-    def run_processor(self, image):
-        midas_processor = MidasDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = midas_processor(image,
-                                          a=np.pi * self.a_mult,
-                                          bg_th=self.bg_th,
-                                          # dept_and_normal not supported in controlnet_aux v0.0.3
-                                          # depth_and_normal=self.depth_and_normal,
-                                          )
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, MidasDetector) as midas_processor:
+            processed_image = midas_processor(image,
+                                              a=np.pi * self.a_mult,
+                                              bg_th=self.bg_th,
+                                              # dept_and_normal not supported in controlnet_aux v0.0.3
+                                              # depth_and_normal=self.depth_and_normal,
+                                              )
         return processed_image
 
 
@@ -365,11 +380,11 @@ class NormalbaeImageProcessorInvocation(ImageProcessorInvocation, PILInvocationC
     image_resolution: int = Field(default=512, ge=0, description="The pixel resolution for the output image")
     # fmt: on
 
-    def run_processor(self, image):
-        normalbae_processor = NormalBaeDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = normalbae_processor(image,
-                                              detect_resolution=self.detect_resolution,
-                                              image_resolution=self.image_resolution)
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, NormalBaeDetector) as normalbae_processor:
+            processed_image = normalbae_processor(image,
+                                                  detect_resolution=self.detect_resolution,
+                                                  image_resolution=self.image_resolution)
         return processed_image
 
 
@@ -384,13 +399,13 @@ class MlsdImageProcessorInvocation(ImageProcessorInvocation, PILInvocationConfig
     thr_d: float = Field(default=0.1, ge=0, description="MLSD parameter `thr_d`")
     # fmt: on
 
-    def run_processor(self, image):
-        mlsd_processor = MLSDdetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = mlsd_processor(image,
-                                         detect_resolution=self.detect_resolution,
-                                         image_resolution=self.image_resolution,
-                                         thr_v=self.thr_v,
-                                         thr_d=self.thr_d)
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, MLSDdetector) as mlsd_processor:
+            processed_image = mlsd_processor(image,
+                                             detect_resolution=self.detect_resolution,
+                                             image_resolution=self.image_resolution,
+                                             thr_v=self.thr_v,
+                                             thr_d=self.thr_d)
         return processed_image
 
 
@@ -405,13 +420,13 @@ class PidiImageProcessorInvocation(ImageProcessorInvocation, PILInvocationConfig
     scribble: bool = Field(default=False, description="Whether to use scribble mode")
     # fmt: on
 
-    def run_processor(self, image):
-        pidi_processor = PidiNetDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = pidi_processor(image,
-                                         detect_resolution=self.detect_resolution,
-                                         image_resolution=self.image_resolution,
-                                         safe=self.safe,
-                                         scribble=self.scribble)
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, PidiNetDetector) as pidi_processor:
+            processed_image = pidi_processor(image,
+                                             detect_resolution=self.detect_resolution,
+                                             image_resolution=self.image_resolution,
+                                             safe=self.safe,
+                                             scribble=self.scribble)
         return processed_image
 
 
@@ -427,7 +442,7 @@ class ContentShuffleImageProcessorInvocation(ImageProcessorInvocation, PILInvoca
     f: Optional[int] = Field(default=256, ge=0, description="Content shuffle `f` parameter")
     # fmt: on
 
-    def run_processor(self, image):
+    def run_processor(self, image, context: InvocationContext):
         content_shuffle_processor = ContentShuffleDetector()
         processed_image = content_shuffle_processor(image,
                                                     detect_resolution=self.detect_resolution,
@@ -446,9 +461,9 @@ class ZoeDepthImageProcessorInvocation(ImageProcessorInvocation, PILInvocationCo
     type: Literal["zoe_depth_image_processor"] = "zoe_depth_image_processor"
     # fmt: on
 
-    def run_processor(self, image):
-        zoe_depth_processor = ZoeDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = zoe_depth_processor(image)
+    def run_processor(self, image, context: InvocationContext):
+        with load_annotator(context, ZoeDetector) as zoe_depth_processor:
+            processed_image = zoe_depth_processor(image)
         return processed_image
 
 
@@ -461,7 +476,7 @@ class MediapipeFaceProcessorInvocation(ImageProcessorInvocation, PILInvocationCo
     min_confidence: float = Field(default=0.5, ge=0, le=1, description="Minimum confidence for face detection")
     # fmt: on
 
-    def run_processor(self, image):
+    def run_processor(self, image, context: InvocationContext):
         # MediaPipeFaceDetector throws an error if image has alpha channel
         #     so convert to RGB if needed
         if image.mode == 'RGBA':
@@ -482,14 +497,15 @@ class LeresImageProcessorInvocation(ImageProcessorInvocation, PILInvocationConfi
     image_resolution: int = Field(default=512, ge=0, description="The pixel resolution for the output image")
     # fmt: on
 
-    def run_processor(self, image):
-        leres_processor = LeresDetector.from_pretrained("lllyasviel/Annotators")
-        processed_image = leres_processor(image,
-                                          thr_a=self.thr_a,
-                                          thr_b=self.thr_b,
-                                          boost=self.boost,
-                                          detect_resolution=self.detect_resolution,
-                                          image_resolution=self.image_resolution)
+    def run_processor(self, image, context: InvocationContext):
+        # LeresDetector does not move its boost model to other devices
+        with load_annotator(context, LeresDetector, gpu_load=False) as leres_processor:
+            processed_image = leres_processor(image,
+                                              thr_a=self.thr_a,
+                                              thr_b=self.thr_b,
+                                              boost=self.boost,
+                                              detect_resolution=self.detect_resolution,
+                                              image_resolution=self.image_resolution)
         return processed_image
 
 
@@ -517,7 +533,7 @@ class TileResamplerProcessorInvocation(ImageProcessorInvocation, PILInvocationCo
         np_img = cv2.resize(np_img, (W, H), interpolation=cv2.INTER_AREA)
         return np_img
 
-    def run_processor(self, img):
+    def run_processor(self, img, context: InvocationContext):
         np_img = np.array(img, dtype=np.uint8)
         processed_np_image = self.tile_resample(np_img,
                                                 #res=self.tile_size,
@@ -535,11 +551,13 @@ class SegmentAnythingProcessorInvocation(ImageProcessorInvocation, PILInvocation
     type: Literal["segment_anything_processor"] = "segment_anything_processor"
     # fmt: on
 
-    def run_processor(self, image):
+    def run_processor(self, image, context: InvocationContext):
         # segment_anything_processor = SamDetector.from_pretrained("ybelkada/segment-anything", subfolder="checkpoints")
-        segment_anything_processor = SamDetectorReproducibleColors.from_pretrained("ybelkada/segment-anything", subfolder="checkpoints")
-        np_img = np.array(image, dtype=np.uint8)
-        processed_image = segment_anything_processor(np_img)
+        # SamDetector cannot be moved to another device
+        with load_annotator(context, SamDetectorReproducibleColors, "ybelkada/segment-anything",
+                            gpu_load=False, subfolder="checkpoints") as segment_anything_processor:
+            np_img = np.array(image, dtype=np.uint8)
+            processed_image = segment_anything_processor(np_img)
         return processed_image
 
 class SamDetectorReproducibleColors(SamDetector):
@@ -187,7 +187,7 @@ class InpaintInvocation(BaseInvocation):
 
             yield OldModelInfo(
                 name=self.unet.unet.model_name,
-                hash="<NO-HASH>",
+                hash=unet_info.hash,
                 model=pipeline,
             )
 
@@ -9,7 +9,7 @@ from diffusers.image_processor import VaeImageProcessor
 from diffusers.schedulers import SchedulerMixin as Scheduler
 from pydantic import BaseModel, Field, validator
 
-from invokeai.app.invocations.metadata import CoreMetadata
+from invokeai.app.invocations.metadata import CoreMetadata, add_model_hashes
 from invokeai.app.util.step_callback import stable_diffusion_step_callback
 
 from ...backend.model_management.lora import ModelPatcher
@@ -497,7 +497,7 @@ class LatentsToImageInvocation(BaseInvocation):
             node_id=self.id,
             session_id=context.graph_execution_state_id,
             is_intermediate=self.is_intermediate,
-            metadata=self.metadata.dict() if self.metadata else None,
+            metadata=add_model_hashes(self.metadata, context).dict() if self.metadata else None,
         )
 
         return ImageOutput(
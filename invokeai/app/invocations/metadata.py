@@ -8,12 +8,14 @@ from invokeai.app.invocations.baseinvocation import (BaseInvocation,
 from invokeai.app.invocations.controlnet_image_processors import ControlField
 from invokeai.app.invocations.model import (LoRAModelField, MainModelField,
                                             VAEModelField)
+from invokeai.backend.model_management import ModelType
 
 
 class LoRAMetadataField(BaseModel):
     """LoRA metadata for an image generated in InvokeAI."""
     lora: LoRAModelField = Field(description="The LoRA model")
     weight: float = Field(description="The weight of the LoRA model")
+    hash: Optional[str] = Field(default=None, description="The SHA256 hash of the LoRA model")
 
 
 class CoreMetadata(BaseModel):
@@ -44,6 +46,33 @@ class CoreMetadata(BaseModel):
         default=None,
         description="The VAE used for decoding, if the main model's default was not used",
     )
+    model_hash: Optional[str] = Field(default=None, description="The SHA256 hash of the main model")
+    vae_hash: Optional[str] = Field(default=None, description="The SHA256 hash of the VAE")
+
+
+def add_model_hashes(metadata: CoreMetadata, context: InvocationContext) -> CoreMetadata:
+    """Gets a copy of some metadata with the hashes of its models, which identify them across installs"""
+    model_manager = context.services.model_manager
+
+    def get_hash(model_name: str, base_model, model_type: ModelType) -> Optional[str]:
+        try:
+            return model_manager.get_model_hash(model_name, base_model, model_type)
+        except Exception as e:
+            context.services.logger.warning(f"Could not hash model {model_name}: {e}")
+            return None
+
+    update = dict()
+    if metadata.model_hash is None:
+        update["model_hash"] = get_hash(metadata.model.model_name, metadata.model.base_model, ModelType.Main)
+    if metadata.vae is not None and metadata.vae_hash is None:
+        update["vae_hash"] = get_hash(metadata.vae.model_name, metadata.vae.base_model, ModelType.Vae)
+    update["loras"] = [
+        lora if lora.hash is not None else lora.copy(
+            update=dict(hash=get_hash(lora.lora.model_name, lora.lora.base_model, ModelType.Lora))
+        )
+        for lora in metadata.loras
+    ]
+    return metadata.copy(update=update)
 
 
 class ImageMetadata(BaseModel):
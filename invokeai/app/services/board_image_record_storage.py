@@ -4,6 +4,7 @@ import threading
 from typing import Optional, cast
 
 from invokeai.app.services.image_record_storage import OffsetPaginatedResults
+from invokeai.app.services.sqlite import SqliteDatabase, get_database
 from invokeai.app.services.models.image_record import (
     ImageRecord,
     deserialize_image_record,
@@ -58,18 +59,18 @@ class BoardImageRecordStorageBase(ABC):
 
 class SqliteBoardImageRecordStorage(BoardImageRecordStorageBase):
     _filename: str
+    _db: SqliteDatabase
     _conn: sqlite3.Connection
     _cursor: sqlite3.Cursor
-    _lock: threading.Lock
+    _lock: threading.RLock
 
     def __init__(self, filename: str) -> None:
         super().__init__()
         self._filename = filename
-        self._conn = sqlite3.connect(filename, check_same_thread=False)
-        # Enable row factory to get rows as dictionaries (must be done before making the cursor!)
-        self._conn.row_factory = sqlite3.Row
+        self._db = get_database(filename)
+        self._conn = self._db.conn
         self._cursor = self._conn.cursor()
-        self._lock = threading.Lock()
+        self._lock = self._db.lock
 
         try:
             self._lock.acquire()
@@ -181,32 +182,29 @@ class SqliteBoardImageRecordStorage(BoardImageRecordStorageBase):
     ) -> OffsetPaginatedResults[ImageRecord]:
         # TODO: this isn't paginated yet?
         try:
-            self._lock.acquire()
-            self._cursor.execute(
-                """--sql
-                SELECT images.*
-                FROM board_images
-                INNER JOIN images ON board_images.image_name = images.image_name
-                WHERE board_images.board_id = ?
-                ORDER BY board_images.updated_at DESC;
-                """,
-                (board_id,),
-            )
-            result = cast(list[sqlite3.Row], self._cursor.fetchall())
-            images = list(map(lambda r: deserialize_image_record(dict(r)), result))
-
-            self._cursor.execute(
-                """--sql
-                SELECT COUNT(*) FROM images WHERE 1=1;
-                """
-            )
-            count = cast(int, self._cursor.fetchone()[0])
+            with self._db.reader() as cursor:
+                cursor.execute(
+                    """--sql
+                    SELECT images.*
+                    FROM board_images
+                    INNER JOIN images ON board_images.image_name = images.image_name
+                    WHERE board_images.board_id = ?
+                    ORDER BY board_images.updated_at DESC;
+                    """,
+                    (board_id,),
+                )
+                result = cast(list[sqlite3.Row], cursor.fetchall())
+                images = list(map(lambda r: deserialize_image_record(dict(r)), result))
+
+                cursor.execute(
+                    """--sql
+                    SELECT COUNT(*) FROM images WHERE 1=1;
+                    """
+                )
+                count = cast(int, cursor.fetchone()[0])
 
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise e
-        finally:
-            self._lock.release()
         return OffsetPaginatedResults(
             items=images, offset=offset, limit=limit, total=count
         )
@@ -216,38 +214,32 @@ class SqliteBoardImageRecordStorage(BoardImageRecordStorageBase):
         image_name: str,
     ) -> Optional[str]:
         try:
-            self._lock.acquire()
-            self._cursor.execute(
-                """--sql
-                SELECT board_id
-                FROM board_images
-                WHERE image_name = ?;
-                """,
-                (image_name,),
-            )
-            result = self._cursor.fetchone()
-            if result is None:
-                return None
-            return cast(str, result[0])
+            with self._db.reader() as cursor:
+                cursor.execute(
+                    """--sql
+                    SELECT board_id
+                    FROM board_images
+                    WHERE image_name = ?;
+                    """,
+                    (image_name,),
+                )
+                result = cursor.fetchone()
+                if result is None:
+                    return None
+                return cast(str, result[0])
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise e
-        finally:
-            self._lock.release()
 
     def get_image_count_for_board(self, board_id: str) -> int:
         try:
-            self._lock.acquire()
-            self._cursor.execute(
-                """--sql
-                SELECT COUNT(*) FROM board_images WHERE board_id = ?;
-                """,
-                (board_id,),
-            )
-            count = cast(int, self._cursor.fetchone()[0])
-            return count
+            with self._db.reader() as cursor:
+                cursor.execute(
+                    """--sql
+                    SELECT COUNT(*) FROM board_images WHERE board_id = ?;
+                    """,
+                    (board_id,),
+                )
+                count = cast(int, cursor.fetchone()[0])
+                return count
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise e
-        finally:
-            self._lock.release()
@@ -5,6 +5,7 @@ import threading
 from typing import Optional, Union
 import uuid
 from invokeai.app.services.image_record_storage import OffsetPaginatedResults
+from invokeai.app.services.sqlite import SqliteDatabase, get_database
 from invokeai.app.services.models.board_record import (
     BoardRecord,
     deserialize_board_record,
@@ -93,18 +94,18 @@ class BoardRecordStorageBase(ABC):
 
 class SqliteBoardRecordStorage(BoardRecordStorageBase):
     _filename: str
+    _db: SqliteDatabase
     _conn: sqlite3.Connection
     _cursor: sqlite3.Cursor
-    _lock: threading.Lock
+    _lock: threading.RLock
 
     def __init__(self, filename: str) -> None:
         super().__init__()
         self._filename = filename
-        self._conn = sqlite3.connect(filename, check_same_thread=False)
-        # Enable row factory to get rows as dictionaries (must be done before making the cursor!)
-        self._conn.row_factory = sqlite3.Row
+        self._db = get_database(filename)
+        self._conn = self._db.conn
         self._cursor = self._conn.cursor()
-        self._lock = threading.Lock()
+        self._lock = self._db.lock
 
         try:
             self._lock.acquire()
@@ -201,22 +202,19 @@ class SqliteBoardRecordStorage(BoardRecordStorageBase):
         board_id: str,
     ) -> BoardRecord:
         try:
-            self._lock.acquire()
-            self._cursor.execute(
-                """--sql
-                SELECT *
-                FROM boards
-                WHERE board_id = ?;
-                """,
-                (board_id,),
-            )
+            with self._db.reader() as cursor:
+                cursor.execute(
+                    """--sql
+                    SELECT *
+                    FROM boards
+                    WHERE board_id = ?;
+                    """,
+                    (board_id,),
+                )
 
-            result = cast(Union[sqlite3.Row, None], self._cursor.fetchone())
+                result = cast(Union[sqlite3.Row, None], cursor.fetchone())
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise BoardRecordNotFoundException from e
-        finally:
-            self._lock.release()
         if result is None:
             raise BoardRecordNotFoundException
         return BoardRecord(**dict(result))
@@ -265,65 +263,57 @@ class SqliteBoardRecordStorage(BoardRecordStorageBase):
         limit: int = 10,
     ) -> OffsetPaginatedResults[BoardRecord]:
         try:
-            self._lock.acquire()
-
-            # Get all the boards
-            self._cursor.execute(
-                """--sql
-                SELECT *
-                FROM boards
-                ORDER BY created_at DESC
-                LIMIT ? OFFSET ?;
-                """,
-                (limit, offset),
-            )
+            with self._db.reader() as cursor:
+                # Get all the boards
+                cursor.execute(
+                    """--sql
+                    SELECT *
+                    FROM boards
+                    ORDER BY created_at DESC
+                    LIMIT ? OFFSET ?;
+                    """,
+                    (limit, offset),
+                )
 
-            result = cast(list[sqlite3.Row], self._cursor.fetchall())
-            boards = list(map(lambda r: deserialize_board_record(dict(r)), result))
+                result = cast(list[sqlite3.Row], cursor.fetchall())
+                boards = list(map(lambda r: deserialize_board_record(dict(r)), result))
 
-            # Get the total number of boards
-            self._cursor.execute(
-                """--sql
-                SELECT COUNT(*)
-                FROM boards
-                WHERE 1=1;
-                """
-            )
+                # Get the total number of boards
+                cursor.execute(
+                    """--sql
+                    SELECT COUNT(*)
+                    FROM boards
+                    WHERE 1=1;
+                    """
+                )
 
-            count = cast(int, self._cursor.fetchone()[0])
+                count = cast(int, cursor.fetchone()[0])
 
-            return OffsetPaginatedResults[BoardRecord](
-                items=boards, offset=offset, limit=limit, total=count
-            )
+                return OffsetPaginatedResults[BoardRecord](
+                    items=boards, offset=offset, limit=limit, total=count
+                )
 
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise e
-        finally:
-            self._lock.release()
 
     def get_all(
         self,
     ) -> list[BoardRecord]:
         try:
-            self._lock.acquire()
-
-            # Get all the boards
-            self._cursor.execute(
-                """--sql
-                SELECT *
-                FROM boards
-                ORDER BY created_at DESC
-                """
-            )
+            with self._db.reader() as cursor:
+                # Get all the boards
+                cursor.execute(
+                    """--sql
+                    SELECT *
+                    FROM boards
+                    ORDER BY created_at DESC
+                    """
+                )
 
-            result = cast(list[sqlite3.Row], self._cursor.fetchall())
-            boards = list(map(lambda r: deserialize_board_record(dict(r)), result))
+                result = cast(list[sqlite3.Row], cursor.fetchall())
+                boards = list(map(lambda r: deserialize_board_record(dict(r)), result))
 
-            return boards
+                return boards
 
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise e
-        finally:
-            self._lock.release()
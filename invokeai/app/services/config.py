@@ -25,8 +25,24 @@ InvokeAI:
     precision: float16
     max_cache_size: 6
     max_vram_cache_size: 2.7
+    model_cache_policy: lrfu
+    prefetch_models: true
+    eager_model_conversion: true
+    mmap_models: true
     always_use_cpu: false
     free_gpu_mem: false
+    worker_devices: []
+    max_queue_size: 0
+    db_synchronous: NORMAL
+    db_cache_size: 2.0
+    latents_cache_size: 0.5
+    sweep_intermediates: true
+    intermediates_sweep_delay: 60.0
+    intermediates_ttl: 86400.0
+    invocation_cache_size: 0
+    invocation_cache_types: []
+    progress_image_interval: 1
+    progress_image_max_rate: 4.0
   Features:
     nsfw_checker: true
     restore: true
@@ -368,11 +384,27 @@ setting environment variables INVOKEAI_<setting>.
     max_loaded_models   : int = Field(default=3, gt=0, description="(DEPRECATED: use max_cache_size) Maximum number of models to keep in memory for rapid switching", category='DEPRECATED')
     max_cache_size      : float = Field(default=6.0, gt=0, description="Maximum memory amount used by model cache for rapid switching", category='Memory/Performance')
     max_vram_cache_size : float = Field(default=2.75, ge=0, description="Amount of VRAM reserved for model storage", category='Memory/Performance')
+    model_cache_policy  : Literal[tuple(['lru','lfu','lrfu'])] = Field(default='lrfu', description='Which models leave the RAM and VRAM caches first: the least recently used ("lru"), the least frequently used ("lfu"), or a mix of both ("lrfu")', category='Memory/Performance')
+    prefetch_models     : bool = Field(default=True, description="Load the models used by the next sessions in the queue into RAM in the background, without evicting models that were requested", category='Memory/Performance')
+    eager_model_conversion : bool = Field(default=True, description="Convert checkpoint models to diffusers in the background as soon as they are added, instead of on their first use", category='Memory/Performance')
+    mmap_models         : bool = Field(default=True, description="Map safetensors LoRA and embedding files into memory instead of copying them, so that their pages are shared with the OS file cache", category='Memory/Performance')
     gpu_mem_reserved    : float = Field(default=2.75, ge=0, description="DEPRECATED: use max_vram_cache_size. Amount of VRAM reserved for model storage", category='DEPRECATED')
     precision           : Literal[tuple(['auto','float16','float32','autocast'])] = Field(default='float16',description='Floating point precision', category='Memory/Performance')
     sequential_guidance : bool = Field(default=False, description="Whether to calculate guidance in serial instead of in parallel, lowering memory requirements", category='Memory/Performance')
     xformers_enabled    : bool = Field(default=True, description="Enable/disable memory-efficient attention", category='Memory/Performance')
     tiled_decode        : bool = Field(default=False, description="Whether to enable tiled VAE decode (reduces memory consumption with some performance penalty)", category='Memory/Performance')
+    worker_devices      : List[str] = Field(default=[], description='Run one invocation worker per listed device (e.g. "cpu cuda:0"). At most one GPU may be listed. Workers on "cpu" only run cpu-only invocations. Leave empty for a single worker on the default device', category='Memory/Performance')
+    max_queue_size      : int = Field(default=0, ge=0, description='Maximum number of queued invocations before new sessions are refused. Use 0 for no limit', category='Memory/Performance')
+    db_synchronous      : Literal[tuple(['OFF','NORMAL','FULL','EXTRA'])] = Field(default='NORMAL', description='SQLite "synchronous" setting of the databases. NORMAL is safe with the write-ahead log and avoids a disk sync per commit', category='Memory/Performance')
+    db_cache_size       : float = Field(default=2.0, gt=0, description='SQLite page cache size of each database connection, in MB', category='Memory/Performance')
+    latents_cache_size  : float = Field(default=0.5, gt=0, description='Maximum memory used to keep latents and conditioning passed between nodes, in GB. Least recently used latents are moved to disk beyond this', category='Memory/Performance')
+    sweep_intermediates : bool = Field(default=True, description='Delete the latents of sessions, and the intermediate images their nodes only passed to each other, once they complete', category='Memory/Performance')
+    intermediates_sweep_delay : float = Field(default=60.0, ge=0, description='Seconds to wait after a session completes before deleting its intermediates', category='Memory/Performance')
+    intermediates_ttl   : float = Field(default=86400.0, gt=0, description='Delete latents, and intermediate images only passed between nodes, older than this many seconds, even if their session never completed', category='Memory/Performance')
+    invocation_cache_size : int = Field(default=0, ge=0, description='Number of node outputs kept to be reused when a node runs again with the same inputs, e.g. when a session is run again with one parameter changed. Use 0 to disable', category='Memory/Performance')
+    invocation_cache_types : List[str] = Field(default=[], description='Types of the nodes whose outputs are reused (e.g. "compel noise"). Leave empty for the built-in nodes whose outputs only depend on their inputs', category='Memory/Performance')
+    progress_image_interval : int = Field(default=1, ge=0, description='Number of denoising steps between two progress images sent to the web UI. Use 0 to send none', category='Memory/Performance')
+    progress_image_max_rate : float = Field(default=4.0, ge=0, description='Maximum number of progress images sent per second for each node. Use 0 for no limit', category='Memory/Performance')
 
     root                : Path = Field(default=_find_root(), description='InvokeAI runtime root directory', category='Paths')
     autoimport_dir      : Path = Field(default='autoimport/main', description='Path to a directory of models files to be imported on startup.', category='Paths')
@@ -385,6 +417,7 @@ setting environment variables INVOKEAI_<setting>.
     db_dir              : Path = Field(default='databases', description='Path to InvokeAI databases directory', category='Paths')
     outdir              : Path = Field(default='outputs', description='Default folder for output images', category='Paths')
     from_file           : Path = Field(default=None, description='Take command input from the indicated file (command-line client only)', category='Paths')
+    model_cache_trace   : Path = Field(default=None, description='Record each model request to this file, to replay with scripts/simulate_model_cache.py', category='Paths')
     use_memory_db       : bool = Field(default=False, description='Use in-memory database for storing image metadata', category='Paths')
 
     model               : str = Field(default='stable-diffusion-1.5', description='Initial model name', category='Models')
@@ -504,6 +537,13 @@ setting environment variables INVOKEAI_<setting>.
         '''
         return self._resolve(self.autoconvert_dir) if self.autoconvert_dir else None
 
+    @property
+    def model_cache_trace_path(self)->Path:
+        '''
+        Path to the file recording the model requests, if any.
+        '''
+        return self._resolve(self.model_cache_trace) if self.model_cache_trace else None
+
     # the following methods support legacy calls leftover from the Globals era
     @property
     def full_precision(self)->bool:
@@ -7,12 +7,17 @@ from invokeai.app.services.model_manager_service import BaseModelType, ModelType
 
 class EventServiceBase:
     session_event: str = "session_event"
+    model_event: str = "model_event"
 
     """Basic event bus, to have an empty stand-in when not needed"""
 
     def dispatch(self, event_name: str, payload: Any) -> None:
         pass
 
+    def has_session_subscribers(self, graph_execution_state_id: str) -> bool:
+        """Whether some client listens to the events of a session, e.g. to show its progress images"""
+        return False
+
     def __emit_session_event(self, event_name: str, payload: dict) -> None:
         payload["timestamp"] = get_timestamp()
         self.dispatch(
@@ -20,6 +25,13 @@ class EventServiceBase:
             payload=dict(event=event_name, data=payload),
         )
 
+    def __emit_model_event(self, event_name: str, payload: dict) -> None:
+        payload["timestamp"] = get_timestamp()
+        self.dispatch(
+            event_name=EventServiceBase.model_event,
+            payload=dict(event=event_name, data=payload),
+        )
+
     # Define events here for every event in the system.
     # This will make them easier to integrate until we find a schema generator.
     def emit_generator_progress(
@@ -151,3 +163,42 @@ class EventServiceBase:
                 model_info=model_info,
             ),
         )
+
+    def emit_model_conversion_started(self, model_name: str) -> None:
+        """Emitted when a checkpoint model starts being converted to diffusers"""
+        self.__emit_model_event(
+            event_name="model_conversion_started",
+            payload=dict(
+                model_name=model_name,
+            ),
+        )
+
+    def emit_model_conversion_progress(self, model_name: str, elapsed: float) -> None:
+        """Emitted periodically while a model is being converted"""
+        self.__emit_model_event(
+            event_name="model_conversion_progress",
+            payload=dict(
+                model_name=model_name,
+                elapsed=elapsed,
+            ),
+        )
+
+    def emit_model_conversion_completed(self, model_name: str, elapsed: float) -> None:
+        """Emitted when a model was converted"""
+        self.__emit_model_event(
+            event_name="model_conversion_completed",
+            payload=dict(
+                model_name=model_name,
+                elapsed=elapsed,
+            ),
+        )
+
+    def emit_model_conversion_error(self, model_name: str, error: str) -> None:
+        """Emitted when a model could not be converted"""
+        self.__emit_model_event(
+            event_name="model_conversion_error",
+            payload=dict(
+                model_name=model_name,
+                error=error,
+            ),
+        )
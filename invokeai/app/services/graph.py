@@ -1,8 +1,10 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
 import copy
+import heapq
 import itertools
 import uuid
+from enum import Enum
 from typing import (
     Annotated,
     Any,
@@ -15,7 +17,7 @@ from typing import (
 )
 
 import networkx as nx
-from pydantic import BaseModel, root_validator, validator
+from pydantic import BaseModel, PrivateAttr, root_validator, validator
 from pydantic.fields import Field
 
 from ..invocations import *
@@ -785,6 +787,148 @@ class Graph(BaseModel):
         return g
 
 
+# Field values of these types can be shared between a node and its prepared copies
+_IMMUTABLE_FIELD_TYPES = (str, int, float, bool, bytes, NoneType, Enum)
+
+
+def _copy_node(node: BaseInvocation, node_id: str) -> BaseInvocation:
+    """Copies a node with a new id, without validation. Immutable field values are shared
+    with the original node, and only mutable values (lists, models...) are deep copied."""
+    values = {
+        k: v if isinstance(v, _IMMUTABLE_FIELD_TYPES) else copy.deepcopy(v)
+        for k, v in node.__dict__.items()
+    }
+    values["id"] = node_id
+    return node.__class__.construct(_fields_set=set(node.__fields_set__) | {"id"}, **values)
+
+
+class _SourceGraphIndex:
+    """Structural information about the source graph of an execution, computed once.
+
+    The source graph can only be changed in ways that do not affect prepared nodes,
+    so this is rebuilt only when the graph is modified.
+    """
+
+    def __init__(self, graph: Graph):
+        self.signature = (len(graph.nodes), len(graph.edges))
+        self.nx_graph = graph.nx_graph_flat()
+        self.parents = {n: list(self.nx_graph.predecessors(n)) for n in self.nx_graph.nodes}
+
+        order = list(nx.topological_sort(self.nx_graph))
+        nodes = {n: graph.get_node(n) for n in order}
+        self.iterators = set(n for n in order if isinstance(nodes[n], IterateInvocation))
+
+        # Iterators upstream of each node, both through any path and through paths that
+        # do not pass through a collector (the iterators that are active for a node)
+        self.iterator_ancestors: dict[str, set[str]] = dict()
+        self.active_iterators: dict[str, set[str]] = dict()
+        for n in order:
+            ancestors = set()
+            active = set()
+            for p in self.parents[n]:
+                parent_iterators = self.iterator_ancestors[p] | ({p} if p in self.iterators else set())
+                ancestors |= parent_iterators
+                if not isinstance(nodes[n], CollectInvocation):
+                    active |= self.active_iterators[p] | ({p} if p in self.iterators else set())
+            self.iterator_ancestors[n] = ancestors
+            self.active_iterators[n] = active
+
+        # Nodes that have not been prepared yet, in topological order
+        self.unprepared = dict.fromkeys(order)
+
+    def is_current(self, graph: Graph) -> bool:
+        return self.signature == (len(graph.nodes), len(graph.edges))
+
+
+class _ExecutionGraphIndex:
+    """Tracks which prepared nodes are ready to execute.
+
+    Each prepared node keeps a count of its unexecuted inputs, which is updated as
+    nodes are completed. Ready nodes are kept in a heap ordered so that the nodes
+    made ready by the most recent completion are executed first, which results in
+    a depth-first execution of the graph.
+    """
+
+    def __init__(self, state: "GraphExecutionState"):
+        self.input_edges: dict[str, list[Edge]] = dict()
+        self.children: dict[str, set[str]] = dict()
+        self.pending: dict[str, int] = dict()
+        self.unexecuted: dict[str, int] = dict()
+        self.iterator_ancestors: dict[str, set[str]] = dict()
+        self.iteration_descendants: dict[str, dict[str, list[str]]] = dict()
+        self.ready: list[tuple[int, int, str]] = list()
+        self.generation = 0
+        self.sequence = 0
+
+        input_edges = dict((n, list()) for n in state.execution_graph.nodes)
+        for e in state.execution_graph.edges:
+            input_edges[e.destination.node_id].append(e)
+
+        g = state.execution_graph.nx_graph()
+        for n in nx.topological_sort(g):
+            self.add_node(state, n, input_edges[n], ready=False)
+
+        # Depth-first search with pre-order traversal is a depth-first topological sort
+        for n in nx.dfs_preorder_nodes(g):
+            if self.pending[n] == 0 and n not in state.executed:
+                self._push(n)
+
+    def _push(self, node_id: str) -> None:
+        heapq.heappush(self.ready, (-self.generation, self.sequence, node_id))
+        self.sequence += 1
+
+    def add_node(self, state: "GraphExecutionState", node_id: str, input_edges: list[Edge], ready: bool = True) -> None:
+        parents = set(e.source.node_id for e in input_edges)
+        self.input_edges[node_id] = input_edges
+        self.children[node_id] = set()
+        self.pending[node_id] = sum(1 for p in parents if p not in state.executed)
+
+        source_node = state.prepared_source_mapping[node_id]
+        self.unexecuted.setdefault(source_node, 0)
+        if node_id not in state.executed:
+            self.unexecuted[source_node] += 1
+
+        ancestors = set()
+        for p in parents:
+            self.children[p].add(node_id)
+            ancestors |= self.iterator_ancestors[p]
+            if isinstance(state.execution_graph.nodes[p], IterateInvocation):
+                ancestors.add(p)
+        self.iterator_ancestors[node_id] = ancestors
+        for iterator in ancestors:
+            self.iteration_descendants.setdefault(iterator, dict()).setdefault(source_node, list()).append(node_id)
+
+        if ready and self.pending[node_id] == 0:
+            self._push(node_id)
+
+    def complete(self, state: "GraphExecutionState", node_id: str) -> None:
+        self.unexecuted[state.prepared_source_mapping[node_id]] -= 1
+
+        self.generation += 1
+        for child in self.children.get(node_id, ()):
+            self.pending[child] -= 1
+            if self.pending[child] == 0:
+                self._push(child)
+
+    def peek(self, state: "GraphExecutionState") -> Optional[str]:
+        """Gets the first ready node, discarding stale entries"""
+        # Drop nodes that have been handed out or executed since they became ready
+        while self.ready and (
+            self.ready[0][2] in state.executed or self.ready[0][2] in state.executing
+        ):
+            heapq.heappop(self.ready)
+
+        return self.ready[0][2] if self.ready else None
+
+    def all_ready(self, state: "GraphExecutionState") -> list[str]:
+        """Gets all ready nodes in execution order"""
+        return [
+            n
+            for _, _, n in sorted(self.ready)
+            if n not in state.executed and n not in state.executing
+        ]
+
+
 class GraphExecutionState(BaseModel):
     """Tracks the state of a graph execution"""
 
@@ -808,6 +952,11 @@ class GraphExecutionState(BaseModel):
         default_factory=list,
     )
 
+    # Nodes that have been handed out for execution but not yet completed
+    executing: set[str] = Field(
+        description="The set of prepared node ids that are currently executing", default_factory=set
+    )
+
     # The results of executed nodes
     results: dict[
         str, Annotated[InvocationOutputsUnion, Field(discriminator="type")]
@@ -830,6 +979,10 @@ class GraphExecutionState(BaseModel):
         default_factory=dict,
     )
 
+    # Indexes derived from the graphs, rebuilt on demand (they are not serialized)
+    _source_index: Optional[_SourceGraphIndex] = PrivateAttr(default=None)
+    _execution_index: Optional[_ExecutionGraphIndex] = PrivateAttr(default=None)
+
     class Config:
         schema_extra = {
             'required': [
@@ -838,6 +991,7 @@ class GraphExecutionState(BaseModel):
                 'execution_graph',
                 'executed',
                 'executed_history',
+                'executing',
                 'results',
                 'errors',
                 'prepared_source_mapping',
@@ -846,10 +1000,7 @@ class GraphExecutionState(BaseModel):
         }
 
     def next(self) -> Optional[BaseInvocation]:
-        """Gets the next node ready to execute."""
-
-        # TODO: enable multiple nodes to execute simultaneously by tracking currently executing nodes
-        #       possibly with a timeout?
+        """Gets the next node ready to execute and marks it as executing."""
 
         # If there are no prepared nodes, prepare some nodes
         next_node = self._get_next_node()
@@ -864,41 +1015,74 @@ class GraphExecutionState(BaseModel):
         # Get values from edges
         if next_node is not None:
             self._prepare_inputs(next_node)
+            self.executing.add(next_node.id)
 
         # If next is still none, there's no next node, return None
         return next_node
 
+    def next_ready(self) -> list[BaseInvocation]:
+        """Gets all nodes that are ready to execute and marks them as executing.
+        Nodes returned by this call do not depend on each other and may be executed concurrently."""
+
+        # Prepare as many nodes as we can
+        while self._prepare() is not None:
+            pass
+
+        ready_nodes = self._get_ready_nodes()
+        for node in ready_nodes:
+            self._prepare_inputs(node)
+            self.executing.add(node.id)
+
+        return ready_nodes
+
     def complete(self, node_id: str, output: InvocationOutputsUnion):
         """Marks a node as complete"""
 
         if node_id not in self.execution_graph.nodes:
             return  # TODO: log error?
 
+        index = self._get_execution_index()
+        if node_id in self.executed:
+            self.results[node_id] = output
+            return
+
         # Mark node as executed
+        self.executing.discard(node_id)
         self.executed.add(node_id)
         self.results[node_id] = output
+        index.complete(self, node_id)
 
         # Check if source node is complete (all prepared nodes are complete)
         source_node = self.prepared_source_mapping[node_id]
-        prepared_nodes = self.source_prepared_mapping[source_node]
 
-        if all([n in self.executed for n in prepared_nodes]):
+        if index.unexecuted[source_node] == 0:
             self.executed.add(source_node)
             self.executed_history.append(source_node)
 
     def set_node_error(self, node_id: str, error: str):
         """Marks a node as errored"""
+        self.executing.discard(node_id)
         self.errors[node_id] = error
 
     def is_complete(self) -> bool:
         """Returns true if the graph is complete"""
-        node_ids = set(self.graph.nx_graph_flat().nodes)
+        node_ids = self._get_source_index().nx_graph.nodes
         return self.has_error() or all((k in self.executed for k in node_ids))
 
     def has_error(self) -> bool:
         """Returns true if the graph has any errors"""
         return len(self.errors) > 0
 
+    def _get_source_index(self) -> _SourceGraphIndex:
+        if self._source_index is None or not self._source_index.is_current(self.graph):
+            self._source_index = _SourceGraphIndex(self.graph)
+        return self._source_index
+
+    def _get_execution_index(self) -> _ExecutionGraphIndex:
+        if self._execution_index is None:
+            self._execution_index = _ExecutionGraphIndex(self)
+        return self._execution_index
+
     def _create_execution_node(
         self, node_path: str, iteration_node_map: list[tuple[str, str]]
     ) -> list[str]:
@@ -906,6 +1090,11 @@ class GraphExecutionState(BaseModel):
 
         node = self.graph.get_node(node_path)
 
+        # Index the prepared nodes by source node
+        prepared_input_nodes: dict[str, list[str]] = dict()
+        for source_node_id, prepared_node_id in iteration_node_map:
+            prepared_input_nodes.setdefault(source_node_id, list()).append(prepared_node_id)
+
         self_iteration_count = -1
 
         # If this is an iterator node, we must create a copy for each iteration
@@ -914,11 +1103,9 @@ class GraphExecutionState(BaseModel):
             input_collection_edge = next(
                 iter(self.graph._get_input_edges(node_path, "collection"))
             )
-            input_collection_prepared_node_id = next(
-                n[1]
-                for n in iteration_node_map
-                if n[0] == input_collection_edge.source.node_id
-            )
+            input_collection_prepared_node_id = prepared_input_nodes[
+                input_collection_edge.source.node_id
+            ][0]
             input_collection_prepared_node_output = self.results[
                 input_collection_prepared_node_id
             ]
@@ -939,9 +1126,7 @@ class GraphExecutionState(BaseModel):
         # For collect nodes, this may contain multiple inputs to the same field
         new_edges = list()
         for edge in input_edges:
-            for input_node_id in (
-                n[1] for n in iteration_node_map if n[0] == edge.source.node_id
-            ):
+            for input_node_id in prepared_input_nodes.get(edge.source.node_id, []):
                 new_edge = Edge(
                     source=EdgeConnection(node_id=input_node_id, field=edge.source.field),
                     destination=EdgeConnection(node_id="", field=edge.destination.field),
@@ -950,11 +1135,8 @@ class GraphExecutionState(BaseModel):
 
         # Create a new node (or one for each iteration of this iterator)
         for i in range(self_iteration_count) if self_iteration_count > 0 else [-1]:
-            # Create a new node
-            new_node = copy.deepcopy(node)
-
-            # Create the node id (use a random uuid)
-            new_node.id = str(uuid.uuid4())
+            # Create a new node (use a random uuid for the id)
+            new_node = _copy_node(node, str(uuid.uuid4()))
 
             # Set the iteration index for iteration invocations
             if isinstance(new_node, IterateInvocation):
@@ -968,76 +1150,63 @@ class GraphExecutionState(BaseModel):
             self.source_prepared_mapping[node_path].add(new_node.id)
 
             # Add new edges to execution graph
-            for edge in new_edges:
-                new_edge = Edge(
+            # These mirror edges of the source graph, which have already been validated
+            new_node_edges = [
+                Edge.construct(
                     source=edge.source,
-                    destination=EdgeConnection(node_id=new_node.id, field=edge.destination.field),
+                    destination=EdgeConnection.construct(node_id=new_node.id, field=edge.destination.field),
                 )
-                self.execution_graph.add_edge(new_edge)
+                for edge in new_edges
+            ]
+            self.execution_graph.edges.extend(new_node_edges)
+
+            if self._execution_index is not None:
+                self._execution_index.add_node(self, new_node.id, new_node_edges)
 
             new_nodes.append(new_node.id)
 
         return new_nodes
 
-    def _iterator_graph(self) -> nx.DiGraph:
-        """Gets a DiGraph with edges to collectors removed so an ancestor search produces all active iterators for any node"""
-        g = self.graph.nx_graph_flat()
-        collectors = (
-            n
-            for n in self.graph.nodes
-            if isinstance(self.graph.get_node(n), CollectInvocation)
-        )
-        for c in collectors:
-            g.remove_edges_from(list(g.in_edges(c)))
-        return g
-
     def _get_node_iterators(self, node_id: str) -> list[str]:
         """Gets iterators for a node"""
-        g = self._iterator_graph()
-        iterators = [
-            n
-            for n in nx.ancestors(g, node_id)
-            if isinstance(self.graph.get_node(n), IterateInvocation)
-        ]
-        return iterators
+        return list(self._get_source_index().active_iterators[node_id])
 
     def _prepare(self) -> Optional[str]:
-        # Get flattened source graph
-        g = self.graph.nx_graph_flat()
+        index = self._get_source_index()
 
         # Find next node that:
         # - was not already prepared
         # - is not an iterate node whose inputs have not been executed
         # - does not have an unexecuted iterate ancestor
-        sorted_nodes = nx.topological_sort(g)
-        next_node_id = next(
-            (
-                n
-                for n in sorted_nodes
-                # exclude nodes that have already been prepared
-                if n not in self.source_prepared_mapping
-                # exclude iterate nodes whose inputs have not been executed
-                and not (
-                    isinstance(self.graph.get_node(n), IterateInvocation)  # `n` is an iterate node...
-                    and not all((e[0] in self.executed for e in g.in_edges(n)))  # ...that has unexecuted inputs
-                )
-                # exclude nodes who have unexecuted iterate ancestors
-                and not any(
-                    (
-                        isinstance(self.graph.get_node(a), IterateInvocation)  # `a` is an iterate ancestor of `n`...
-                        and a not in self.executed  # ...that is not executed
-                        for a in nx.ancestors(g, n)  # for all ancestors `a` of node `n`
-                    )
-                )
-            ),
-            None,
-        )
+        next_node_id = None
+        already_prepared = list()
+        for n in index.unprepared:
+            # exclude nodes that have already been prepared
+            if n in self.source_prepared_mapping:
+                already_prepared.append(n)
+                continue
+
+            # exclude iterate nodes whose inputs have not been executed
+            if n in index.iterators and not all((p in self.executed for p in index.parents[n])):
+                continue
+
+            # exclude nodes who have unexecuted iterate ancestors
+            if any((a not in self.executed for a in index.iterator_ancestors[n])):
+                continue
+
+            next_node_id = n
+            break
+
+        for n in already_prepared:
+            del index.unprepared[n]
 
         if next_node_id == None:
             return None
 
+        del index.unprepared[next_node_id]
+
         # Get all parents of the next node
-        next_node_parents = [e[0] for e in g.in_edges(next_node_id)]
+        next_node_parents = index.parents[next_node_id]
 
         # Create execution nodes
         next_node = self.graph.get_node(next_node_id)
@@ -1072,8 +1241,7 @@ class GraphExecutionState(BaseModel):
             # Select the correct prepared parents for each iteration
             # For every iterator, the parent must either not be a child of that iterator, or must match the prepared iteration for that iterator
             # TODO: Handle a node mapping to none
-            eg = self.execution_graph.nx_graph_flat()
-            prepared_parent_mappings = [[(n, self._get_iteration_node(n, g, eg, it)) for n in next_node_parents] for it in iterator_node_prepared_combinations]  # type: ignore
+            prepared_parent_mappings = [[(n, self._get_iteration_node(n, it)) for n in next_node_parents] for it in iterator_node_prepared_combinations]  # type: ignore
 
             # Create execution node for each iteration
             for iteration_mappings in prepared_parent_mappings:
@@ -1086,8 +1254,6 @@ class GraphExecutionState(BaseModel):
     def _get_iteration_node(
         self,
         source_node_path: str,
-        graph: nx.DiGraph,
-        execution_graph: nx.DiGraph,
         prepared_iterator_nodes: list[str],
     ) -> Optional[str]:
         """Gets the prepared version of the specified source node that matches every iteration specified"""
@@ -1097,27 +1263,34 @@ class GraphExecutionState(BaseModel):
 
         # Check if the requested node is an iterator
         prepared_iterator = next(
-            (n for n in prepared_nodes if n in prepared_iterator_nodes), None
+            (n for n in prepared_iterator_nodes if n in prepared_nodes), None
         )
         if prepared_iterator is not None:
             return prepared_iterator
 
-        # Filter to only iterator nodes that are a parent of the specified node, in tuple format (prepared, source)
-        iterator_source_node_mapping = [
-            (n, self.prepared_source_mapping[n]) for n in prepared_iterator_nodes
-        ]
+        # Filter to only iterator nodes that are a parent of the specified node
+        source_iterators = self._get_source_index().iterator_ancestors[source_node_path]
         parent_iterators = [
-            itn
-            for itn in iterator_source_node_mapping
-            if nx.has_path(graph, itn[1], source_node_path)
+            n
+            for n in prepared_iterator_nodes
+            if self.prepared_source_mapping[n] in source_iterators
         ]
 
+        if len(parent_iterators) == 0:
+            return next(iter(prepared_nodes))
+
+        # Only the prepared nodes downstream of every parent iterator can match
+        index = self._get_execution_index()
+        candidates = min(
+            (index.iteration_descendants.get(pit, {}).get(source_node_path, []) for pit in parent_iterators),
+            key=len,
+        )
         return next(
             (
                 n
-                for n in prepared_nodes
+                for n in candidates
                 if all(
-                    nx.has_path(execution_graph, pit[0], n)
+                    pit in index.iterator_ancestors[n]
                     for pit in parent_iterators
                 )
             ),
@@ -1126,28 +1299,19 @@ class GraphExecutionState(BaseModel):
 
     def _get_next_node(self) -> Optional[BaseInvocation]:
         """Gets the deepest node that is ready to be executed"""
-        g = self.execution_graph.nx_graph()
-
-        # Depth-first search with pre-order traversal is a depth-first topological sort
-        sorted_nodes = nx.dfs_preorder_nodes(g)
-        
-        next_node = next(
-            (
-                n
-                for n in sorted_nodes
-                if n not in self.executed # the node must not already be executed...
-                and all((e[0] in self.executed for e in g.in_edges(n))) # ...and all its inputs must be executed
-            ),
-            None,
-        )
+        next_node = self._get_execution_index().peek(self)
 
         if next_node is None:
             return None
 
         return self.execution_graph.nodes[next_node]
 
+    def _get_ready_nodes(self) -> list[BaseInvocation]:
+        """Gets all nodes that are ready to be executed"""
+        return [self.execution_graph.nodes[n] for n in self._get_execution_index().all_ready(self)]
+
     def _prepare_inputs(self, node: BaseInvocation):
-        input_edges = [e for e in self.execution_graph.edges if e.destination.node_id == node.id]
+        input_edges = self._get_execution_index().input_edges[node.id]
         if isinstance(node, CollectInvocation):
             output_collection = [
                 getattr(self.results[edge.source.node_id], edge.source.field)
@@ -1180,6 +1344,7 @@ class GraphExecutionState(BaseModel):
 
     def add_node(self, node: BaseInvocation) -> None:
         self.graph.add_node(node)
+        self._source_index = None
 
     def update_node(self, node_path: str, new_node: BaseInvocation) -> None:
         if not self._is_node_updatable(node_path):
@@ -1187,6 +1352,7 @@ class GraphExecutionState(BaseModel):
                 f"Node {node_path} has already been prepared or executed and cannot be updated"
             )
         self.graph.update_node(node_path, new_node)
+        self._source_index = None
 
     def delete_node(self, node_path: str) -> None:
         if not self._is_node_updatable(node_path):
@@ -1194,6 +1360,7 @@ class GraphExecutionState(BaseModel):
                 f"Node {node_path} has already been prepared or executed and cannot be deleted"
             )
         self.graph.delete_node(node_path)
+        self._source_index = None
 
     def add_edge(self, edge: Edge) -> None:
         if not self._is_node_updatable(edge.destination.node_id):
@@ -1201,6 +1368,7 @@ class GraphExecutionState(BaseModel):
                 f"Destination node {edge.destination.node_id} has already been prepared or executed and cannot be linked to"
             )
         self.graph.add_edge(edge)
+        self._source_index = None
 
     def delete_edge(self, edge: Edge) -> None:
         if not self._is_node_updatable(edge.destination.node_id):
@@ -1208,6 +1376,7 @@ class GraphExecutionState(BaseModel):
                 f"Destination node {edge.destination.node_id} has already been prepared or executed and cannot have a source edge deleted"
             )
         self.graph.delete_edge(edge)
+        self._source_index = None
 
 
 class ExposedNodeInput(BaseModel):
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import sqlite3
+from typing import Any, Optional
+
+from pydantic.json import pydantic_encoder
+
+from .graph import GraphExecutionState, GraphInvocation
+from .sqlite import SqliteItemStorage
+
+
+class _PersistedState:
+    """What has been written to the database for a graph execution state"""
+
+    graph_hash: str
+    nodes: set[str]
+    edge_count: int
+    executed: set[str]
+    history_length: int
+    results: set[str]
+    errors: set[str]
+    prepared: set[str]
+    executing: set[str]
+    snapshot_size: int
+    delta_size: int
+
+    def __init__(self, state: GraphExecutionState, graph_hash: str, snapshot_size: int):
+        self.graph_hash = graph_hash
+        self.nodes = set(state.execution_graph.nodes)
+        self.edge_count = len(state.execution_graph.edges)
+        self.executed = set(state.executed)
+        self.history_length = len(state.executed_history)
+        self.results = set(state.results)
+        self.errors = set(state.errors)
+        self.prepared = set(state.prepared_source_mapping)
+        self.executing = set(state.executing)
+        self.snapshot_size = snapshot_size
+        self.delta_size = 0
+
+
+def _hash_graph(state: GraphExecutionState) -> str:
+    return hashlib.sha1(state.graph.json().encode("utf-8")).hexdigest()
+
+
+def _get_search_text(state: GraphExecutionState) -> str:
+    """Gets the words sessions are searched by: the session id, and the type
+    and text inputs (e.g. prompts) of every node of the source graph"""
+    words = [state.id]
+    graphs = [state.graph]
+    while graphs:
+        graph = graphs.pop()
+        for node in graph.nodes.values():
+            words.extend(v for v in node.__dict__.values() if isinstance(v, str))
+            if isinstance(node, GraphInvocation) and node.graph is not None:
+                graphs.append(node.graph)
+    return " ".join(words)
+
+
+class SqliteGraphExecutionStateStorage(SqliteItemStorage[GraphExecutionState]):
+    """Stores graph execution states as a snapshot plus a log of deltas.
+
+    The processor saves the state after every invocation. Rewriting the whole
+    state each time makes a session cost O(n²) bytes written, so instead only
+    what changed since the last write is appended to a delta table: new and
+    touched execution nodes, new edges, results, errors and executed ids.
+    `get()` applies the deltas to the snapshot. Once the deltas of a state
+    outgrow its snapshot, they are folded into a new snapshot.
+
+    Changes that are not part of executing the graph (e.g. editing the source
+    graph) and the first write of a state in this process write a snapshot.
+
+    Sessions are searched by their id and the types and text inputs of their
+    source nodes, through a full-text index.
+    """
+
+    _deltas_table_name: str
+    _persisted: dict[str, _PersistedState]
+
+    def __init__(self, filename: str, table_name: str = "graph_executions"):
+        self._deltas_table_name = f"{table_name}_deltas"
+        self._persisted = dict()
+        super().__init__(filename, table_name, "id", search_text=_get_search_text)
+
+    def _create_table(self):
+        super()._create_table()
+        try:
+            self._lock.acquire()
+            self._cursor.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self._deltas_table_name} (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL,
+                delta TEXT NOT NULL);"""
+            )
+            self._cursor.execute(
+                f"""CREATE INDEX IF NOT EXISTS {self._deltas_table_name}_id ON {self._deltas_table_name}(id, seq);"""
+            )
+            self._conn.commit()
+        finally:
+            self._lock.release()
+
+    def _parse_item(self, item: str) -> GraphExecutionState:
+        return GraphExecutionState.parse_raw(item)
+
+    def set(self, item: GraphExecutionState):
+        graph_hash = _hash_graph(item)
+        try:
+            self._lock.acquire()
+            persisted = self._persisted.get(item.id)
+            delta = None
+            if persisted is not None and persisted.graph_hash == graph_hash:
+                delta = self._get_delta(item, persisted)
+
+            if delta is None or persisted.delta_size + len(delta) > persisted.snapshot_size:
+                self._write_snapshot(item, graph_hash)
+            elif delta:
+                self._cursor.execute(
+                    f"""INSERT INTO {self._deltas_table_name} (id, delta) VALUES (?, ?);""",
+                    (item.id, delta),
+                )
+                self._conn.commit()
+                snapshot_size, delta_size = persisted.snapshot_size, persisted.delta_size
+                persisted = _PersistedState(item, graph_hash, snapshot_size)
+                persisted.delta_size = delta_size + len(delta)
+                self._persisted[item.id] = persisted
+        finally:
+            self._lock.release()
+        self._on_changed(item)
+
+    def _write_snapshot(self, item: GraphExecutionState, graph_hash: str):
+        snapshot = item.json()
+        self._write_item(item, snapshot)
+        self._cursor.execute(
+            f"""DELETE FROM {self._deltas_table_name} WHERE id = ?;""", (item.id,)
+        )
+        self._conn.commit()
+        self._persisted[item.id] = _PersistedState(item, graph_hash, len(snapshot))
+
+    def _get_delta(self, item: GraphExecutionState, persisted: _PersistedState) -> Optional[str]:
+        """Gets the changes to a state since it was persisted, or None if they cannot be expressed as a delta"""
+        nodes = item.execution_graph.nodes
+        edges = item.execution_graph.edges
+        if (
+            len(edges) < persisted.edge_count
+            or len(item.executed_history) < persisted.history_length
+            or not persisted.nodes.issubset(nodes)
+            or not persisted.executed.issubset(item.executed)
+            or not persisted.results.issubset(item.results)
+            or not persisted.errors.issubset(item.errors)
+            or not persisted.prepared.issubset(item.prepared_source_mapping)
+        ):
+            return None
+
+        new_executed = item.executed - persisted.executed
+        new_errors = item.errors.keys() - persisted.errors
+        new_prepared = item.prepared_source_mapping.keys() - persisted.prepared
+
+        # Nodes have their inputs set when they are handed out for execution
+        touched = (item.executing ^ persisted.executing) | new_executed | new_errors
+        changed_nodes = (nodes.keys() - persisted.nodes) | {n for n in touched if n in nodes}
+        changed_sources = {item.prepared_source_mapping[n] for n in new_prepared}
+
+        delta: dict[str, Any] = dict()
+        if changed_nodes:
+            delta["nodes"] = {n: nodes[n] for n in changed_nodes}
+        if len(edges) > persisted.edge_count:
+            delta["edges"] = edges[persisted.edge_count:]
+        if new_executed:
+            delta["executed"] = new_executed
+        if len(item.executed_history) > persisted.history_length:
+            delta["executed_history"] = item.executed_history[persisted.history_length:]
+        if item.executing != persisted.executing:
+            delta["executing"] = item.executing
+        if len(item.results) > len(persisted.results):
+            delta["results"] = {k: item.results[k] for k in item.results.keys() - persisted.results}
+        if new_errors:
+            delta["errors"] = {k: item.errors[k] for k in new_errors}
+        if new_prepared:
+            delta["prepared_source_mapping"] = {k: item.prepared_source_mapping[k] for k in new_prepared}
+            delta["source_prepared_mapping"] = {k: item.source_prepared_mapping[k] for k in changed_sources}
+
+        if not delta:
+            return ""
+
+        return json.dumps(delta, default=pydantic_encoder)
+
+    def _materialize(self, item: str, deltas: list[str]) -> dict[str, Any]:
+        state = json.loads(item)
+        for raw_delta in deltas:
+            delta = json.loads(raw_delta)
+            execution_graph = state["execution_graph"]
+            execution_graph["nodes"].update(delta.get("nodes", {}))
+            execution_graph["edges"].extend(delta.get("edges", []))
+            state["executed"] = list(set(state["executed"]).union(delta.get("executed", [])))
+            state["executed_history"].extend(delta.get("executed_history", []))
+            state["executing"] = delta.get("executing", state["executing"])
+            state["results"].update(delta.get("results", {}))
+            state["errors"].update(delta.get("errors", {}))
+            state["prepared_source_mapping"].update(delta.get("prepared_source_mapping", {}))
+            state["source_prepared_mapping"].update(delta.get("source_prepared_mapping", {}))
+        return state
+
+    def _get_state_dicts(self, cursor: sqlite3.Cursor, items: list[str]) -> list[dict[str, Any]]:
+        """Applies the deltas of each snapshot"""
+        snapshots = [json.loads(i) for i in items]
+        deltas: dict[str, list[str]] = {s["id"]: list() for s in snapshots}
+        if deltas:
+            placeholders = ",".join("?" * len(deltas))
+            cursor.execute(
+                f"""SELECT id, delta FROM {self._deltas_table_name} WHERE id IN ({placeholders}) ORDER BY seq;""",
+                list(deltas.keys()),
+            )
+            for item_id, delta in cursor.fetchall():
+                deltas[item_id].append(delta)
+
+        return [self._materialize(i, deltas[s["id"]]) for i, s in zip(items, snapshots)]
+
+    def _parse_items(self, cursor: sqlite3.Cursor, items: list[str]) -> list[GraphExecutionState]:
+        return [GraphExecutionState.parse_obj(s) for s in self._get_state_dicts(cursor, items)]
+
+    def _get_search_filter(self, query: str) -> tuple[str, list[str]]:
+        if self._search_table_name is not None:
+            return super()._get_search_filter(query)
+
+        # Without a full-text index, match the deltas as well
+        return (
+            f"""(t.item LIKE ? OR t.id IN (SELECT id FROM {self._deltas_table_name} WHERE delta LIKE ?))""",
+            [f"%{query}%", f"%{query}%"],
+        )
+
+    def get(self, id: str) -> Optional[GraphExecutionState]:
+        raw = self.get_raw(id)
+        if raw is None:
+            return None
+        return self._parse_item(raw)
+
+    def get_raw(self, id: str) -> Optional[str]:
+        with self._db.reader() as cursor:
+            cursor.execute(
+                f"""SELECT item FROM {self._table_name} WHERE id = ?;""", (str(id),)
+            )
+            result = cursor.fetchone()
+            if not result:
+                return None
+
+            cursor.execute(
+                f"""SELECT delta FROM {self._deltas_table_name} WHERE id = ? ORDER BY seq;""",
+                (str(id),),
+            )
+            deltas = [r[0] for r in cursor.fetchall()]
+
+        if not deltas:
+            return result[0]
+
+        return json.dumps(self._materialize(result[0], deltas))
+
+    def delete(self, id: str):
+        try:
+            self._lock.acquire()
+            self._delete_item(id)
+            self._cursor.execute(
+                f"""DELETE FROM {self._deltas_table_name} WHERE id = ?;""", (str(id),)
+            )
+            self._conn.commit()
+            self._persisted.pop(str(id), None)
+        finally:
+            self._lock.release()
+        self._on_deleted(id)
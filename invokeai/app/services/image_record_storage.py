@@ -11,6 +11,7 @@ from pydantic.generics import GenericModel
 from invokeai.app.models.image import ImageCategory, ResourceOrigin
 from invokeai.app.services.models.image_record import (
     ImageRecord, ImageRecordChanges, deserialize_image_record)
+from invokeai.app.services.sqlite import SqliteDatabase, get_database
 
 T = TypeVar("T", bound=BaseModel)
 
@@ -143,18 +144,18 @@ class ImageRecordStorageBase(ABC):
 
 class SqliteImageRecordStorage(ImageRecordStorageBase):
     _filename: str
+    _db: SqliteDatabase
     _conn: sqlite3.Connection
     _cursor: sqlite3.Cursor
-    _lock: threading.Lock
+    _lock: threading.RLock
 
     def __init__(self, filename: str) -> None:
         super().__init__()
         self._filename = filename
-        self._conn = sqlite3.connect(filename, check_same_thread=False)
-        # Enable row factory to get rows as dictionaries (must be done before making the cursor!)
-        self._conn.row_factory = sqlite3.Row
+        self._db = get_database(filename)
+        self._conn = self._db.conn
         self._cursor = self._conn.cursor()
-        self._lock = threading.Lock()
+        self._lock = self._db.lock
 
         try:
             self._lock.acquire()
@@ -229,22 +230,18 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
 
     def get(self, image_name: str) -> Optional[ImageRecord]:
         try:
-            self._lock.acquire()
-
-            self._cursor.execute(
-                f"""--sql
-                SELECT {IMAGE_DTO_COLS} FROM images
-                WHERE image_name = ?;
-                """,
-                (image_name,),
-            )
+            with self._db.reader() as cursor:
+                cursor.execute(
+                    f"""--sql
+                    SELECT {IMAGE_DTO_COLS} FROM images
+                    WHERE image_name = ?;
+                    """,
+                    (image_name,),
+                )
 
-            result = cast(Optional[sqlite3.Row], self._cursor.fetchone())
+                result = cast(Optional[sqlite3.Row], cursor.fetchone())
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise ImageRecordNotFoundException from e
-        finally:
-            self._lock.release()
 
         if not result:
             raise ImageRecordNotFoundException
@@ -253,25 +250,21 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
 
     def get_metadata(self, image_name: str) -> Optional[dict]:
         try:
-            self._lock.acquire()
-
-            self._cursor.execute(
-                f"""--sql
-                SELECT images.metadata FROM images
-                WHERE image_name = ?;
-                """,
-                (image_name,),
-            )
+            with self._db.reader() as cursor:
+                cursor.execute(
+                    f"""--sql
+                    SELECT images.metadata FROM images
+                    WHERE image_name = ?;
+                    """,
+                    (image_name,),
+                )
 
-            result = cast(Optional[sqlite3.Row], self._cursor.fetchone())
-            if not result or not result[0]:
-                return None
-            return json.loads(result[0])
+                result = cast(Optional[sqlite3.Row], cursor.fetchone())
+                if not result or not result[0]:
+                    return None
+                return json.loads(result[0])
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise ImageRecordNotFoundException from e
-        finally:
-            self._lock.release()
 
     def update(
         self,
@@ -330,85 +323,81 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
         board_id: Optional[str] = None,
     ) -> OffsetPaginatedResults[ImageRecord]:
         try:
-            self._lock.acquire()
+            with self._db.reader() as cursor:
+                # Manually build two queries - one for the count, one for the records
+                count_query = """--sql
+                SELECT COUNT(*)
+                FROM images
+                LEFT JOIN board_images ON board_images.image_name = images.image_name
+                WHERE 1=1
+                """
 
-            # Manually build two queries - one for the count, one for the records
-            count_query = """--sql
-            SELECT COUNT(*)
-            FROM images
-            LEFT JOIN board_images ON board_images.image_name = images.image_name
-            WHERE 1=1
-            """
+                images_query = f"""--sql
+                SELECT {IMAGE_DTO_COLS}
+                FROM images
+                LEFT JOIN board_images ON board_images.image_name = images.image_name
+                WHERE 1=1
+                """
 
-            images_query = f"""--sql
-            SELECT {IMAGE_DTO_COLS}
-            FROM images
-            LEFT JOIN board_images ON board_images.image_name = images.image_name
-            WHERE 1=1
-            """
+                query_conditions = ""
+                query_params = []
 
-            query_conditions = ""
-            query_params = []
+                if image_origin is not None:
+                    query_conditions += """--sql
+                    AND images.image_origin = ?
+                    """
+                    query_params.append(image_origin.value)
 
-            if image_origin is not None:
-                query_conditions += """--sql
-                AND images.image_origin = ?
-                """
-                query_params.append(image_origin.value)
+                if categories is not None:
+                    # Convert the enum values to unique list of strings
+                    category_strings = list(map(lambda c: c.value, set(categories)))
+                    # Create the correct length of placeholders
+                    placeholders = ",".join("?" * len(category_strings))
 
-            if categories is not None:
-                # Convert the enum values to unique list of strings
-                category_strings = list(map(lambda c: c.value, set(categories)))
-                # Create the correct length of placeholders
-                placeholders = ",".join("?" * len(category_strings))
+                    query_conditions += f"""--sql
+                    AND images.image_category IN ( {placeholders} )
+                    """
 
-                query_conditions += f"""--sql
-                AND images.image_category IN ( {placeholders} )
-                """
+                    # Unpack the included categories into the query params
+                    for c in category_strings:
+                        query_params.append(c)
 
-                # Unpack the included categories into the query params
-                for c in category_strings:
-                    query_params.append(c)
+                if is_intermediate is not None:
+                    query_conditions += """--sql
+                    AND images.is_intermediate = ?
+                    """
 
-            if is_intermediate is not None:
-                query_conditions += """--sql
-                AND images.is_intermediate = ?
-                """
+                    query_params.append(is_intermediate)
 
-                query_params.append(is_intermediate)
+                if board_id is not None:
+                    query_conditions += """--sql
+                    AND board_images.board_id = ?
+                    """
 
-            if board_id is not None:
-                query_conditions += """--sql
-                AND board_images.board_id = ?
-                """
-
-                query_params.append(board_id)
+                    query_params.append(board_id)
 
-            query_pagination = """--sql
-            ORDER BY images.created_at DESC LIMIT ? OFFSET ?
-            """
+                query_pagination = """--sql
+                ORDER BY images.created_at DESC LIMIT ? OFFSET ?
+                """
 
-            # Final images query with pagination
-            images_query += query_conditions + query_pagination + ";"
-            # Add all the parameters
-            images_params = query_params.copy()
-            images_params.append(limit)
-            images_params.append(offset)
-            # Build the list of images, deserializing each row
-            self._cursor.execute(images_query, images_params)
-            result = cast(list[sqlite3.Row], self._cursor.fetchall())
-            images = list(map(lambda r: deserialize_image_record(dict(r)), result))
-
-            # Set up and execute the count query, without pagination
-            count_query += query_conditions + ";"
-            count_params = query_params.copy()
-            self._cursor.execute(count_query, count_params)
-            count = cast(int, self._cursor.fetchone()[0])
+                # Final images query with pagination
+                images_query += query_conditions + query_pagination + ";"
+                # Add all the parameters
+                images_params = query_params.copy()
+                images_params.append(limit)
+                images_params.append(offset)
+                # Build the list of images, deserializing each row
+                cursor.execute(images_query, images_params)
+                result = cast(list[sqlite3.Row], cursor.fetchall())
+                images = list(map(lambda r: deserialize_image_record(dict(r)), result))
+
+                # Set up and execute the count query, without pagination
+                count_query += query_conditions + ";"
+                count_params = query_params.copy()
+                cursor.execute(count_query, count_params)
+                count = cast(int, cursor.fetchone()[0])
         except sqlite3.Error as e:
-            self._conn.rollback()
             raise e
-        finally:
-            self._lock.release()
 
         return OffsetPaginatedResults(
             items=images, offset=offset, limit=limit, total=count
@@ -515,9 +504,8 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
             self._lock.release()
 
     def get_most_recent_image_for_board(self, board_id: str) -> Optional[ImageRecord]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
+        with self._db.reader() as cursor:
+            cursor.execute(
                 """--sql
                 SELECT images.*
                 FROM images
@@ -529,9 +517,7 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
                 (board_id,),
             )
 
-            result = cast(Optional[sqlite3.Row], self._cursor.fetchone())
-        finally:
-            self._lock.release()
+            result = cast(Optional[sqlite3.Row], cursor.fetchone())
         if result is None:
             return None
 
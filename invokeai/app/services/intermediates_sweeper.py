@@ -0,0 +1,300 @@
+import datetime
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field
+
+from .graph import GraphExecutionState
+from .invoker import Invoker
+
+
+class SweeperStats(BaseModel):
+    """What the sweeper has reclaimed"""
+    #fmt: off
+    sessions: int = Field(default=0, description="Number of completed sessions swept")
+    latents: int = Field(default=0, description="Number of latents deleted")
+    images: int = Field(default=0, description="Number of intermediate images deleted")
+    bytes: int = Field(default=0, description="Number of bytes reclaimed")
+    #fmt: on
+
+
+def get_result_references(state: GraphExecutionState) -> tuple[set[str], set[str]]:
+    """Gets the names of the latents (including conditioning) and images referenced by the results of a session"""
+    return get_output_references(list(state.results.values()))
+
+
+def get_inner_image_names(state: GraphExecutionState) -> set[str]:
+    """
+    Gets the names of the images that nodes of a session only passed to other
+    nodes. Images output by terminal nodes (or by fields that are not linked)
+    are what clients get back, and may be used once the session completed
+    even if they are intermediate (e.g. processed ControlNet images, canvas
+    staging results).
+    """
+    linked = {(edge.source.node_id, edge.source.field) for edge in state.execution_graph.edges}
+    inner_names: set[str] = set()
+    output_names: set[str] = set()
+    for node_id, output in state.results.items():
+        for field, value in output.__dict__.items():
+            _, image_names = get_output_references([value])
+            (inner_names if (node_id, field) in linked else output_names).update(image_names)
+    return inner_names - output_names
+
+
+def get_output_references(outputs: list[Any]) -> tuple[set[str], set[str]]:
+    """Gets the names of the latents (including conditioning) and images referenced by invocation outputs"""
+    latents_names: set[str] = set()
+    image_names: set[str] = set()
+    values: list[Any] = list(outputs)
+    while values:
+        value = values.pop()
+        if isinstance(value, (list, tuple)):
+            values.extend(value)
+        elif isinstance(value, BaseModel):
+            for field, field_value in value.__dict__.items():
+                if field in ("latents_name", "conditioning_name") and isinstance(field_value, str):
+                    latents_names.add(field_value)
+                elif field == "image_name" and isinstance(field_value, str):
+                    image_names.add(field_value)
+                else:
+                    values.append(field_value)
+
+    return latents_names, image_names
+
+
+class IntermediatesSweeperBase(ABC):
+    """Reclaims the latents and intermediate images of sessions"""
+
+    @abstractmethod
+    def sweep_session(self, session_id: str) -> None:
+        """Deletes the latents and inner intermediate images created by a completed session"""
+        pass
+
+    @abstractmethod
+    def sweep_expired(self) -> None:
+        """Deletes the latents and intermediate images older than the time to live"""
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> SweeperStats:
+        pass
+
+
+class IntermediatesSweeper(IntermediatesSweeperBase):
+    """Sweeps the intermediates of sessions in a background thread.
+
+    Latents (and conditioning) are only used to pass data between the nodes
+    of a session, so once a session completes they are deleted, after `delay`
+    seconds in case nodes using them are added to the session. So are the
+    intermediate images that nodes only passed to other nodes (see
+    `get_inner_image_names`): clients keep using the others. Only latents and
+    images that were created by the session are deleted.
+
+    A session may reuse the outputs of another one from the invocation
+    cache. They are kept while any session referencing them is not swept
+    yet, even once they left the cache, and are then left to expire.
+
+    Latents and inner images of sessions that never complete are deleted once
+    they are older than `ttl` seconds. With a `delay` of None, only those are deleted
+    (e.g. the CLI keeps adding nodes to a completed session).
+    """
+
+    __invoker: Invoker
+    __delay: Optional[float]
+    __ttl: float
+    __interval: float
+    __due: dict[str, float]
+    # by session, when it last changed and the names its results reference
+    __references: dict[str, tuple[float, set[str], set[str]]]
+    __stats: SweeperStats
+    __lock: threading.Lock
+    __stop_event: threading.Event
+    __thread: Optional[threading.Thread]
+
+    def __init__(self, delay: Optional[float] = 60.0, ttl: float = 86400.0, interval: float = 10.0):
+        self.__delay = delay
+        self.__ttl = ttl
+        self.__interval = interval
+        self.__due = dict()
+        self.__references = dict()
+        self.__stats = SweeperStats()
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+    def start(self, invoker: Invoker) -> None:
+        self.__invoker = invoker
+        invoker.services.graph_execution_manager.on_changed(self.__on_session_changed)
+
+        self.__thread = threading.Thread(name="intermediates_sweeper", target=self.__sweep_loop)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, *args, **kwargs) -> None:
+        self.__stop_event.set()
+
+    def get_stats(self) -> SweeperStats:
+        with self.__lock:
+            return self.__stats.copy()
+
+    def __on_session_changed(self, state: GraphExecutionState) -> None:
+        latents_names, image_names = get_result_references(state)
+        with self.__lock:
+            if latents_names or image_names:
+                self.__references[state.id] = (time.time(), latents_names, image_names)
+            if self.__delay is None:
+                return
+            if state.is_complete():
+                self.__due.setdefault(state.id, time.time() + self.__delay)
+            else:
+                # e.g. nodes were added after it completed
+                self.__due.pop(state.id, None)
+
+    def __sweep_loop(self) -> None:
+        # The expired intermediates do not need to be looked for as often
+        expire_interval = max(self.__interval, self.__ttl / 4)
+        next_expire = time.time()
+        while not self.__stop_event.is_set():
+            try:
+                now = time.time()
+                with self.__lock:
+                    due = [s for s, t in self.__due.items() if t <= now]
+                    for session_id in due:
+                        del self.__due[session_id]
+
+                for session_id in due:
+                    self.sweep_session(session_id)
+
+                if now >= next_expire:
+                    self.sweep_expired()
+                    next_expire = now + expire_interval
+            except Exception as e:
+                self.__invoker.services.logger.error(f"Error while sweeping intermediates: {e}")
+
+            self.__stop_event.wait(self.__interval)
+
+    def sweep_session(self, session_id: str) -> None:
+        services = self.__invoker.services
+        state = services.graph_execution_manager.get(session_id)
+        if state is None or not state.is_complete():
+            return
+
+        latents_names, image_names = get_result_references(state)
+        # outputs may be reused by other sessions while they are cached
+        invocation_cache = getattr(services, "invocation_cache", None)
+        if invocation_cache is not None:
+            cached_latents_names, cached_image_names = invocation_cache.get_references()
+            latents_names -= cached_latents_names
+            image_names -= cached_image_names
+        # or may have been reused by sessions that still need them
+        with self.__lock:
+            for other_id, (_, other_latents_names, other_image_names) in self.__references.items():
+                if other_id != state.id:
+                    latents_names -= other_latents_names
+                    image_names -= other_image_names
+
+        # Names of latents start with the id of the session that created them
+        latents_count, latents_bytes = self.__delete_latents(
+            [n for n in latents_names if n.startswith(state.id)]
+        )
+
+        intermediate_names = list()
+        for image_name in image_names & get_inner_image_names(state):
+            try:
+                record = services.images.get_record(image_name)
+            except Exception:
+                continue  # already deleted
+            if record.is_intermediate and record.session_id == state.id:
+                intermediate_names.append(image_name)
+        images_count, images_bytes = self.__delete_images(intermediate_names)
+
+        with self.__lock:
+            self.__references.pop(state.id, None)
+        self.__record(1, latents_count, images_count, latents_bytes + images_bytes)
+
+    def sweep_expired(self) -> None:
+        services = self.__invoker.services
+        # what sessions that stopped changing reference expires as well
+        with self.__lock:
+            oldest_change = time.time() - self.__ttl
+            for session_id in [s for s, (t, *_) in self.__references.items() if t < oldest_change]:
+                del self.__references[session_id]
+
+        latents_count, latents_bytes = self.__delete_latents(
+            services.latents.get_names_older_than(self.__ttl)
+        )
+
+        oldest = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.__ttl)
+        expired_names = list()
+        # images without a session (e.g. canvas uploads) are never inner images
+        inner_names_by_session: dict[str, set[str]] = dict()
+        offset = 0
+        while True:
+            page = services.images.get_many(offset=offset, limit=100, is_intermediate=True)
+            for image in page.items:
+                created_at = image.created_at
+                if isinstance(created_at, str):
+                    created_at = datetime.datetime.fromisoformat(created_at)
+                if created_at >= oldest or not image.session_id:
+                    continue
+                if image.session_id not in inner_names_by_session:
+                    inner_names_by_session[image.session_id] = self.__get_inner_image_names(image.session_id)
+                if image.image_name in inner_names_by_session[image.session_id]:
+                    expired_names.append(image.image_name)
+            offset += len(page.items)
+            if not page.items or offset >= page.total:
+                break
+        images_count, images_bytes = self.__delete_images(expired_names)
+
+        self.__record(0, latents_count, images_count, latents_bytes + images_bytes)
+
+    def __get_inner_image_names(self, session_id: str) -> set[str]:
+        try:
+            state = self.__invoker.services.graph_execution_manager.get(session_id)
+        except Exception:
+            state = None
+        return get_inner_image_names(state) if state is not None else set()
+
+    def __delete_latents(self, names: list[str]) -> tuple[int, int]:
+        latents = self.__invoker.services.latents
+        count, size = 0, 0
+        for name in names:
+            try:
+                name_size = latents.get_size(name)
+                latents.delete(name)
+            except Exception as e:
+                self.__invoker.services.logger.debug(f"Could not delete latents {name}: {e}")
+                continue
+            count += 1
+            size += name_size
+        return count, size
+
+    def __delete_images(self, names: list[str]) -> tuple[int, int]:
+        images = self.__invoker.services.images
+        count, size = 0, 0
+        for name in names:
+            try:
+                paths = [images.get_path(name), images.get_path(name, thumbnail=True)]
+                name_size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+                images.delete(name)
+            except Exception as e:
+                self.__invoker.services.logger.debug(f"Could not delete image {name}: {e}")
+                continue
+            count += 1
+            size += name_size
+        return count, size
+
+    def __record(self, sessions: int, latents: int, images: int, size: int) -> None:
+        with self.__lock:
+            self.__stats.sessions += sessions
+            self.__stats.latents += latents
+            self.__stats.images += images
+            self.__stats.bytes += size
+
+        if latents or images:
+            self.__invoker.services.logger.debug(
+                f"Reclaimed {latents} latents and {images} intermediate images ({size / 2**20:.1f} MB)"
+            )
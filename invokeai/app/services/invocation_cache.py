@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+from pydantic import BaseModel, Field
+
+from ..invocations.baseinvocation import BaseInvocation, BaseInvocationOutput
+from .intermediates_sweeper import get_output_references
+from .invoker import Invoker
+
+# Invocations whose outputs only depend on their inputs and models
+DEFAULT_CACHED_TYPES = [
+    "compel",
+    "compel_collection",
+    "noise",
+    "i2l",
+    "t2l",
+    "l2l",
+    "canny_image_processor",
+    "hed_image_processor",
+    "lineart_image_processor",
+    "lineart_anime_image_processor",
+    "openpose_image_processor",
+    "midas_depth_image_processor",
+    "normalbae_image_processor",
+    "mlsd_image_processor",
+    "pidi_image_processor",
+    "content_shuffle_image_processor",
+    "zoe_depth_image_processor",
+    "mediapipe_face_processor",
+    "leres_image_processor",
+    "tile_image_processor",
+    "segment_anything_processor",
+]
+
+
+class InvocationCacheStats(BaseModel):
+    """How often invocations were served from the cache"""
+    #fmt: off
+    hits: int = Field(default=0, description="Number of invocations whose outputs were taken from the cache")
+    misses: int = Field(default=0, description="Number of cacheable invocations that had to run")
+    evictions: int = Field(default=0, description="Number of outputs dropped to make room for others")
+    entries: int = Field(default=0, description="Number of outputs in the cache")
+    max_entries: int = Field(default=0, description="Maximum number of outputs in the cache")
+    hit_rate: float = Field(default=0.0, description="Fraction of cacheable invocations taken from the cache")
+    #fmt: on
+
+
+class InvocationCacheBase(ABC):
+    """Remembers the outputs of invocations, to skip running them again with the same inputs"""
+
+    @abstractmethod
+    def create_key(self, invocation: BaseInvocation) -> Optional[str]:
+        """Gets the key of the outputs of an invocation, or None if they should not be cached"""
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[BaseInvocationOutput]:
+        """Gets the cached outputs of an invocation, if the latents and images they refer to still exist"""
+        pass
+
+    @abstractmethod
+    def save(self, key: str, output: BaseInvocationOutput) -> None:
+        pass
+
+    @abstractmethod
+    def get_references(self) -> tuple[set[str], set[str]]:
+        """Gets the names of the latents and images referenced by the cached outputs"""
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> InvocationCacheStats:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+
+class MemoryInvocationCache(InvocationCacheBase):
+    """Keeps the outputs of the most recently used invocations in memory.
+
+    The key of an invocation is a hash of its type, its inputs once resolved
+    from the outputs of the nodes it is linked to, and the content hashes of
+    the models it uses. Only invocations of the listed types are cached: they
+    must not depend on anything else (e.g. random numbers, the time).
+
+    Outputs only hold the names of the latents and images they produced, so
+    that a hit reuses them rather than a copy. Their names are kept from the
+    intermediates sweeper while they are cached, and a hit whose latents or
+    images were deleted anyway counts as a miss.
+    """
+
+    __invoker: Invoker
+    __max_entries: int
+    __node_types: set[str]
+    __outputs: OrderedDict[str, BaseInvocationOutput]
+    __stats: InvocationCacheStats
+    __lock: threading.Lock
+
+    def __init__(self, max_entries: int = 1000, node_types: Iterable[str] = DEFAULT_CACHED_TYPES):
+        self.__max_entries = max_entries
+        self.__node_types = set(node_types)
+        self.__outputs = OrderedDict()
+        self.__stats = InvocationCacheStats(max_entries=max_entries)
+        self.__lock = threading.Lock()
+
+    def start(self, invoker: Invoker) -> None:
+        self.__invoker = invoker
+
+    def create_key(self, invocation: BaseInvocation) -> Optional[str]:
+        if invocation.type not in self.__node_types:
+            return None
+
+        try:
+            # the same model may be installed under another name, or replaced
+            model_hashes = [
+                self.__invoker.services.model_manager.get_model_hash(*model)
+                for model in sorted(get_model_references(invocation))
+            ]
+        except Exception as e:
+            self.__invoker.services.logger.debug(f"Not caching {invocation.type} invocation: {e}")
+            return None
+
+        inputs = json.loads(invocation.json(exclude={"id"}))
+        data = json.dumps(dict(inputs=inputs, models=model_hashes), sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[BaseInvocationOutput]:
+        with self.__lock:
+            output = self.__outputs.get(key)
+            if output is not None:
+                self.__outputs.move_to_end(key)
+
+        if output is not None and not self.__exists(output):
+            with self.__lock:
+                self.__outputs.pop(key, None)
+            output = None
+
+        with self.__lock:
+            if output is None:
+                self.__stats.misses += 1
+            else:
+                self.__stats.hits += 1
+        return output.copy(deep=True) if output is not None else None
+
+    def save(self, key: str, output: BaseInvocationOutput) -> None:
+        with self.__lock:
+            self.__outputs[key] = output.copy(deep=True)
+            self.__outputs.move_to_end(key)
+            while len(self.__outputs) > self.__max_entries:
+                self.__outputs.popitem(last=False)
+                self.__stats.evictions += 1
+
+    def get_references(self) -> tuple[set[str], set[str]]:
+        with self.__lock:
+            outputs = list(self.__outputs.values())
+        return get_output_references(outputs)
+
+    def get_stats(self) -> InvocationCacheStats:
+        with self.__lock:
+            stats = self.__stats.copy(update=dict(entries=len(self.__outputs)))
+        lookups = stats.hits + stats.misses
+        stats.hit_rate = stats.hits / lookups if lookups else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__outputs.clear()
+
+    def __exists(self, output: BaseInvocationOutput) -> bool:
+        services = self.__invoker.services
+        latents_names, image_names = get_output_references([output])
+        try:
+            return all(services.latents.get_size(n) > 0 for n in latents_names) and all(
+                os.path.exists(services.images.get_path(n)) for n in image_names
+            )
+        except Exception:
+            return False
+
+
+def get_model_references(invocation: BaseInvocation) -> set[tuple[str, Any, Any]]:
+    """Gets the name, base model and type of the models an invocation loads"""
+    from ..invocations.model import ModelInfo
+
+    models: set[tuple[str, Any, Any]] = set()
+    values: list[Any] = [invocation]
+    while values:
+        value = values.pop()
+        if isinstance(value, ModelInfo):
+            models.add((value.model_name, value.base_model, value.model_type))
+        elif isinstance(value, (list, tuple)):
+            values.extend(value)
+        elif isinstance(value, BaseModel):
+            values.extend(value.__dict__.values())
+    return models
@@ -1,16 +1,43 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
+import sqlite3
+import threading
 import time
 from abc import ABC, abstractmethod
-from queue import Queue
+from collections import deque
 
 from pydantic import BaseModel, Field
 from typing import Optional
 
+from ..invocations.baseinvocation import BaseInvocation
+from .sqlite import SqliteDatabase, get_database
+
+# Invocations defined in these modules never touch the execution device, so
+# they may be handed to a "cpu" worker while other workers are busy denoising.
+CPU_INVOCATION_MODULES = {
+    "collections",
+    "cv",
+    "graph",
+    "image",
+    "infill",
+    "math",
+    "metadata",
+    "params",
+    "prompt",
+}
+
+
+def is_cpu_invocation(invocation: BaseInvocation) -> bool:
+    """Returns true if the invocation can run on a cpu worker"""
+    return type(invocation).__module__.rsplit(".", 1)[-1] in CPU_INVOCATION_MODULES
+
+
 class InvocationQueueItem(BaseModel):
     graph_execution_state_id: str = Field(description="The ID of the graph execution state")
     invocation_id: str = Field(description="The ID of the node being invoked")
     invoke_all: bool = Field(default=False)
+    priority: int = Field(default=0, description="Items with a higher priority are dequeued first")
+    cpu_only: bool = Field(default=False, description="The invocation never uses the execution device (see is_cpu_invocation)")
     timestamp: float = Field(default_factory=time.time)
 
 
@@ -18,7 +45,12 @@ class InvocationQueueABC(ABC):
     """Abstract base class for all invocation queues"""
 
     @abstractmethod
-    def get(self) -> InvocationQueueItem:
+    def get(self, cpu_only: Optional[bool] = None) -> InvocationQueueItem:
+        """
+        Gets the next item, waiting for one. If `cpu_only` is given, only items
+        whose `cpu_only` matches are considered, so that each pool of workers
+        takes the next item it can run. Returns None to wake up a consumer.
+        """
         pass
 
     @abstractmethod
@@ -33,36 +65,320 @@ class InvocationQueueABC(ABC):
     def is_canceled(self, graph_execution_state_id: str) -> bool:
         pass
 
+    def is_full(self) -> bool:
+        """Returns true if the queue should not accept new sessions"""
+        return False
+
+    def task_done(self, item: InvocationQueueItem) -> None:
+        """Signals that a dequeued item has been processed"""
+        pass
+
+    def get_session_ids(self, limit: int) -> list[str]:
+        """Gets the ids of the sessions with queued items, running sessions first, then roughly in the order they will run"""
+        return []
+
 
 class MemoryInvocationQueue(InvocationQueueABC):
-    __queue: Queue
+    __items: deque[Optional[InvocationQueueItem]]
+    __not_empty: threading.Condition
     __cancellations: dict[str, float]
 
     def __init__(self):
-        self.__queue = Queue()
+        self.__items = deque()
+        self.__not_empty = threading.Condition()
         self.__cancellations = dict()
 
-    def get(self) -> InvocationQueueItem:
-        item = self.__queue.get()
+    def get(self, cpu_only: Optional[bool] = None) -> InvocationQueueItem:
+        with self.__not_empty:
+            while True:
+                index = next(
+                    (
+                        i
+                        for i, item in enumerate(self.__items)
+                        if item is None or cpu_only is None or item.cpu_only == cpu_only
+                    ),
+                    None,
+                )
+                if index is None:
+                    self.__not_empty.wait()
+                    continue
 
-        while isinstance(item, InvocationQueueItem) \
-            and item.graph_execution_state_id in self.__cancellations \
-            and self.__cancellations[item.graph_execution_state_id] > item.timestamp:
-            item = self.__queue.get()
+                item = self.__items[index]
+                del self.__items[index]
+                if not (
+                    isinstance(item, InvocationQueueItem)
+                    and item.graph_execution_state_id in self.__cancellations
+                    and self.__cancellations[item.graph_execution_state_id] > item.timestamp
+                ):
+                    break
 
-        # Clear old items
-        for graph_execution_state_id in list(self.__cancellations.keys()):
-            if self.__cancellations[graph_execution_state_id] < item.timestamp:
-                del self.__cancellations[graph_execution_state_id]
+            # Clear old items
+            if item is not None:
+                for graph_execution_state_id in list(self.__cancellations.keys()):
+                    if self.__cancellations[graph_execution_state_id] < item.timestamp:
+                        del self.__cancellations[graph_execution_state_id]
 
         return item
 
     def put(self, item: Optional[InvocationQueueItem]) -> None:
-        self.__queue.put(item)
+        with self.__not_empty:
+            self.__items.append(item)
+            # consumers may be waiting for different items
+            self.__not_empty.notify_all()
 
     def cancel(self, graph_execution_state_id: str) -> None:
         if graph_execution_state_id not in self.__cancellations:
             self.__cancellations[graph_execution_state_id] = time.time()
 
+    def get_session_ids(self, limit: int) -> list[str]:
+        with self.__not_empty:
+            session_ids = dict.fromkeys(i.graph_execution_state_id for i in self.__items if i is not None)
+        return list(session_ids)[:limit]
+
     def is_canceled(self, graph_execution_state_id: str) -> bool:
         return graph_execution_state_id in self.__cancellations
+
+
+class SqliteInvocationQueue(InvocationQueueABC):
+    """An invocation queue persisted to a sqlite database.
+
+    Items are dequeued by priority, then round-robin across sessions, so that
+    a session with many queued invocations does not starve the others. Items
+    stay in the database until they are marked done, and items that were being
+    processed when the application stopped are queued again on startup.
+
+    If `max_size` is set, `is_full()` reports when the queue holds that many
+    items, so that callers can refuse to start new sessions.
+    """
+
+    _filename: str
+    _db: SqliteDatabase
+    _conn: sqlite3.Connection
+    _cursor: sqlite3.Cursor
+    _lock: threading.RLock
+    _not_empty: threading.Condition
+    _max_size: int
+    _wakeups: int
+    _turn: int
+    _session_turns: dict[str, int]
+    _cancellations: dict[str, float]
+
+    def __init__(self, filename: str, max_size: int = 0):
+        super().__init__()
+        self._filename = filename
+        self._max_size = max_size
+        self._wakeups = 0
+        self._turn = 0
+        self._session_turns = dict()
+        self._cancellations = dict()
+        self._db = get_database(filename)
+        self._conn = self._db.conn
+        self._cursor = self._conn.cursor()
+        self._lock = self._db.lock
+        self._not_empty = threading.Condition(self._lock)
+
+        try:
+            self._lock.acquire()
+            self._create_tables()
+            # Anything that was being processed did not complete, so run it again
+            self._cursor.execute(
+                """--sql
+                UPDATE invocation_queue SET taken = FALSE WHERE taken = TRUE;
+                """
+            )
+            self._conn.commit()
+        finally:
+            self._lock.release()
+
+    def _create_tables(self) -> None:
+        """Creates the `invocation_queue` table."""
+
+        self._cursor.execute(
+            """--sql
+            CREATE TABLE IF NOT EXISTS invocation_queue (
+                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                graph_execution_state_id TEXT NOT NULL,
+                invocation_id TEXT NOT NULL,
+                invoke_all BOOLEAN NOT NULL DEFAULT FALSE,
+                priority INTEGER NOT NULL DEFAULT 0,
+                cpu_only BOOLEAN NOT NULL DEFAULT FALSE,
+                timestamp REAL NOT NULL,
+                -- Set when the item has been dequeued but not yet processed
+                taken BOOLEAN NOT NULL DEFAULT FALSE
+            );
+            """
+        )
+
+        # queues created before items were told apart by the workers that may run them
+        self._cursor.execute("""PRAGMA table_info(invocation_queue);""")
+        if "cpu_only" not in [row[1] for row in self._cursor.fetchall()]:
+            self._cursor.execute(
+                """--sql
+                ALTER TABLE invocation_queue ADD COLUMN cpu_only BOOLEAN NOT NULL DEFAULT FALSE;
+                """
+            )
+
+        self._cursor.execute(
+            """--sql
+            CREATE INDEX IF NOT EXISTS idx_invocation_queue_pending
+                ON invocation_queue(taken, priority, graph_execution_state_id, item_id);
+            """
+        )
+
+    def _next_item_id(self, cpu_only: Optional[bool] = None) -> Optional[int]:
+        """Finds the next item to dequeue. Must be called with the lock held."""
+        # The oldest item of every session at the highest pending priority,
+        # among the items the caller can run
+        self._cursor.execute(
+            """--sql
+            SELECT graph_execution_state_id, MIN(item_id) FROM invocation_queue
+            WHERE taken = FALSE AND (:cpu_only IS NULL OR cpu_only = :cpu_only) AND priority = (
+                SELECT MAX(priority) FROM invocation_queue
+                WHERE taken = FALSE AND (:cpu_only IS NULL OR cpu_only = :cpu_only)
+            )
+            GROUP BY graph_execution_state_id;
+            """,
+            dict(cpu_only=cpu_only),
+        )
+        candidates = self._cursor.fetchall()
+        if not candidates:
+            return None
+
+        # Serve the session that has waited the longest since its last turn
+        session_id, item_id = min(
+            candidates, key=lambda c: (self._session_turns.get(c[0], -1), c[1])
+        )
+        self._session_turns[session_id] = self._turn
+        self._turn += 1
+        return item_id
+
+    def get(self, cpu_only: Optional[bool] = None) -> InvocationQueueItem:
+        with self._not_empty:
+            while True:
+                if self._wakeups > 0:
+                    self._wakeups -= 1
+                    return None
+
+                item_id = self._next_item_id(cpu_only)
+                if item_id is not None:
+                    break
+
+                self._not_empty.wait()
+
+            self._cursor.execute(
+                """--sql
+                UPDATE invocation_queue SET taken = TRUE WHERE item_id = ?;
+                """,
+                (item_id,),
+            )
+            self._cursor.execute(
+                """--sql
+                SELECT graph_execution_state_id, invocation_id, invoke_all, priority, cpu_only, timestamp
+                FROM invocation_queue WHERE item_id = ?;
+                """,
+                (item_id,),
+            )
+            row = self._cursor.fetchone()
+            self._conn.commit()
+
+        return InvocationQueueItem(
+            graph_execution_state_id=row[0],
+            invocation_id=row[1],
+            invoke_all=bool(row[2]),
+            priority=row[3],
+            cpu_only=bool(row[4]),
+            timestamp=row[5],
+        )
+
+    def put(self, item: Optional[InvocationQueueItem]) -> None:
+        with self._not_empty:
+            if item is None:
+                # Wakes up a waiting consumer, usually because we are stopping
+                self._wakeups += 1
+            else:
+                # A new invocation after a cancellation resumes the session
+                canceled_at = self._cancellations.get(item.graph_execution_state_id)
+                if canceled_at is not None and canceled_at < item.timestamp:
+                    del self._cancellations[item.graph_execution_state_id]
+
+                self._cursor.execute(
+                    """--sql
+                    INSERT INTO invocation_queue (graph_execution_state_id, invocation_id, invoke_all, priority, cpu_only, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?);
+                    """,
+                    (
+                        item.graph_execution_state_id,
+                        item.invocation_id,
+                        item.invoke_all,
+                        item.priority,
+                        item.cpu_only,
+                        item.timestamp,
+                    ),
+                )
+                self._conn.commit()
+
+            # consumers may be waiting for different items
+            self._not_empty.notify_all()
+
+    def task_done(self, item: InvocationQueueItem) -> None:
+        with self._lock:
+            self._cursor.execute(
+                """--sql
+                DELETE FROM invocation_queue
+                WHERE taken = TRUE AND graph_execution_state_id = ? AND invocation_id = ?;
+                """,
+                (item.graph_execution_state_id, item.invocation_id),
+            )
+            self._conn.commit()
+
+            # Forget the turns of sessions that have nothing left in the queue
+            self._cursor.execute(
+                """--sql
+                SELECT 1 FROM invocation_queue WHERE graph_execution_state_id = ? LIMIT 1;
+                """,
+                (item.graph_execution_state_id,),
+            )
+            if self._cursor.fetchone() is None:
+                self._session_turns.pop(item.graph_execution_state_id, None)
+
+    def cancel(self, graph_execution_state_id: str) -> None:
+        with self._lock:
+            if graph_execution_state_id not in self._cancellations:
+                self._cancellations[graph_execution_state_id] = time.time()
+            self._session_turns.pop(graph_execution_state_id, None)
+
+            self._cursor.execute(
+                """--sql
+                DELETE FROM invocation_queue WHERE graph_execution_state_id = ? AND taken = FALSE;
+                """,
+                (graph_execution_state_id,),
+            )
+            self._conn.commit()
+
+    def is_canceled(self, graph_execution_state_id: str) -> bool:
+        return graph_execution_state_id in self._cancellations
+
+    def is_full(self) -> bool:
+        if self._max_size <= 0:
+            return False
+
+        return self.size() >= self._max_size
+
+    def get_session_ids(self, limit: int) -> list[str]:
+        with self._db.reader() as cursor:
+            cursor.execute(
+                """--sql
+                SELECT graph_execution_state_id FROM invocation_queue
+                GROUP BY graph_execution_state_id
+                ORDER BY MAX(taken) DESC, MAX(priority) DESC, MIN(item_id)
+                LIMIT ?;
+                """,
+                (limit,),
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def size(self) -> int:
+        """Gets the number of queued and in-progress items"""
+        with self._db.reader() as cursor:
+            cursor.execute("""SELECT count(*) FROM invocation_queue;""")
+            return cursor.fetchone()[0]
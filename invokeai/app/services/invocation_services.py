@@ -1,6 +1,6 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654) and the InvokeAI Team
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 if TYPE_CHECKING:
     from logging import Logger
@@ -16,6 +16,8 @@ if TYPE_CHECKING:
     from invokeai.app.services.config import InvokeAISettings
     from invokeai.app.services.graph import GraphExecutionState, LibraryGraph
     from invokeai.app.services.invoker import InvocationProcessorABC
+    from invokeai.app.services.intermediates_sweeper import IntermediatesSweeperBase
+    from invokeai.app.services.invocation_cache import InvocationCacheBase
 
 
 class InvocationServices:
@@ -35,6 +37,8 @@ class InvocationServices:
     processor: "InvocationProcessorABC"
     queue: "InvocationQueueABC"
     restoration: "RestorationServices"
+    sweeper: Optional["IntermediatesSweeperBase"]
+    invocation_cache: Optional["InvocationCacheBase"]
 
     def __init__(
         self,
@@ -51,6 +55,8 @@ class InvocationServices:
         processor: "InvocationProcessorABC",
         queue: "InvocationQueueABC",
         restoration: "RestorationServices",
+        sweeper: Optional["IntermediatesSweeperBase"] = None,
+        invocation_cache: Optional["InvocationCacheBase"] = None,
     ):
         self.board_images = board_images
         self.boards = boards
@@ -66,3 +72,5 @@ class InvocationServices:
         self.processor = processor
         self.queue = queue
         self.restoration = restoration
+        self.sweeper = sweeper
+        self.invocation_cache = invocation_cache
@@ -4,7 +4,7 @@ from abc import ABC
 from typing import Optional
 
 from .graph import Graph, GraphExecutionState
-from .invocation_queue import InvocationQueueItem
+from .invocation_queue import InvocationQueueItem, is_cpu_invocation
 from .invocation_services import InvocationServices
 
 class Invoker:
@@ -17,30 +17,40 @@ class Invoker:
         self._start()
 
     def invoke(
-        self, graph_execution_state: GraphExecutionState, invoke_all: bool = False
+        self, graph_execution_state: GraphExecutionState, invoke_all: bool = False, priority: int = 0
     ) -> Optional[str]:
         """Determines the next node to invoke and enqueues it, preparing if needed.
-        Returns the id of the queued node, or `None` if there are no nodes left to enqueue."""
-
-        # Get the next invocation
-        invocation = graph_execution_state.next()
-        if not invocation:
+        When invoking all, every node that is ready to execute is enqueued so that
+        independent branches of the graph may run concurrently.
+        Returns the id of the first queued node, or `None` if there are no nodes left to enqueue."""
+
+        # Get the next invocations
+        if invoke_all:
+            invocations = graph_execution_state.next_ready()
+        else:
+            invocation = graph_execution_state.next()
+            invocations = [invocation] if invocation else []
+
+        if not invocations:
             return None
 
         # Save the execution state
         self.services.graph_execution_manager.set(graph_execution_state)
 
-        # Queue the invocation
-        self.services.queue.put(
-            InvocationQueueItem(
-                # session_id    = session.id,
-                graph_execution_state_id=graph_execution_state.id,
-                invocation_id=invocation.id,
-                invoke_all=invoke_all,
+        # Queue the invocations
+        for invocation in invocations:
+            self.services.queue.put(
+                InvocationQueueItem(
+                    # session_id    = session.id,
+                    graph_execution_state_id=graph_execution_state.id,
+                    invocation_id=invocation.id,
+                    invoke_all=invoke_all,
+                    priority=priority,
+                    cpu_only=is_cpu_invocation(invocation),
+                )
             )
-        )
 
-        return invocation.id
+        return invocations[0].id
 
     def create_execution_state(self, graph: Optional[Graph] = None) -> GraphExecutionState:
         """Creates a new execution state for the given graph"""
@@ -52,6 +62,12 @@ class Invoker:
         """Cancels the given execution state"""
         self.services.queue.cancel(graph_execution_state_id)
 
+        # Release any nodes that were handed out, so the session may be invoked again
+        graph_execution_state = self.services.graph_execution_manager.get(graph_execution_state_id)
+        if graph_execution_state is not None and graph_execution_state.executing:
+            graph_execution_state.executing.clear()
+            self.services.graph_execution_manager.set(graph_execution_state)
+
     def __start_service(self, service) -> None:
         # Call start() method on any services that have it
         start_op = getattr(service, "start", None)
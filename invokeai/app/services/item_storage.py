@@ -17,6 +17,21 @@ class PaginatedResults(GenericModel, Generic[T]):
     total: int = Field(description="Total number of items in result")
     #fmt: on
 
+class CursorPaginatedResults(GenericModel, Generic[T]):
+    """Cursor-paginated results"""
+    #fmt: off
+    items: list[T] = Field(description="Items")
+    per_page: int = Field(description="Number of items per page")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor to get the next page with, if there are more items")
+    #fmt: on
+
+class ItemSummary(BaseModel):
+    """An item that has not been parsed"""
+    #fmt: off
+    id: str = Field(description="The id of the item")
+    text: Optional[str] = Field(default=None, description="The indexed text of the item, if items are indexed")
+    #fmt: on
+
 class ItemStorageABC(ABC, Generic[T]):
     _on_changed_callbacks: list[Callable[[T], None]]
     _on_deleted_callbacks: list[Callable[[str], None]]
@@ -53,6 +68,20 @@ class ItemStorageABC(ABC, Generic[T]):
     ) -> PaginatedResults[T]:
         pass
 
+    @abstractmethod
+    def list_after(
+        self, after: Optional[str] = None, per_page: int = 10, query: str = ""
+    ) -> CursorPaginatedResults[T]:
+        """Gets the items with an id greater than `after`, ordered by id, optionally searching"""
+        pass
+
+    @abstractmethod
+    def list_summaries(
+        self, after: Optional[str] = None, per_page: int = 10, query: str = ""
+    ) -> CursorPaginatedResults[ItemSummary]:
+        """Gets item summaries like `list_after`, without parsing the items"""
+        pass
+
     def on_changed(self, on_changed: Callable[[T], None]) -> None:
         """Register a callback for when an item is changed"""
         self._on_changed_callbacks.append(on_changed)
@@ -1,11 +1,26 @@
 # Copyright (c) 2023 Kyle Schouviller (https://github.com/kyle0654)
 
+import os
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from queue import Queue
-from typing import Dict, Union, Optional
+from threading import Lock
+from typing import Any, Union, Optional
 
 import torch
+from pydantic import BaseModel, Field
+from safetensors import SafetensorError, safe_open
+from safetensors.torch import save_file
+
+import invokeai.backend.util.logging as logger
+
+# Name of the tensor in latents files
+LATENTS_KEY = "latents"
+# Metadata of conditioning files, from which their extra info is rebuilt
+TOKENS_COUNT_KEY = "tokens_count_including_eos_bos"
+
 
 class LatentsStorageBase(ABC):
     """Responsible for storing and retrieving latents."""
@@ -22,52 +37,243 @@ class LatentsStorageBase(ABC):
     def delete(self, name: str) -> None:
         pass
 
+    @abstractmethod
+    def get_size(self, name: str) -> int:
+        """Gets the number of bytes taken by stored latents, or 0 if they do not exist"""
+        pass
+
+    @abstractmethod
+    def get_names_older_than(self, seconds: float) -> list[str]:
+        """Gets the names of the stored latents last saved more than `seconds` ago"""
+        pass
+
+    def touch(self, name: str) -> None:
+        """Marks stored latents as just saved, so that they are not expired while they are reused"""
+        pass
+
+    def flush(self, names: list[str], wait: bool = False) -> None:
+        """Writes the named latents to persistent storage if they are only in memory.
+
+        The latents may be written in the background, unless `wait` is set.
+        """
+        pass
+
+
+class LatentsCacheStats(BaseModel):
+    """Statistics of a latents cache"""
+    #fmt: off
+    hits: int = Field(default=0, description="Number of gets served from memory")
+    misses: int = Field(default=0, description="Number of gets read from the underlying storage")
+    evictions: int = Field(default=0, description="Number of latents evicted from memory")
+    spills: int = Field(default=0, description="Number of evicted latents written to the underlying storage")
+    size: int = Field(default=0, description="Size of the cached latents, in bytes")
+    count: int = Field(default=0, description="Number of cached latents")
+    #fmt: on
+
+
+def get_latents_size(data: Any) -> int:
+    """Gets the number of bytes taken by the tensors of some latents or conditioning"""
+    if isinstance(data, torch.Tensor):
+        return data.element_size() * data.nelement()
+    if isinstance(data, (tuple, list)):
+        return sum(get_latents_size(d) for d in data)
+    if isinstance(data, dict):
+        return sum(get_latents_size(d) for d in data.values())
+    # e.g. extra conditioning info
+    return sum(get_latents_size(d) for d in getattr(data, "__dict__", {}).values())
+
+
+def is_plain_conditioning(data: Any) -> bool:
+    """Whether data is conditioning whose extra info is nothing but its number of tokens"""
+    return (
+        isinstance(data, tuple)
+        and len(data) == 2
+        and isinstance(data[0], torch.Tensor)
+        and hasattr(data[1], TOKENS_COUNT_KEY)
+        and getattr(data[1], "cross_attention_control_args", None) is None
+    )
+
 
 class ForwardCacheLatentsStorage(LatentsStorageBase):
-    """Caches the latest N latents in memory, writing-thorugh to and reading from underlying storage"""
-    
-    __cache: Dict[str, torch.Tensor]
-    __cache_ids: Queue
+    """Caches latents in memory up to a size in bytes, evicting the least recently used.
+
+    Saved latents are only written to the underlying storage when they are
+    evicted, when they are flushed (when a session that references them is
+    saved, so that it can resume after a crash) or when the invoker stops.
+    Latents that are deleted before then never reach the disk.
+
+    Flushed latents are written by a background thread, outside the lock of
+    the cache, and served from memory until they are written.
+    """
+
+    __cache: OrderedDict[str, Any]
+    __dirty: set[str]
+    # name -> data of the flushed latents that are being written
+    __flushing: dict[str, Any]
+    __cache_size: int
     __max_cache_size: int
+    __stats: LatentsCacheStats
+    __lock: Lock
+    # held while flushed latents are written, outside the lock
+    __write_lock: Lock
+    __writing: Optional[str]
+    __writer: ThreadPoolExecutor
     __underlying_storage: LatentsStorageBase
 
-    def __init__(self, underlying_storage: LatentsStorageBase, max_cache_size: int = 20):
+    def __init__(self, underlying_storage: LatentsStorageBase, max_cache_size: int = 512 * 2**20):
         self.__underlying_storage = underlying_storage
-        self.__cache = dict()
-        self.__cache_ids = Queue()
+        self.__cache = OrderedDict()
+        self.__dirty = set()
+        self.__flushing = dict()
+        self.__cache_size = 0
         self.__max_cache_size = max_cache_size
+        self.__stats = LatentsCacheStats()
+        self.__lock = Lock()
+        self.__write_lock = Lock()
+        self.__writing = None
+        self.__writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="latents_flush")
 
     def get(self, name: str) -> torch.Tensor:
-        cache_item = self.__get_cache(name)
-        if cache_item is not None:
-            return cache_item
+        with self.__lock:
+            if name in self.__cache:
+                self.__stats.hits += 1
+                self.__cache.move_to_end(name)
+                return self.__cache[name]
+            if name in self.__flushing:
+                # evicted before it was written
+                self.__stats.hits += 1
+                return self.__flushing[name]
 
-        latent = self.__underlying_storage.get(name)
-        self.__set_cache(name, latent)
-        return latent
+            self.__stats.misses += 1
+            latent = self.__underlying_storage.get(name)
+            self.__set_cache(name, latent, dirty=False)
+            return latent
 
     def save(self, name: str, data: torch.Tensor) -> None:
-        self.__underlying_storage.save(name, data)
-        self.__set_cache(name, data)
+        with self.__lock:
+            cached = self.__set_cache(name, data, dirty=True)
+            writing = self.__writing == name
+        if not cached:
+            self.__wait_for_write(writing)
+            self.__underlying_storage.save(name, data)
 
     def delete(self, name: str) -> None:
+        with self.__lock:
+            self.__remove(name)
+            writing = self.__writing == name
+        self.__wait_for_write(writing)
         self.__underlying_storage.delete(name)
+
+    def get_size(self, name: str) -> int:
+        with self.__lock:
+            if name in self.__dirty:
+                return get_latents_size(self.__cache[name])
+            if name in self.__flushing:
+                return get_latents_size(self.__flushing[name])
+            return self.__underlying_storage.get_size(name)
+
+    def get_names_older_than(self, seconds: float) -> list[str]:
+        # Latents that are only in memory are recent enough not to have been evicted
+        return self.__underlying_storage.get_names_older_than(seconds)
+
+    def touch(self, name: str) -> None:
+        self.__underlying_storage.touch(name)
+
+    def flush(self, names: list[str], wait: bool = False) -> None:
+        futures = list()
+        with self.__lock:
+            for name in names:
+                if name in self.__dirty:
+                    data = self.__cache[name]
+                    self.__dirty.discard(name)
+                    self.__flushing[name] = data
+                    futures.append(self.__writer.submit(self.__write, name, data))
+        if wait:
+            for future in futures:
+                future.result()
+
+    def stop(self, *args, **kwargs) -> None:
+        """Writes the latents that only exist in memory to the underlying storage"""
+        # the flushes are written in order, so they are all written after this one
+        self.__writer.submit(lambda: None).result()
+        with self.__lock:
+            for name in list(self.__dirty):
+                self.__underlying_storage.save(name, self.__cache[name])
+            self.__dirty.clear()
+
+    def get_stats(self) -> LatentsCacheStats:
+        with self.__lock:
+            return self.__stats.copy(update=dict(size=self.__cache_size, count=len(self.__cache)))
+
+    def __set_cache(self, name: str, data: Any, dirty: bool) -> bool:
+        """Caches data, evicting older latents to make room. Returns False if the data is too large to cache."""
+        self.__remove(name)
+        size = get_latents_size(data)
+        if size > self.__max_cache_size:
+            return False
+
+        while self.__cache and self.__cache_size + size > self.__max_cache_size:
+            self.__evict()
+
+        self.__cache[name] = data
+        self.__cache_size += size
+        if dirty:
+            self.__dirty.add(name)
+        return True
+
+    def __evict(self):
+        name, data = self.__cache.popitem(last=False)
+        self.__cache_size -= get_latents_size(data)
+        self.__stats.evictions += 1
+        if name in self.__dirty:
+            self.__dirty.discard(name)
+            self.__underlying_storage.save(name, data)
+            self.__stats.spills += 1
+
+    def __remove(self, name: str):
         if name in self.__cache:
-            del self.__cache[name]
+            self.__cache_size -= get_latents_size(self.__cache.pop(name))
+        self.__dirty.discard(name)
+        self.__flushing.pop(name, None)
 
-    def __get_cache(self, name: str) -> Optional[torch.Tensor]:
-        return None if name not in self.__cache else self.__cache[name]
+    def __wait_for_write(self, writing: bool):
+        """Waits until the latents that were being written are written, so that they do not overwrite newer changes"""
+        if writing:
+            with self.__write_lock:
+                pass
 
-    def __set_cache(self, name: str, data: torch.Tensor):
-        if not name in self.__cache:
-            self.__cache[name] = data
-            self.__cache_ids.put(name)
-            if self.__cache_ids.qsize() > self.__max_cache_size:
-                self.__cache.pop(self.__cache_ids.get())
+    def __write(self, name: str, data: Any):
+        with self.__write_lock:
+            with self.__lock:
+                # deleted or saved again since it was flushed
+                if self.__flushing.get(name) is not data:
+                    return
+                self.__writing = name
+            written = False
+            try:
+                self.__underlying_storage.save(name, data)
+                written = True
+            except Exception as e:
+                logger.warning(f"Could not store the latents {name}: {e}")
+                raise
+            finally:
+                with self.__lock:
+                    self.__writing = None
+                    if self.__flushing.get(name) is data:
+                        del self.__flushing[name]
+                        # written again when evicted, flushed or when the invoker stops
+                        if not written and self.__cache.get(name) is data:
+                            self.__dirty.add(name)
 
 
 class DiskLatentsStorage(LatentsStorageBase):
-    """Stores latents in a folder on disk without caching"""
+    """Stores latents in a folder on disk without caching.
+
+    Tensors are stored in safetensors files, which are memory-mapped when
+    read instead of being unpickled. So is conditioning, unless its extra info
+    holds cross-attention control arguments: the rest of its extra info fits
+    in the file's metadata. Anything else is pickled with torch.save().
+    """
 
     __output_folder: Union[str, Path]
 
@@ -77,18 +283,59 @@ class DiskLatentsStorage(LatentsStorageBase):
 
     def get(self, name: str) -> torch.Tensor:
         latent_path = self.get_path(name)
-        return torch.load(latent_path)
+        try:
+            with safe_open(latent_path, framework="pt") as f:
+                metadata = f.metadata() or {}
+                latents = f.get_tensor(LATENTS_KEY).to(metadata.get("device", "cpu"))
+        except SafetensorError:
+            # Not a tensor, or saved by an older version
+            return torch.load(latent_path)
+
+        if TOKENS_COUNT_KEY in metadata:
+            from invokeai.backend.stable_diffusion.diffusion import InvokeAIDiffuserComponent
+
+            extra_conditioning_info = InvokeAIDiffuserComponent.ExtraConditioningInfo(
+                tokens_count_including_eos_bos=int(metadata[TOKENS_COUNT_KEY]),
+            )
+            return (latents, extra_conditioning_info)
+        return latents
 
     def save(self, name: str, data: torch.Tensor) -> None:
         self.__output_folder.mkdir(parents=True, exist_ok=True)
         latent_path = self.get_path(name)
-        torch.save(data, latent_path)
+        if isinstance(data, torch.Tensor):
+            save_file({LATENTS_KEY: data.contiguous()}, latent_path, metadata={"device": str(data.device)})
+        elif is_plain_conditioning(data):
+            c, extra_conditioning_info = data
+            metadata = {
+                "device": str(c.device),
+                TOKENS_COUNT_KEY: str(extra_conditioning_info.tokens_count_including_eos_bos),
+            }
+            save_file({LATENTS_KEY: c.contiguous()}, latent_path, metadata=metadata)
+        else:
+            torch.save(data, latent_path)
 
     def delete(self, name: str) -> None:
         latent_path = self.get_path(name)
-        latent_path.unlink()
-        
+        latent_path.unlink(missing_ok=True)
+
+    def get_size(self, name: str) -> int:
+        latent_path = self.get_path(name)
+        return latent_path.stat().st_size if latent_path.exists() else 0
+
+    def touch(self, name: str) -> None:
+        try:
+            os.utime(self.get_path(name))
+        except FileNotFoundError:
+            pass
+
+    def get_names_older_than(self, seconds: float) -> list[str]:
+        oldest = time.time() - seconds
+        return [
+            entry.name
+            for entry in os.scandir(self.__output_folder)
+            if entry.is_file() and entry.stat().st_mtime < oldest
+        ]
 
     def get_path(self, name: str) -> Path:
         return self.__output_folder / name
-    
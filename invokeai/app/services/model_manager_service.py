@@ -2,10 +2,12 @@
 
 from __future__ import annotations
 
+import queue
+import threading
 from abc import ABC, abstractmethod
 from pathlib import Path
 from pydantic import Field
-from typing import Optional, Union, Callable, List, Tuple, TYPE_CHECKING
+from typing import Any, Dict, Optional, Union, Callable, List, Tuple, TYPE_CHECKING
 from types import ModuleType
 
 from invokeai.backend.model_management import (
@@ -18,7 +20,11 @@ from invokeai.backend.model_management import (
     SchedulerPredictionType,
     ModelMerger,
     MergeInterpolationMethod,
+    PrefetchStats,
 )
+from invokeai.backend.model_management.annotator import Annotator
+from invokeai.backend.model_management.model_cache import CacheFullException, ModelCache
+from invokeai.backend.model_management.model_conversion import ConversionEvent, ConversionJob
 from invokeai.backend.model_management.model_search import FindModels
 
 import torch
@@ -28,6 +34,43 @@ from .config import InvokeAIAppConfig
 
 if TYPE_CHECKING:
     from ..invocations.baseinvocation import BaseInvocation, InvocationContext
+    from .events import EventServiceBase
+    from .graph import Graph, GraphExecutionState
+    from .invoker import Invoker
+
+# A model to load: name, base model, type and submodel
+ModelRequest = Tuple[str, BaseModelType, ModelType, Optional[SubModelType]]
+
+# Number of sessions at the head of the invocation queue (the running ones
+# included) whose models are prefetched
+PREFETCH_SESSIONS = 2
+# Asks the prefetch thread to look at the sessions at the head of the queue
+NEXT_SESSIONS = "next_sessions"
+
+
+def get_graph_models(graph: Graph) -> List[ModelRequest]:
+    """Gets the models the loader nodes of a graph (and its subgraphs) will request"""
+    from ..invocations.model import LoraLoaderInvocation, MainModelLoaderInvocation, VaeLoaderInvocation
+    from .graph import GraphInvocation
+
+    models = list()
+    graphs = [graph]
+    while graphs:
+        for node in graphs.pop().nodes.values():
+            if isinstance(node, MainModelLoaderInvocation):
+                models.extend(
+                    (node.model.model_name, node.model.base_model, ModelType.Main, submodel)
+                    for submodel in (SubModelType.TextEncoder, SubModelType.UNet, SubModelType.Vae)
+                )
+            elif isinstance(node, LoraLoaderInvocation) and node.lora is not None:
+                models.append((node.lora.model_name, node.lora.base_model, ModelType.Lora, None))
+            elif isinstance(node, VaeLoaderInvocation):
+                models.append((node.vae_model.model_name, node.vae_model.base_model, ModelType.Vae, None))
+            elif isinstance(node, GraphInvocation) and node.graph is not None:
+                graphs.append(node.graph)
+
+    # in order, without duplicates
+    return list(dict.fromkeys(models))
 
 
 class ModelManagerServiceBase(ABC):
@@ -260,6 +303,44 @@ class ModelManagerServiceBase(ABC):
         Return list of all models found in the designated directory.
         """
         pass
+
+    @abstractmethod
+    def prefetch_models(self, graph: Graph) -> None:
+        """
+        Start loading the models used by a graph into RAM in the background.
+        """
+        pass
+
+    @abstractmethod
+    def get_prefetch_stats(self) -> PrefetchStats:
+        """
+        Return how many model requests prefetching served, and the loading time it saved.
+        """
+        pass
+
+    @abstractmethod
+    def get_model_hash(self, model_name: str, base_model: BaseModelType, model_type: ModelType) -> str:
+        """
+        Return the sha256 checksum of the contents of a model.
+        """
+        pass
+
+    @abstractmethod
+    def get_annotator(self, name: str, loader: Callable[[], Any], gpu_load: bool = True) -> ModelCache.ModelLocker:
+        """
+        Return an image annotator (e.g. a controlnet_aux detector) kept in the
+        model cache, loading it with loader() if it is not cached. Use the
+        result as a context manager to get the annotator, locked in the
+        execution device if gpu_load is set.
+        """
+        pass
+
+    @abstractmethod
+    def find_duplicate_models(self) -> List[List[str]]:
+        """
+        Return the keys of the installed models that have the same contents, grouped by model.
+        """
+        pass
         
     @abstractmethod
     def sync_to_config(self):
@@ -330,8 +411,100 @@ class ModelManagerService(ModelManagerServiceBase):
             sequential_offload=sequential_offload,
             logger=logger,
         )
+        self._prefetch_enabled = config.prefetch_models
+        self._prefetch_queue: queue.Queue[Union[ModelRequest, str, None]] = queue.Queue()
+        self._prefetch_thread = None
+        self._next_sessions_pending = threading.Event()
+        # sessions whose models were prefetched, oldest first
+        self._prefetched_sessions: Dict[str, None] = dict()
         logger.info('Model manager service initialized')
 
+    def start(self, invoker: Invoker) -> None:
+        self.mgr.converter.add_listener(
+            lambda event, job: self._on_conversion_event(invoker.services.events, event, job)
+        )
+        if not self._prefetch_enabled:
+            return
+        self._services = invoker.services
+        invoker.services.graph_execution_manager.on_changed(self._on_session_changed)
+        self._prefetch_thread = threading.Thread(name="model_prefetch", target=self._prefetch_loop)
+        self._prefetch_thread.daemon = True
+        self._prefetch_thread.start()
+
+    def stop(self, *args, **kwargs) -> None:
+        self._prefetch_queue.put(None)
+
+    def _on_conversion_event(self, events: EventServiceBase, event: ConversionEvent, job: ConversionJob) -> None:
+        if event == 'started':
+            events.emit_model_conversion_started(model_name=job.name)
+        elif event == 'progress':
+            events.emit_model_conversion_progress(model_name=job.name, elapsed=job.elapsed)
+        elif event == 'completed':
+            events.emit_model_conversion_completed(model_name=job.name, elapsed=job.elapsed)
+        else:
+            events.emit_model_conversion_error(model_name=job.name, error=job.error)
+
+    def _on_session_changed(self, state: GraphExecutionState) -> None:
+        # sessions were queued, or moved up the queue
+        if not self._next_sessions_pending.is_set():
+            self._next_sessions_pending.set()
+            self._prefetch_queue.put(NEXT_SESSIONS)
+
+    def prefetch_models(self, graph: Graph) -> None:
+        if self._prefetch_thread is None:
+            return
+        for request in get_graph_models(graph):
+            self._prefetch_queue.put(request)
+
+    def _prefetch_loop(self) -> None:
+        while True:
+            request = self._prefetch_queue.get()
+            if request is None:
+                break
+            if request == NEXT_SESSIONS:
+                self._next_sessions_pending.clear()
+                self._prefetch_next_sessions()
+                continue
+            self._prefetch_model(request)
+
+    def _prefetch_next_sessions(self) -> None:
+        """
+        Prefetches the models of the sessions at the head of the queue. Sessions
+        further down the queue would only evict each other's models before
+        they run.
+        """
+        for session_id in self._services.queue.get_session_ids(PREFETCH_SESSIONS):
+            if session_id in self._prefetched_sessions:
+                continue
+            self._prefetched_sessions[session_id] = None
+            while len(self._prefetched_sessions) > 100:
+                del self._prefetched_sessions[next(iter(self._prefetched_sessions))]
+
+            state = self._services.graph_execution_manager.get(session_id)
+            if state is not None:
+                for request in get_graph_models(state.graph):
+                    self._prefetch_model(request)
+
+    def _prefetch_model(self, request: ModelRequest) -> None:
+        try:
+            self.mgr.get_model(*request, prefetch=True)
+        except CacheFullException:
+            self.logger.debug(f'No room to prefetch model {request}')
+        except Exception as e:
+            self.logger.debug(f'Could not prefetch model {request}: {e}')
+
+    def get_prefetch_stats(self) -> PrefetchStats:
+        return self.mgr.cache.get_prefetch_stats()
+
+    def get_model_hash(self, model_name: str, base_model: BaseModelType, model_type: ModelType) -> str:
+        return self.mgr.get_model_hash(model_name, base_model, model_type)
+
+    def get_annotator(self, name: str, loader: Callable[[], Any], gpu_load: bool = True) -> ModelCache.ModelLocker:
+        return self.mgr.cache.get_custom_model(f"annotator:{name}", lambda: Annotator(loader()), gpu_load=gpu_load)
+
+    def find_duplicate_models(self) -> List[List[str]]:
+        return self.mgr.find_duplicate_models()
+
     def get_model(
         self,
         model_name: str,
@@ -1,154 +1,288 @@
 import time
 import traceback
-from threading import Event, Thread, BoundedSemaphore
+from contextlib import nullcontext
+from threading import Event, RLock, Thread
+from typing import Optional
 
 from ..invocations.baseinvocation import InvocationContext
+from .graph import GraphExecutionState
+from .intermediates_sweeper import get_output_references
 from .invocation_queue import InvocationQueueItem
 from .invoker import InvocationProcessorABC, Invoker
 from ..models.exceptions import CanceledException
+from ..util.step_callback import flush_progress
 
 import invokeai.backend.util.logging as logger
+
+
+def check_worker_devices(devices: list[Optional[str]]) -> None:
+    """
+    Raises a ValueError if workers would run on more than one GPU. Workers
+    share a model cache, which moves the models they use to a single
+    execution device: a worker on another GPU would move a model away while
+    another worker runs it.
+    """
+    gpus = {d if ":" in d else f"{d}:0" for d in devices if d is not None and d != "cpu"}
+    if len(gpus) > 1:
+        raise ValueError(f"worker_devices may only list one GPU, got {', '.join(sorted(gpus))}")
+
+
 class DefaultInvocationProcessor(InvocationProcessorABC):
-    __invoker_thread: Thread
+    """Processes queued invocations on a pool of worker threads.
+
+    By default a single worker executes every invocation on the default
+    device. Set `worker_devices` in the configuration to start one worker
+    per listed device (e.g. `cpu cuda:0`), on at most one GPU (see
+    `check_worker_devices`). Workers bound to "cpu" only receive
+    cpu-only invocations (see `invocation_queue.is_cpu_invocation`), so that cheap image
+    and math operations do not wait behind generation on the other workers.
+
+    Sessions invoked with `invoke_all` enqueue every ready node at once, so
+    independent branches of a graph are spread across the available workers.
+    Workers take items from the invocation queue when they are idle, so that
+    the queue decides which item runs next.
+
+    The states of the sessions with executing nodes are kept in memory, and
+    only saved as their nodes complete: reading a state from storage rebuilds
+    the indexes of its graphs. A state saved by anyone else, e.g. when a
+    session is canceled, is dropped from memory and read again from storage.
+    """
+
+    __worker_threads: list[Thread]
+    # reentrant, since the processor's own saves call back __on_session_changed
+    __state_lock: RLock
+    # session id -> live state of the sessions with executing nodes
+    __states: dict[str, GraphExecutionState]
     __stop_event: Event
     __invoker: Invoker
-    __threadLimit: BoundedSemaphore
 
     def start(self, invoker) -> None:
-        # if we do want multithreading at some point, we could make this configurable
-        self.__threadLimit = BoundedSemaphore(1)
         self.__invoker = invoker
         self.__stop_event = Event()
-        self.__invoker_thread = Thread(
-            name="invoker_processor",
-            target=self.__process,
-            kwargs=dict(stop_event=self.__stop_event),
-        )
-        self.__invoker_thread.daemon = (
-            True  # TODO: make async and do not use threads
-        )
-        self.__invoker_thread.start()
+        self.__state_lock = RLock()
+        self.__states = dict()
+        invoker.services.graph_execution_manager.on_changed(self.__on_session_changed)
+        invoker.services.graph_execution_manager.on_deleted(self.__on_session_deleted)
+
+        config = invoker.services.configuration
+        devices = list(getattr(config, "worker_devices", None) or [None])
+        check_worker_devices(devices)
+
+        # cpu workers only get items of their own if there is some other
+        # worker available to run invocations that need the execution device
+        split = any(d != "cpu" for d in devices) and "cpu" in devices
+
+        self.__worker_threads = list()
+        for i, device in enumerate(devices):
+            worker_thread = Thread(
+                name=f"invoker_worker_{i}",
+                target=self.__work,
+                kwargs=dict(
+                    stop_event=self.__stop_event,
+                    cpu_only=(device == "cpu") if split else None,
+                    device=device,
+                ),
+            )
+            worker_thread.daemon = True  # TODO: make async and do not use threads
+            self.__worker_threads.append(worker_thread)
+
+        for worker_thread in self.__worker_threads:
+            worker_thread.start()
 
     def stop(self, *args, **kwargs) -> None:
         self.__stop_event.set()
+        # wake up the workers so that they can see the stop event
+        for _ in self.__worker_threads:
+            self.__invoker.services.queue.put(None)
 
-    def __process(self, stop_event: Event):
+    def __work(self, stop_event: Event, cpu_only: Optional[bool], device: Optional[str]):
+        """
+        Runs the items of the invocation queue that this worker can run. Idle
+        workers take items from the queue themselves, so that the queue decides
+        which item runs next, and workers of each kind only wait for their own.
+        """
         try:
-            self.__threadLimit.acquire()
             while not stop_event.is_set():
                 try:
-                    queue_item: InvocationQueueItem = self.__invoker.services.queue.get()
+                    queue_item: Optional[InvocationQueueItem] = self.__invoker.services.queue.get(cpu_only=cpu_only)
                 except Exception as e:
                     logger.debug("Exception while getting from queue: %s" % e)
-
-                if not queue_item:  # Probably stopping
                     # do not hammer the queue
                     time.sleep(0.5)
                     continue
 
-                graph_execution_state = (
-                    self.__invoker.services.graph_execution_manager.get(
-                        queue_item.graph_execution_state_id
-                    )
-                )
-                invocation = graph_execution_state.execution_graph.get_node(
-                    queue_item.invocation_id
-                )
+                if not queue_item:  # Probably stopping
+                    continue
 
-                # get the source node id to provide to clients (the prepared node id is not as useful)
-                source_node_id = graph_execution_state.prepared_source_mapping[invocation.id]
+                with self.__device_context(device):
+                    try:
+                        self.__process(queue_item)
+                    finally:
+                        self.__invoker.services.queue.task_done(queue_item)
 
-                # Send starting event
-                self.__invoker.services.events.emit_invocation_started(
-                    graph_execution_state_id=graph_execution_state.id,
-                    node=invocation.dict(),
-                    source_node_id=source_node_id
-                )
+        except KeyboardInterrupt:
+            pass  # Log something? KeyboardInterrupt is probably not going to be seen by the processor
 
-                # Invoke
-                try:
-                    outputs = invocation.invoke(
-                        InvocationContext(
-                            services=self.__invoker.services,
-                            graph_execution_state_id=graph_execution_state.id,
-                        )
-                    )
+    def __device_context(self, device: Optional[str]):
+        """Makes `device` the current cuda device of the worker thread, if it is one"""
+        if device is None or not device.startswith("cuda:"):
+            return nullcontext()
 
-                    # Check queue to see if this is canceled, and skip if so
-                    if self.__invoker.services.queue.is_canceled(
-                        graph_execution_state.id
-                    ):
-                        continue
+        import torch
 
-                    # Save outputs and history
-                    graph_execution_state.complete(invocation.id, outputs)
+        return torch.cuda.device(torch.device(device))
 
-                    # Save the state changes
-                    self.__invoker.services.graph_execution_manager.set(
-                        graph_execution_state
-                    )
+    def __get_state(self, graph_execution_state_id: str) -> GraphExecutionState:
+        """Gets the live state of a session, reading it from storage unless it is executing. Call with the state lock."""
+        graph_execution_state = self.__states.get(graph_execution_state_id)
+        if graph_execution_state is None:
+            graph_execution_state = self.__invoker.services.graph_execution_manager.get(graph_execution_state_id)
+            if graph_execution_state is not None and graph_execution_state.executing:
+                self.__states[graph_execution_state_id] = graph_execution_state
+        return graph_execution_state
+
+    def __on_session_changed(self, graph_execution_state: GraphExecutionState) -> None:
+        with self.__state_lock:
+            # saved by someone else, e.g. when canceled
+            if self.__states.get(graph_execution_state.id) is not graph_execution_state:
+                self.__states.pop(graph_execution_state.id, None)
+
+    def __on_session_deleted(self, graph_execution_state_id: str) -> None:
+        with self.__state_lock:
+            self.__states.pop(graph_execution_state_id, None)
+
+    def __process(self, queue_item: InvocationQueueItem):
+        with self.__state_lock:
+            graph_execution_state = self.__get_state(queue_item.graph_execution_state_id)
+            invocation = graph_execution_state.execution_graph.get_node(
+                queue_item.invocation_id
+            )
+
+            # get the source node id to provide to clients (the prepared node id is not as useful)
+            source_node_id = graph_execution_state.prepared_source_mapping[invocation.id]
+
+        # Send starting event
+        self.__invoker.services.events.emit_invocation_started(
+            graph_execution_state_id=graph_execution_state.id,
+            node=invocation.dict(),
+            source_node_id=source_node_id
+        )
+
+        # Invoke
+        outputs = None
+        error = None
+        try:
+            # reuse the outputs of an identical invocation
+            invocation_cache = self.__invoker.services.invocation_cache
+            cache_key = invocation_cache.create_key(invocation) if invocation_cache is not None else None
+            if cache_key is not None:
+                outputs = invocation_cache.get(cache_key)
 
-                    # Send complete event
-                    self.__invoker.services.events.emit_invocation_complete(
+            if outputs is None:
+                outputs = invocation.invoke(
+                    InvocationContext(
+                        services=self.__invoker.services,
                         graph_execution_state_id=graph_execution_state.id,
-                        node=invocation.dict(),
-                        source_node_id=source_node_id,
-                        result=outputs.dict(),
                     )
+                )
+                if cache_key is not None:
+                    invocation_cache.save(cache_key, outputs)
 
-                except KeyboardInterrupt:
-                    pass
+        except KeyboardInterrupt:
+            pass
 
-                except CanceledException:
-                    pass
+        except CanceledException:
+            pass
 
-                except Exception as e:
-                    error = traceback.format_exc()
-                    logger.error(error)
+        except Exception as e:
+            error = traceback.format_exc()
+            logger.error(error)
 
-                    # Save error
-                    graph_execution_state.set_node_error(invocation.id, error)
+        finally:
+            # progress events are emitted in the background, and must not
+            # reach clients after the node completed
+            flush_progress(graph_execution_state.id, source_node_id)
 
-                    # Save the state changes
-                    self.__invoker.services.graph_execution_manager.set(
-                        graph_execution_state
-                    )
+        if outputs is None and error is None:
+            return
+
+        # sessions resume from their saved state after a crash, so the
+        # latents their results reference are stored, in the background
+        latents = self.__invoker.services.latents
+        if outputs is not None and latents is not None:
+            try:
+                latents.flush(list(get_output_references([outputs])[0]))
+            except Exception as e:
+                logger.warning(f"Could not store the latents of {invocation.id}: {e}")
+
+        # Other nodes of this session may have completed while this one was running,
+        # so apply the changes to the latest state
+        with self.__state_lock:
+            # Check queue to see if this is canceled, and skip if so
+            if self.__invoker.services.queue.is_canceled(
+                graph_execution_state.id
+            ):
+                self.__states.pop(graph_execution_state.id, None)
+                return
+
+            graph_execution_state = self.__get_state(queue_item.graph_execution_state_id)
+            was_complete = graph_execution_state.is_complete()
 
-                    # Send error event
+            if error is None:
+                # Save outputs and history
+                graph_execution_state.complete(invocation.id, outputs)
+
+                # Save the state changes
+                self.__invoker.services.graph_execution_manager.set(
+                    graph_execution_state
+                )
+
+                # Send complete event
+                self.__invoker.services.events.emit_invocation_complete(
+                    graph_execution_state_id=graph_execution_state.id,
+                    node=invocation.dict(),
+                    source_node_id=source_node_id,
+                    result=outputs.dict(),
+                )
+
+            else:
+                # Save error
+                graph_execution_state.set_node_error(invocation.id, error)
+
+                # Save the state changes
+                self.__invoker.services.graph_execution_manager.set(
+                    graph_execution_state
+                )
+
+                # Send error event
+                self.__invoker.services.events.emit_invocation_error(
+                    graph_execution_state_id=graph_execution_state.id,
+                    node=invocation.dict(),
+                    source_node_id=source_node_id,
+                    error=error,
+                )
+
+            # Queue any further commands if invoking all
+            is_complete = graph_execution_state.is_complete()
+            if was_complete:
+                pass  # completion was already reported by another node
+            elif queue_item.invoke_all and not is_complete:
+                try:
+                    self.__invoker.invoke(
+                        graph_execution_state, invoke_all=True, priority=queue_item.priority
+                    )
+                except Exception as e:
+                    logger.error("Error while invoking: %s" % e)
                     self.__invoker.services.events.emit_invocation_error(
                         graph_execution_state_id=graph_execution_state.id,
                         node=invocation.dict(),
                         source_node_id=source_node_id,
-                        error=error,
+                        error=traceback.format_exc()
                     )
-
-                    pass
-
-                # Check queue to see if this is canceled, and skip if so
-                if self.__invoker.services.queue.is_canceled(
+            elif is_complete:
+                self.__invoker.services.events.emit_graph_execution_complete(
                     graph_execution_state.id
-                ):
-                    continue
-
-                # Queue any further commands if invoking all
-                is_complete = graph_execution_state.is_complete()
-                if queue_item.invoke_all and not is_complete:
-                    try:
-                        self.__invoker.invoke(graph_execution_state, invoke_all=True)
-                    except Exception as e:
-                        logger.error("Error while invoking: %s" % e)
-                        self.__invoker.services.events.emit_invocation_error(
-                            graph_execution_state_id=graph_execution_state.id,
-                            node=invocation.dict(),
-                            source_node_id=source_node_id,
-                            error=traceback.format_exc()
-                        )
-                elif is_complete:
-                    self.__invoker.services.events.emit_graph_execution_complete(
-                        graph_execution_state.id
-                    )
+                )
 
-        except KeyboardInterrupt:
-            pass  # Log something? KeyboardInterrupt is probably not going to be seen by the processor
-        finally:
-            self.__threadLimit.release()
+            if not graph_execution_state.executing:
+                self.__states.pop(graph_execution_state.id, None)
@@ -1,34 +1,149 @@
+import os
 import sqlite3
-from threading import Lock
-from typing import Generic, Optional, TypeVar, get_args
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Generic, Iterator, List, Optional, TypeVar, get_args
 
 from pydantic import BaseModel, parse_raw_as
 
-from .item_storage import ItemStorageABC, PaginatedResults
+from .item_storage import CursorPaginatedResults, ItemStorageABC, ItemSummary, PaginatedResults
 
 T = TypeVar("T", bound=BaseModel)
 
 sqlite_memory = ":memory:"
 
 
+class SqliteDatabase:
+    """A sqlite database shared by all the storages that use the same file.
+
+    Writes go through a single connection guarded by `lock`. Database files
+    are switched to write-ahead logging, so that reads do not wait for writes:
+    `reader()` hands out a connection per thread which does not take the lock.
+
+    In-memory databases only exist for the connection that created them, so
+    they are read through the write connection while holding the lock.
+    """
+
+    filename: str
+    conn: sqlite3.Connection
+    lock: threading.RLock
+    _synchronous: str
+    _cache_size: float
+    _readers: threading.local
+
+    def __init__(self, filename: str, synchronous: str = "NORMAL", cache_size: float = 2.0):
+        self.filename = str(filename)
+        self.lock = threading.RLock()
+        self._synchronous = synchronous
+        self._cache_size = cache_size
+        self._readers = threading.local()
+
+        self.conn = self._connect(check_same_thread=False)
+        if not self.is_memory:
+            self.conn.execute("PRAGMA journal_mode = WAL;")
+
+    @property
+    def is_memory(self) -> bool:
+        return self.filename == sqlite_memory
+
+    @property
+    def has_fts5(self) -> bool:
+        """Whether sqlite was built with the FTS5 full-text search extension"""
+        with self.lock:
+            try:
+                self.conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text);")
+                self.conn.execute("DROP TABLE temp.fts5_probe;")
+                return True
+            except sqlite3.OperationalError:
+                return False
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.filename, **kwargs)
+        # Enable row factory to get rows as dictionaries (must be done before making a cursor!)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA synchronous = {self._synchronous};")
+        # negative sizes are in KiB rather than pages
+        conn.execute(f"PRAGMA cache_size = {-int(self._cache_size * 1024)};")
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Cursor]:
+        """Gets a cursor for reading from the database, on a connection owned by the calling thread.
+        The reads made with the cursor see a single snapshot of the database."""
+        if self.is_memory:
+            with self.lock:
+                yield self.conn.cursor()
+            return
+
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = ON;")
+            self._readers.conn = conn
+
+        cursor = conn.cursor()
+        cursor.execute("BEGIN;")
+        try:
+            yield cursor
+        finally:
+            cursor.execute("COMMIT;")
+            cursor.close()
+
+
+_databases: dict[str, SqliteDatabase] = dict()
+_databases_lock = threading.Lock()
+
+
+def get_database(filename: str, synchronous: str = "NORMAL", cache_size: float = 2.0) -> SqliteDatabase:
+    """Gets the shared database for a file, opening it with the given settings if it is not open yet.
+    Every call with `sqlite_memory` opens a new, separate in-memory database."""
+    if str(filename) == sqlite_memory:
+        return SqliteDatabase(sqlite_memory, synchronous=synchronous, cache_size=cache_size)
+
+    key = os.path.abspath(filename)
+    with _databases_lock:
+        if key not in _databases:
+            _databases[key] = SqliteDatabase(filename, synchronous=synchronous, cache_size=cache_size)
+        return _databases[key]
+
+
 class SqliteItemStorage(ItemStorageABC, Generic[T]):
+    """Stores pydantic models as json in a sqlite table.
+
+    If `search_text` is given, items are searched through a full-text (FTS5)
+    index of the text it returns for each item, rather than by matching the
+    raw json. Searches then match words by prefix, e.g. "ban" finds "Banana".
+    """
+
     _filename: str
     _table_name: str
+    _search_table_name: Optional[str]
+    _search_text: Optional[Callable[[T], str]]
+    _index_pending: bool
+    _db: SqliteDatabase
     _conn: sqlite3.Connection
     _cursor: sqlite3.Cursor
     _id_field: str
-    _lock: Lock
+    _lock: threading.RLock
 
-    def __init__(self, filename: str, table_name: str, id_field: str = "id"):
+    def __init__(
+        self,
+        filename: str,
+        table_name: str,
+        id_field: str = "id",
+        search_text: Optional[Callable[[T], str]] = None,
+    ):
         super().__init__()
 
         self._filename = filename
         self._table_name = table_name
         self._id_field = id_field  # TODO: validate that T has this field
-        self._lock = Lock()
-        self._conn = sqlite3.connect(
-            self._filename, check_same_thread=False
-        )  # TODO: figure out a better threading solution
+        self._search_text = search_text
+        self._search_table_name = None
+        self._index_pending = False
+        self._db = get_database(filename)
+        self._lock = self._db.lock
+        self._conn = self._db.conn
         self._cursor = self._conn.cursor()
 
         self._create_table()
@@ -44,6 +159,47 @@ class SqliteItemStorage(ItemStorageABC, Generic[T]):
             self._cursor.execute(
                 f"""CREATE UNIQUE INDEX IF NOT EXISTS {self._table_name}_id ON {self._table_name}(id);"""
             )
+            if self._search_text is not None and self._db.has_fts5:
+                self._create_search_table()
+            self._conn.commit()
+        finally:
+            self._lock.release()
+
+    def _create_search_table(self):
+        """Creates the full-text index of the items, indexing any items stored before it existed"""
+        self._search_table_name = f"{self._table_name}_search"
+        self._cursor.execute(
+            """SELECT 1 FROM sqlite_master WHERE name = ?;""", (self._search_table_name,)
+        )
+        if self._cursor.fetchone() is not None:
+            return
+
+        # Rows of the index have the rowid of the item they index
+        self._cursor.execute(
+            f"""CREATE VIRTUAL TABLE {self._search_table_name} USING fts5(text);"""
+        )
+        self._cursor.execute(f"""SELECT 1 FROM {self._table_name} LIMIT 1;""")
+        self._index_pending = self._cursor.fetchone() is not None
+
+    def _index_existing_items(self):
+        """Indexes the items stored before the index was created.
+        This is not done on creation, as the item type is not known before __init__ returns."""
+        if not self._index_pending:
+            return
+
+        try:
+            self._lock.acquire()
+            rows = self._conn.execute(
+                f"""SELECT rowid, item FROM {self._table_name}
+                WHERE rowid NOT IN (SELECT rowid FROM {self._search_table_name});"""
+            )
+            while batch := rows.fetchmany(100):
+                self._cursor.executemany(
+                    f"""INSERT INTO {self._search_table_name} (rowid, text) VALUES (?, ?);""",
+                    [(r[0], self._search_text(self._parse_item(r[1]))) for r in batch],
+                )
+            self._conn.commit()
+            self._index_pending = False
         finally:
             self._lock.release()
 
@@ -51,42 +207,86 @@ class SqliteItemStorage(ItemStorageABC, Generic[T]):
         item_type = get_args(self.__orig_class__)[0]
         return parse_raw_as(item_type, item)
 
+    def _parse_items(self, cursor: sqlite3.Cursor, items: list[str]) -> list[T]:
+        """Parses items read with `cursor`"""
+        return [self._parse_item(i) for i in items]
+
+    def _write_item(self, item: T, raw: str):
+        """Writes an item and indexes it. Must be called with the lock held."""
+        # Updates keep the rowid, and so the position of the item in lists
+        self._cursor.execute(
+            f"""INSERT INTO {self._table_name} (item) VALUES (?)
+            ON CONFLICT(id) DO UPDATE SET item = excluded.item;""",
+            (raw,),
+        )
+        if self._search_table_name is None:
+            return
+
+        self._cursor.execute(
+            f"""SELECT rowid FROM {self._table_name} WHERE id = ?;""",
+            (str(getattr(item, self._id_field)),),
+        )
+        rowid = self._cursor.fetchone()[0]
+        self._cursor.execute(
+            f"""DELETE FROM {self._search_table_name} WHERE rowid = ?;""", (rowid,)
+        )
+        self._cursor.execute(
+            f"""INSERT INTO {self._search_table_name} (rowid, text) VALUES (?, ?);""",
+            (rowid, self._search_text(item)),
+        )
+
+    def _delete_item(self, id: str):
+        """Deletes an item and its index entry. Must be called with the lock held."""
+        if self._search_table_name is not None:
+            self._cursor.execute(
+                f"""DELETE FROM {self._search_table_name}
+                WHERE rowid IN (SELECT rowid FROM {self._table_name} WHERE id = ?);""",
+                (str(id),),
+            )
+        self._cursor.execute(
+            f"""DELETE FROM {self._table_name} WHERE id = ?;""", (str(id),)
+        )
+
+    def _get_search_filter(self, query: str) -> tuple[str, list[str]]:
+        """Gets the condition and parameters matching items of the table (as `t`) to a query"""
+        if self._search_table_name is None:
+            return "t.item LIKE ?", [f"%{query}%"]
+
+        self._index_existing_items()
+
+        # Quote every word so that it is not parsed as FTS5 syntax, and match it as a prefix
+        match = " ".join('"' + word.replace('"', '""') + '"*' for word in query.split())
+        return (
+            f"t.rowid IN (SELECT rowid FROM {self._search_table_name} WHERE {self._search_table_name} MATCH ?)",
+            [match],
+        )
+
     def set(self, item: T):
         try:
             self._lock.acquire()
-            self._cursor.execute(
-                f"""INSERT OR REPLACE INTO {self._table_name} (item) VALUES (?);""",
-                (item.json(),),
-            )
+            self._write_item(item, item.json())
             self._conn.commit()
         finally:
             self._lock.release()
         self._on_changed(item)
 
     def get(self, id: str) -> Optional[T]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
+        with self._db.reader() as cursor:
+            cursor.execute(
                 f"""SELECT item FROM {self._table_name} WHERE id = ?;""", (str(id),)
             )
-            result = self._cursor.fetchone()
-        finally:
-            self._lock.release()
+            result = cursor.fetchone()
+            if not result:
+                return None
 
-        if not result:
-            return None
-
-        return self._parse_item(result[0])
+            return self._parse_items(cursor, [result[0]])[0]
 
     def get_raw(self, id: str) -> Optional[str]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
+        with self._db.reader() as cursor:
+            cursor.execute(
                 f"""SELECT item FROM {self._table_name} WHERE id = ?;""", (str(id),)
             )
-            result = self._cursor.fetchone()
-        finally:
-            self._lock.release()
+            result = cursor.fetchone()
 
         if not result:
             return None
@@ -96,29 +296,23 @@ class SqliteItemStorage(ItemStorageABC, Generic[T]):
     def delete(self, id: str):
         try:
             self._lock.acquire()
-            self._cursor.execute(
-                f"""DELETE FROM {self._table_name} WHERE id = ?;""", (str(id),)
-            )
+            self._delete_item(id)
             self._conn.commit()
         finally:
             self._lock.release()
         self._on_deleted(id)
 
     def list(self, page: int = 0, per_page: int = 10) -> PaginatedResults[T]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
+        with self._db.reader() as cursor:
+            cursor.execute(
                 f"""SELECT item FROM {self._table_name} LIMIT ? OFFSET ?;""",
                 (per_page, page * per_page),
             )
-            result = self._cursor.fetchall()
-
-            items = list(map(lambda r: self._parse_item(r[0]), result))
+            result = cursor.fetchall()
+            items = self._parse_items(cursor, [r[0] for r in result])
 
-            self._cursor.execute(f"""SELECT count(*) FROM {self._table_name};""")
-            count = self._cursor.fetchone()[0]
-        finally:
-            self._lock.release()
+            cursor.execute(f"""SELECT count(*) FROM {self._table_name};""")
+            count = cursor.fetchone()[0]
 
         pageCount = int(count / per_page) + 1
 
@@ -129,26 +323,78 @@ class SqliteItemStorage(ItemStorageABC, Generic[T]):
     def search(
         self, query: str, page: int = 0, per_page: int = 10
     ) -> PaginatedResults[T]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
-                f"""SELECT item FROM {self._table_name} WHERE item LIKE ? LIMIT ? OFFSET ?;""",
-                (f"%{query}%", per_page, page * per_page),
+        condition, params = self._get_search_filter(query)
+        with self._db.reader() as cursor:
+            cursor.execute(
+                f"""SELECT t.item FROM {self._table_name} t WHERE {condition} LIMIT ? OFFSET ?;""",
+                (*params, per_page, page * per_page),
             )
-            result = self._cursor.fetchall()
-
-            items = list(map(lambda r: self._parse_item(r[0]), result))
+            result = cursor.fetchall()
+            items = self._parse_items(cursor, [r[0] for r in result])
 
-            self._cursor.execute(
-                f"""SELECT count(*) FROM {self._table_name} WHERE item LIKE ?;""",
-                (f"%{query}%",),
+            cursor.execute(
+                f"""SELECT count(*) FROM {self._table_name} t WHERE {condition};""",
+                params,
             )
-            count = self._cursor.fetchone()[0]
-        finally:
-            self._lock.release()
+            count = cursor.fetchone()[0]
 
         pageCount = int(count / per_page) + 1
 
         return PaginatedResults[T](
             items=items, page=page, pages=pageCount, per_page=per_page, total=count
         )
+
+    def _get_page(
+        self, cursor: sqlite3.Cursor, columns: str, after: Optional[str], per_page: int, query: str
+    ) -> tuple[List[sqlite3.Row], Optional[str]]:
+        """Gets a page of rows ordered by id, and the id to get the next page after"""
+        conditions = ["1=1"]
+        params: list[Any] = list()
+        if after is not None:
+            conditions.append("t.id > ?")
+            params.append(after)
+        if query:
+            condition, query_params = self._get_search_filter(query)
+            conditions.append(condition)
+            params.extend(query_params)
+
+        # Get one more row to know if there is a next page
+        cursor.execute(
+            f"""SELECT t.id, {columns} FROM {self._table_name} t
+            WHERE {" AND ".join(conditions)} ORDER BY t.id LIMIT ?;""",
+            (*params, per_page + 1),
+        )
+        rows = cursor.fetchall()
+        if len(rows) <= per_page:
+            return rows, None
+
+        rows = rows[:per_page]
+        return rows, rows[-1][0]
+
+    def list_after(
+        self, after: Optional[str] = None, per_page: int = 10, query: str = ""
+    ) -> CursorPaginatedResults[T]:
+        with self._db.reader() as cursor:
+            rows, next_cursor = self._get_page(cursor, "t.item", after, per_page, query)
+            items = self._parse_items(cursor, [r[1] for r in rows])
+
+        return CursorPaginatedResults[T](
+            items=items, per_page=per_page, next_cursor=next_cursor
+        )
+
+    def list_summaries(
+        self, after: Optional[str] = None, per_page: int = 10, query: str = ""
+    ) -> CursorPaginatedResults[ItemSummary]:
+        if self._search_table_name is None:
+            columns = "NULL"
+        else:
+            columns = f"""(SELECT s.text FROM {self._search_table_name} s WHERE s.rowid = t.rowid)"""
+
+        with self._db.reader() as cursor:
+            rows, next_cursor = self._get_page(cursor, columns, after, per_page, query)
+
+        return CursorPaginatedResults[ItemSummary](
+            items=[ItemSummary(id=r[0], text=r[1]) for r in rows],
+            per_page=per_page,
+            next_cursor=next_cursor,
+        )
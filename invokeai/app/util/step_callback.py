@@ -1,3 +1,10 @@
+import threading
+import time
+from typing import Callable, Optional
+
+import torch
+
+import invokeai.backend.util.logging as logger
 from invokeai.app.models.exceptions import CanceledException
 from invokeai.app.models.image import ProgressImage
 from ..invocations.baseinvocation import InvocationContext
@@ -5,6 +12,106 @@ from ...backend.util.util import image_to_dataURL
 from ...backend.generator.base import Generator
 from ...backend.stable_diffusion import PipelineIntermediateState
 
+# Emits the progress of a node, given its progress image if there is one
+ProgressEmitter = Callable[[Optional[ProgressImage]], None]
+
+
+class ProgressImageEncoder:
+    """Emits progress events, encoding their progress images on a background thread.
+
+    Decoding latents to a preview and compressing it to JPEG waits for the
+    device and takes a while on the CPU, which used to stall the sampler at
+    every step. Steps now only hand their latents over. If the encoder falls
+    behind, the progress of a node that was not emitted yet is replaced by
+    the latest one (keeping its latents if the latest has none), so that
+    events are never queued up and always reach clients in order.
+    """
+
+    _encoder: Optional["ProgressImageEncoder"] = None
+    _encoder_lock = threading.Lock()
+
+    def __init__(self):
+        self.__pending: dict[tuple[str, str], tuple[ProgressEmitter, Optional[torch.Tensor]]] = dict()
+        self.__emitting: set[tuple[str, str]] = set()
+        self.__last_image_times: dict[tuple[str, str], float] = dict()
+        self.__condition = threading.Condition()
+        self.__thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def get_encoder(cls) -> "ProgressImageEncoder":
+        with cls._encoder_lock:
+            if cls._encoder is None:
+                cls._encoder = cls()
+            return cls._encoder
+
+    def wants_image(self, key: tuple[str, str], step: int, interval: int, max_rate: float) -> bool:
+        """
+        Whether a step of a node should have a progress image: one every
+        `interval` steps (none if 0), at most `max_rate` per second (no limit
+        if 0).
+        """
+        if interval <= 0 or step % interval != 0:
+            return False
+        now = time.monotonic()
+        with self.__condition:
+            if max_rate > 0 and now - self.__last_image_times.get(key, -1e9) < 1 / max_rate:
+                return False
+            self.__last_image_times[key] = now
+            return True
+
+    def submit(self, key: tuple[str, str], emit: ProgressEmitter, sample: Optional[torch.Tensor] = None) -> None:
+        """Emits the progress of a node in the background, with an image of `sample` if given"""
+        with self.__condition:
+            if sample is None and key in self.__pending:
+                sample = self.__pending[key][1]
+            self.__pending[key] = (emit, sample)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="progress_image_encoder", daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+
+    def flush(self, key: tuple[str, str], timeout: float = 5.0) -> None:
+        """Waits for the progress of a node to be emitted, and forgets about the node"""
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: key not in self.__pending and key not in self.__emitting, timeout=timeout
+            )
+            self.__last_image_times.pop(key, None)
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending)
+                key = next(iter(self.__pending))
+                emit, sample = self.__pending.pop(key)
+                self.__emitting.add(key)
+
+            try:
+                emit(encode_progress_image(sample) if sample is not None else None)
+            except Exception as e:
+                logger.warning(f"Could not emit progress: {e}")
+            finally:
+                with self.__condition:
+                    self.__emitting.discard(key)
+                    self.__condition.notify_all()
+
+
+@torch.no_grad()
+def encode_progress_image(sample: torch.Tensor) -> ProgressImage:
+    image = Generator.sample_to_lowres_estimated_image(sample)
+
+    (width, height) = image.size
+    width *= 8
+    height *= 8
+
+    dataURL = image_to_dataURL(image, image_format="JPEG")
+    return ProgressImage(width=width, height=height, dataURL=dataURL)
+
+
+def flush_progress(graph_execution_state_id: str, source_node_id: str) -> None:
+    """Waits for the progress events of a node to be emitted"""
+    ProgressImageEncoder.get_encoder().flush((graph_execution_state_id, source_node_id))
+
 
 def stable_diffusion_step_callback(
     context: InvocationContext,
@@ -36,20 +143,27 @@ def stable_diffusion_step_callback(
     #     latents = sample
     #     step = intermediate_state.step
 
-    # TODO: only output a preview image when requested
-    image = Generator.sample_to_lowres_estimated_image(sample)
-
-    (width, height) = image.size
-    width *= 8
-    height *= 8
+    encoder = ProgressImageEncoder.get_encoder()
+    key = (context.graph_execution_state_id, source_node_id)
+    config = context.services.configuration
+    # only render a preview when someone is there to see it
+    wants_image = context.services.events.has_session_subscribers(
+        context.graph_execution_state_id
+    ) and encoder.wants_image(
+        key,
+        intermediate_state.step,
+        interval=config.progress_image_interval,
+        max_rate=config.progress_image_max_rate,
+    )
 
-    dataURL = image_to_dataURL(image, image_format="JPEG")
+    def emit(progress_image: Optional[ProgressImage]) -> None:
+        context.services.events.emit_generator_progress(
+            graph_execution_state_id=context.graph_execution_state_id,
+            node=node,
+            source_node_id=source_node_id,
+            progress_image=progress_image,
+            step=intermediate_state.step,
+            total_steps=node["steps"],
+        )
 
-    context.services.events.emit_generator_progress(
-        graph_execution_state_id=context.graph_execution_state_id,
-        node=node,
-        source_node_id=source_node_id,
-        progress_image=ProgressImage(width=width, height=height, dataURL=dataURL),
-        step=intermediate_state.step,
-        total_steps=node["steps"],
-    )
+    encoder.submit(key, emit, sample if wants_image else None)
@@ -4,6 +4,7 @@ including img2img, txt2img, and inpaint
 """
 from __future__ import annotations
 
+import functools
 import itertools
 import dataclasses
 import diffusers
@@ -34,6 +35,23 @@ from ..stable_diffusion.schedulers import SCHEDULER_MAP
 
 downsampling = 8
 
+
+@functools.lru_cache(maxsize=None)
+def get_latent_rgb_factors(device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+    """Gets the matrix that maps latents to approximate RGB colors, created once per device and dtype"""
+    # these updated numbers for v1.5 are from @torridgristle
+    return torch.tensor(
+        [
+            #    R        G        B
+            [0.3444, 0.1385, 0.0670],  # L1
+            [0.1247, 0.4027, 0.1494],  # L2
+            [-0.3192, 0.2513, 0.2103],  # L3
+            [-0.1307, -0.1874, -0.7445],  # L4
+        ],
+        dtype=dtype,
+        device=device,
+    )
+
 @dataclass
 class InvokeAIGeneratorBasicParams:
     seed: Optional[int]=None
@@ -453,21 +471,9 @@ class Generator:
     def sample_to_lowres_estimated_image(samples):
         # origingally adapted from code by @erucipe and @keturn here:
         # https://discuss.huggingface.co/t/decoding-latents-to-rgb-without-upscaling/23204/7
+        latent_rgb_factors = get_latent_rgb_factors(samples.device, samples.dtype)
 
-        # these updated numbers for v1.5 are from @torridgristle
-        v1_5_latent_rgb_factors = torch.tensor(
-            [
-                #    R        G        B
-                [0.3444, 0.1385, 0.0670],  # L1
-                [0.1247, 0.4027, 0.1494],  # L2
-                [-0.3192, 0.2513, 0.2103],  # L3
-                [-0.1307, -0.1874, -0.7445],  # L4
-            ],
-            dtype=samples.dtype,
-            device=samples.device,
-        )
-
-        latent_image = samples[0].permute(1, 2, 0) @ v1_5_latent_rgb_factors
+        latent_image = samples[0].permute(1, 2, 0) @ latent_rgb_factors
         latents_ubyte = (
             ((latent_image + 1) / 2)
             .clamp(0, 1)  # change scale from -1..1 to 0..1
@@ -201,16 +201,17 @@ class ModelInstall(object):
             models_installed.update({str(path):self._install_path(path)})
 
         # folders style or similar
-        elif path.is_dir() and any([(path/x).exists() for x in \
-                                    {'config.json','model_index.json','learned_embeds.bin','pytorch_lora_weights.bin'}
-                                    ]
-                                   ):
+        elif self._is_model_folder(path):
             models_installed.update(self._install_path(path))
 
         # recursive scan
         elif path.is_dir():
-            for child in path.iterdir():
-                self.heuristic_import(child, models_installed=models_installed)
+            children = list(path.iterdir())
+            models = [x for x in children if x.is_file() or self._is_model_folder(x)]
+            models_installed.update(self._install_paths(models))
+            for child in children:
+                if child not in models:
+                    self.heuristic_import(child, models_installed=models_installed)
 
         # huggingface repo
         elif len(str(model_path_id_or_url).split('/')) == 2:
@@ -225,6 +226,24 @@ class ModelInstall(object):
 
         return models_installed
 
+    @classmethod
+    def _is_model_folder(cls, path: Path)->bool:
+        return path.is_dir() and any([(path/x).exists() for x in \
+                                      {'config.json','model_index.json','learned_embeds.bin','pytorch_lora_weights.bin'}
+                                      ]
+                                     )
+
+    # install several models from local paths, probing them in parallel beforehand
+    def _install_paths(self, paths: List[Path])->Dict[str, AddModelResult]:
+        infos = ModelProbe.probe_many(paths, self.prediction_helper)
+        models_installed = dict()
+        for path in paths:
+            try:
+                models_installed.update({str(path): self._install_path(path, infos.get(path))})
+            except Exception as e:
+                logger.warning(str(e))
+        return models_installed
+
     # install a model from a local path. The optional info parameter is there to prevent
     # the model from being probed twice in the event that it has already been probed.
     def _install_path(self, path: Path, info: ModelProbeInfo=None)->AddModelResult:
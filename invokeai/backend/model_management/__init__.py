@@ -2,7 +2,8 @@
 Initialization file for invokeai.backend.model_management
 """
 from .model_manager import ModelManager, ModelInfo, AddModelResult, SchedulerPredictionType
-from .model_cache import ModelCache
+from .model_cache import ModelCache, PrefetchStats
+from .cache_policy import CachePolicy, CACHE_POLICIES
 from .models import BaseModelType, ModelType, SubModelType, ModelVariantType
 from .model_merge import ModelMerger, MergeInterpolationMethod
 
@@ -0,0 +1,47 @@
+"""
+Image annotators (e.g. the edge and depth detectors of controlnet_aux),
+wrapped so that the model cache can keep them with the other models.
+"""
+
+from typing import Any, List
+
+import torch
+
+
+class Annotator(torch.nn.Module):
+    """
+    A detector as a module: its networks are registered as submodules, so
+    that the model cache can measure the detector, and it reports the device
+    they are on. Calling it calls the detector.
+    """
+
+    def __init__(self, detector: Any):
+        super().__init__()
+        self.detector = detector
+        self.networks = torch.nn.ModuleList(find_modules(detector))
+
+    @property
+    def device(self) -> torch.device:
+        for tensor in self.parameters():
+            return tensor.device
+        return torch.device("cpu")
+
+    def to(self, *args, **kwargs) -> "Annotator":
+        # detectors know how to move whatever their networks are wrapped in
+        if hasattr(self.detector, "to"):
+            self.detector.to(*args, **kwargs)
+        else:
+            super().to(*args, **kwargs)
+        return self
+
+    def forward(self, *args, **kwargs) -> Any:
+        return self.detector(*args, **kwargs)
+
+
+def find_modules(obj: Any, depth: int = 0) -> List[torch.nn.Module]:
+    """Finds the modules an object holds, e.g. in the estimators of a pose detector"""
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    if depth >= 3 or not hasattr(obj, "__dict__"):
+        return []
+    return [module for value in vars(obj).values() for module in find_modules(value, depth + 1)]
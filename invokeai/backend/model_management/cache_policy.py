@@ -0,0 +1,130 @@
+"""
+Eviction policies of the model cache.
+
+The cache has two tiers: the models in RAM, and the models of those that
+are also loaded into VRAM. Each tier has its own policy, which is told
+about every access to a model of the tier and decides which models leave
+it first when room has to be made.
+
+Time is counted in accesses rather than seconds, so that a policy behaves
+the same whether it runs in the cache or replays a trace of its accesses
+(see scripts/simulate_model_cache.py).
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, Union
+
+
+class CachePolicy(ABC):
+    """Decides the order in which cached models are evicted"""
+
+    @abstractmethod
+    def touch(self, key: str) -> None:
+        """Records an access to a model, adding it to the tracked models"""
+        pass
+
+    @abstractmethod
+    def remove(self, key: str) -> None:
+        """Stops tracking a model that left the cache"""
+        pass
+
+    @abstractmethod
+    def victims(self) -> List[str]:
+        """Gets the tracked models, in the order they should be evicted"""
+        pass
+
+
+class LRUPolicy(CachePolicy):
+    """Evicts the least recently used model first"""
+
+    def __init__(self):
+        self._keys: OrderedDict[str, None] = OrderedDict()
+
+    def touch(self, key: str) -> None:
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+
+    def remove(self, key: str) -> None:
+        self._keys.pop(key, None)
+
+    def victims(self) -> List[str]:
+        return list(self._keys)
+
+
+class LFUPolicy(CachePolicy):
+    """Evicts the least frequently used model first, the least recently used of them on ties.
+
+    Access counts are kept after a model is evicted, so that a model that
+    keeps coming back is not treated as new. There are only as many keys as
+    installed models.
+    """
+
+    def __init__(self):
+        self._clock = 0
+        self._counts: Dict[str, int] = dict()
+        self._last_access: Dict[str, int] = dict()
+        self._keys: set = set()
+
+    def touch(self, key: str) -> None:
+        self._clock += 1
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._last_access[key] = self._clock
+        self._keys.add(key)
+
+    def remove(self, key: str) -> None:
+        self._keys.discard(key)
+
+    def victims(self) -> List[str]:
+        return sorted(self._keys, key=lambda k: (self._counts[k], self._last_access[k]))
+
+
+class LRFUPolicy(CachePolicy):
+    """Weighs both the recency and the frequency of accesses (LRFU).
+
+    Every access adds 1 to a model's score, and scores halve every
+    `half_life` accesses to the cache. The model with the lowest score is
+    evicted first: a model used once a long time ago goes before one used
+    often, but a model that was used often and no longer is eventually goes
+    too. A short half life behaves like LRU, a long one like LFU.
+    """
+
+    def __init__(self, half_life: float = 40.0):
+        self._decay = 0.5 ** (1.0 / half_life)
+        self._clock = 0
+        self._scores: Dict[str, float] = dict()
+        self._last_access: Dict[str, int] = dict()
+        self._keys: set = set()
+
+    def touch(self, key: str) -> None:
+        self._clock += 1
+        self._scores[key] = self._score(key) + 1.0
+        self._last_access[key] = self._clock
+        self._keys.add(key)
+
+    def remove(self, key: str) -> None:
+        self._keys.discard(key)
+
+    def victims(self) -> List[str]:
+        return sorted(self._keys, key=lambda k: (self._score(k), self._last_access[k]))
+
+    def _score(self, key: str) -> float:
+        if key not in self._scores:
+            return 0.0
+        return self._scores[key] * self._decay ** (self._clock - self._last_access[key])
+
+
+CACHE_POLICIES: Dict[str, Callable[[], CachePolicy]] = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "lrfu": LRFUPolicy,
+}
+
+
+def make_cache_policy(policy: Union[str, Callable[[], CachePolicy]]) -> CachePolicy:
+    """Makes a policy from its name in CACHE_POLICIES, or from a policy class"""
+    if isinstance(policy, str):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f"Unknown cache policy {policy}, expected one of {', '.join(CACHE_POLICIES)}")
+        policy = CACHE_POLICIES[policy]
+    return policy()
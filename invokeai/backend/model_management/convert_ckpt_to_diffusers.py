@@ -28,6 +28,7 @@ from safetensors.torch import load_file
 import invokeai.backend.util.logging as logger
 from invokeai.app.services.config import InvokeAIAppConfig
 
+from .mmap_loader import load_safetensors_mmap
 from .model_manager import ModelManager
 from picklescan.scanner import scan_file_path
 from .models import BaseModelType, ModelVariantType
@@ -1011,7 +1012,8 @@ def load_pipeline_from_original_stable_diffusion_ckpt(
         dlogging.set_verbosity_error()
 
         if checkpoint_path.suffix == ".safetensors":
-            checkpoint = load_file(checkpoint_path)
+            # the converted weights are copied, so there is no need to read the whole file first
+            checkpoint = load_safetensors_mmap(checkpoint_path)
         else:
             if scan_needed:
                 # scan model
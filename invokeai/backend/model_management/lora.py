@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import copy
+import threading
+import weakref
 from contextlib import contextmanager
 from typing import Optional, Dict, Tuple, Any, Union, List
 from pathlib import Path
@@ -11,6 +13,8 @@ from diffusers.models import UNet2DConditionModel
 from safetensors.torch import load_file
 from transformers import CLIPTextModel, CLIPTokenizer
 
+from .mmap_loader import load_safetensors_mmap
+
 class LoRALayerBase:
     #rank: Optional[int]
     #alpha: Optional[float]
@@ -370,6 +374,7 @@ class LoRAModel: #(torch.nn.Module):
         file_path: Union[str, Path],
         device: Optional[torch.device] = None,
         dtype: Optional[torch.dtype] = None,
+        mmap: bool = False,
     ):
         device = device or torch.device("cpu")
         dtype = dtype or torch.float32
@@ -384,7 +389,9 @@ class LoRAModel: #(torch.nn.Module):
             layers=dict(),
         )
 
-        if file_path.suffix == ".safetensors":
+        if file_path.suffix == ".safetensors" and mmap:
+            state_dict = load_safetensors_mmap(file_path)
+        elif file_path.suffix == ".safetensors":
             state_dict = load_file(file_path.absolute().as_posix(), device="cpu")
         else:
             state_dict = torch.load(file_path, map_location="cpu")
@@ -443,8 +450,47 @@ with LoRAHelper.apply_lora_unet(unet, loras):
 # unmodified unet
 
 """
+
+class _LoRAPatchState:
+    """The LoRAs fused into the weights of a model"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # prefix -> lora layer key -> (module key, module), built once per model
+        self.key_indexes: Dict[str, Dict[str, Tuple[str, torch.nn.Module]]] = dict()
+        # module key -> (module, weight before patching, on cpu)
+        self.original_weights: Dict[str, Tuple[torch.nn.Module, torch.Tensor]] = dict()
+        # (prefix, (id(lora), weight)...) of the fused loras, which are kept
+        # alive so that their ids are not reused
+        self.applied: Optional[tuple] = None
+        self.applied_loras: List[Tuple[LoRAModel, float]] = list()
+
+
 # TODO: rename smth like ModelPatcher and add TI method?
 class ModelPatcher:
+    _patch_states: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    _patch_states_lock = threading.Lock()
+
+    @classmethod
+    def _get_patch_state(cls, model: torch.nn.Module) -> _LoRAPatchState:
+        with cls._patch_states_lock:
+            state = cls._patch_states.get(model)
+            if state is None:
+                state = cls._patch_states[model] = _LoRAPatchState()
+            return state
+
+    @staticmethod
+    def _build_lora_key_index(model: torch.nn.Module, prefix: str) -> Dict[str, Tuple[str, torch.nn.Module]]:
+        """
+        Maps lora layer keys to the modules of a model. Layer keys are module
+        paths with "_" instead of ".", e.g. lora_unet_down_blocks_0_attentions_0_proj_in
+        for down_blocks.0.attentions.0.proj_in.
+        """
+        index = dict()
+        for module_key, module in model.named_modules():
+            if module_key and hasattr(module, "weight"):
+                index.setdefault(prefix + module_key.replace(".", "_"), (module_key, module))
+        return index
 
     @staticmethod
     def _resolve_lora_key(model: torch.nn.Module, lora_key: str, prefix: str) -> Tuple[str, torch.nn.Module]:
@@ -522,37 +568,99 @@ class ModelPatcher:
         loras: List[Tuple[LoraModel, float]],
         prefix: str,
     ):
-        original_weights = dict()
-        try:
-            with torch.no_grad():
-                for lora, lora_weight in loras:
-                    #assert lora.device.type == "cpu"
-                    for layer_key, layer in lora.layers.items():
-                        if not layer_key.startswith(prefix):
-                            continue
+        """
+        Fuses loras into the weights of a model for the duration of the context.
+
+        The fused weights are kept after the context exits: applying the same
+        loras, in the same order and with the same weights, to the model again
+        reuses them, and applying others restores the original weights first.
+        Every user of the model must therefore go through apply_lora, with an
+        empty list of loras if it has none.
+        """
+        # callers pass generators, which would be used up by the key below
+        loras = list(loras)
+        state = cls._get_patch_state(model)
+        applied = (prefix, tuple((id(lora), lora_weight) for lora, lora_weight in loras))
+        with state.lock:
+            if state.applied != applied:
+                try:
+                    cls._restore_weights(state)
+                    cls._fuse_loras(model, state, loras, prefix)
+                except:
+                    cls._restore_weights(state)
+                    raise
+                state.applied = applied
+                state.applied_loras = list(loras)
 
-                        module_key, module = cls._resolve_lora_key(model, layer_key, prefix)
-                        if module_key not in original_weights:
-                            original_weights[module_key] = module.weight.detach().to(device="cpu", copy=True)
+            yield # wait for context manager exit
 
-                        # enable autocast to calc fp16 loras on cpu
-                        #with torch.autocast(device_type="cpu"):
-                        layer.to(dtype=torch.float32)
-                        layer_scale = layer.alpha / layer.rank if (layer.alpha and layer.rank) else 1.0
-                        layer_weight = layer.get_weight() * lora_weight * layer_scale
+    @classmethod
+    def _restore_weights(cls, state: _LoRAPatchState):
+        with torch.no_grad():
+            for module, weight in state.original_weights.values():
+                module.weight.copy_(weight)
+        state.original_weights.clear()
+        state.applied = None
+        state.applied_loras = list()
 
-                        if module.weight.shape != layer_weight.shape:
-                            # TODO: debug on lycoris
-                            layer_weight = layer_weight.reshape(module.weight.shape)
+    @classmethod
+    def _fuse_loras(
+        cls,
+        model: torch.nn.Module,
+        state: _LoRAPatchState,
+        loras: List[Tuple[LoraModel, float]],
+        prefix: str,
+    ):
+        if prefix not in state.key_indexes:
+            state.key_indexes[prefix] = cls._build_lora_key_index(model, prefix)
+        index = state.key_indexes[prefix]
+
+        # module key -> (module, layers patching it and their weights)
+        patches: Dict[str, Tuple[torch.nn.Module, List[Tuple[LoRALayerBase, float]]]] = dict()
+        for lora, lora_weight in loras:
+            for layer_key, layer in lora.layers.items():
+                if not layer_key.startswith(prefix):
+                    continue
+                if layer_key not in index:
+                    # not named after its module path
+                    index[layer_key] = cls._resolve_lora_key(model, layer_key, prefix)
+                module_key, module = index[layer_key]
+                patches.setdefault(module_key, (module, list()))[1].append((layer, lora_weight))
+
+        device = cls._get_merge_device(model, loras)
+        with torch.no_grad():
+            for module_key, (module, layers) in patches.items():
+                state.original_weights[module_key] = (module, module.weight.detach().to(device="cpu", copy=True))
+
+                # the deltas of every lora patching the module are summed before touching the weight
+                delta = torch.zeros(module.weight.shape, dtype=torch.float32, device=device)
+                for layer, lora_weight in layers:
+                    layer_scale = layer.alpha / layer.rank if (layer.alpha and layer.rank) else 1.0
+                    layer_weight = cls._get_layer_weight(layer, device)
+                    # TODO: debug on lycoris
+                    delta += layer_weight.reshape(module.weight.shape) * (lora_weight * layer_scale)
+
+                module.weight += delta.to(device=module.weight.device, dtype=module.weight.dtype)
 
-                        module.weight += layer_weight.to(device=module.weight.device, dtype=module.weight.dtype)
+    @staticmethod
+    def _get_layer_weight(layer: LoRALayerBase, device: torch.device) -> torch.Tensor:
+        """Computes the weight of a layer in float32 on a device, leaving the layer as it is"""
+        layer = copy.copy(layer)
+        # fp16 matmuls are not implemented on cpu
+        layer.to(device=device, dtype=torch.float32)
+        return layer.get_weight()
 
-            yield # wait for context manager exit
+    @staticmethod
+    def _get_merge_device(model: torch.nn.Module, loras: List[Tuple[LoraModel, float]]) -> torch.device:
+        """Merges on the device of the model if the loras fit in its free memory once in float32"""
+        device = next(model.parameters()).device
+        if device.type != "cuda":
+            return device
 
-        finally:
-            with torch.no_grad():
-                for module_key, weight in original_weights.items():
-                    model.get_submodule(module_key).weight.copy_(weight)
+        # calc_size() counts the bytes in the current dtype, at least 2 per element
+        needed = sum(lora.calc_size() for lora, _ in loras) * 2
+        free, _ = torch.cuda.mem_get_info(device)
+        return device if needed < free else torch.device("cpu")
 
 
     @classmethod
@@ -643,6 +751,7 @@ class TextualInversionModel:
         file_path: Union[str, Path],
         device: Optional[torch.device] = None,
         dtype: Optional[torch.dtype] = None,
+        mmap: bool = False,
     ):
         if not isinstance(file_path, Path):
             file_path = Path(file_path)
@@ -650,7 +759,9 @@ class TextualInversionModel:
         result = cls() # TODO:
         result.name = file_path.stem # TODO:
 
-        if file_path.suffix == ".safetensors":
+        if file_path.suffix == ".safetensors" and mmap:
+            state_dict = load_safetensors_mmap(file_path)
+        elif file_path.suffix == ".safetensors":
             state_dict = load_file(file_path.absolute().as_posix(), device="cpu")
         else:
             state_dict = torch.load(file_path, map_location="cpu")
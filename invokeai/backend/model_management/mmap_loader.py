@@ -0,0 +1,109 @@
+"""
+Load safetensors files as views of a memory map of the file, instead of
+reading them into freshly allocated memory.
+
+The map is private (copy-on-write): until a tensor is written to or moved
+to another device or dtype, its pages belong to the OS page cache. They
+are read on first use, can be reclaimed under memory pressure, and are
+shared by every process that maps the same file.
+"""
+
+import ctypes
+import json
+import mmap
+import weakref
+from pathlib import Path
+from typing import Any, Dict, Union
+
+import torch
+
+_DTYPES = {
+    "BOOL": torch.bool,
+    "U8": torch.uint8,
+    "I8": torch.int8,
+    "I16": torch.int16,
+    "I32": torch.int32,
+    "I64": torch.int64,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F32": torch.float32,
+    "F64": torch.float64,
+}
+
+# start address -> end address of the live maps
+_mapped_regions: Dict[int, int] = dict()
+
+
+def load_safetensors_mmap(path: Union[str, Path]) -> Dict[str, torch.Tensor]:
+    """Loads the tensors of a safetensors file without copying them out of a map of the file"""
+    with open(path, "rb") as f:
+        header_size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    # the map lives as long as a tensor references it
+    start = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+    _mapped_regions[start] = start + len(buffer)
+    weakref.finalize(buffer, _mapped_regions.pop, start, None)
+
+    header.pop("__metadata__", None)
+    data_start = 8 + header_size
+    state_dict = dict()
+    for key, info in header.items():
+        dtype = _DTYPES[info["dtype"]]
+        element_size = torch.empty((), dtype=dtype).element_size()
+        begin, end = info["data_offsets"]
+        if begin == end:
+            tensor = torch.empty(info["shape"], dtype=dtype)
+        elif (data_start + begin) % element_size == 0:
+            tensor = torch.frombuffer(
+                buffer, dtype=dtype, count=(end - begin) // element_size, offset=data_start + begin
+            )
+        else:
+            # unaligned tensors are copied
+            tensor = torch.frombuffer(bytearray(buffer[data_start + begin : data_start + end]), dtype=dtype)
+        state_dict[key] = tensor.reshape(info["shape"])
+
+    return state_dict
+
+
+def calc_mapped_size(model: Any) -> int:
+    """Gets the number of bytes of a model's tensors that are still views of a map"""
+    if not _mapped_regions:
+        return 0
+
+    regions = list(_mapped_regions.items())
+    mapped_size = 0
+    seen = set()
+    for tensor in _iter_tensors(model, set()):
+        if tensor.is_sparse or tensor.device.type != "cpu":
+            continue
+        ptr = tensor.data_ptr()
+        if ptr in seen:
+            continue
+        seen.add(ptr)
+        if any(start <= ptr < end for start, end in regions):
+            mapped_size += tensor.nelement() * tensor.element_size()
+    return mapped_size
+
+
+def _iter_tensors(obj: Any, seen: set, depth: int = 0):
+    # deep enough for LoRA models, whose layers hold the tensors
+    if depth > 4 or id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if isinstance(obj, torch.Tensor):
+        yield obj
+    elif isinstance(obj, torch.nn.Module):
+        yield from obj.parameters()
+        yield from obj.buffers()
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            yield from _iter_tensors(value, seen, depth + 1)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            yield from _iter_tensors(value, seen, depth + 1)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        for value in vars(obj).values():
+            yield from _iter_tensors(value, seen, depth + 1)
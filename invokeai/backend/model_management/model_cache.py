@@ -1,8 +1,14 @@
 """
 Manage a RAM cache of diffusion/transformer models for fast switching.
-They are moved between GPU VRAM and CPU RAM as necessary. If the cache
-grows larger than a preset maximum, then the least recently used
-model will be cleared and (re)loaded from disk when next needed.
+They are moved between GPU VRAM and CPU RAM as necessary. The cache has
+two tiers, each with a size limit: the models in RAM, and those of them
+that are also loaded into VRAM. When a tier is full, its eviction policy
+(see cache_policy) chooses the models that leave it: models pushed out
+of VRAM are moved back to RAM, and models pushed out of RAM are cleared
+and (re)loaded from disk when next needed.
+
+The bytes of each tier are counted from the models' tensors, so the
+accounting works the same on any execution device.
 
 The cache returns context manager generators designed to load the
 model into the GPU within the context, and unload outside the
@@ -13,24 +19,36 @@ context. Use like this:
           cache.get_model('stabilityai/stable-diffusion-2') as SD2:
        do_something_in_GPU(SD1,SD2)
 
+Models whose tensors are still views of memory-mapped files (see
+mmap_loader) only count the bytes that are not mapped against the cache
+size: mapped pages belong to the OS file cache, which can reclaim them
+and shares them with other processes.
 
+The cache can be shared by several threads. Concurrent requests for a
+model that is not cached wait for a single load of it, and models are
+pinned while a context is entered so that they are neither evicted nor
+offloaded while in use.
 """
 
 import gc
+import json
 import os
-import sys
-import hashlib
-from contextlib import suppress
+import threading
+import time
 from pathlib import Path
-from typing import Dict, Union, types, Optional, Type, Any
+from typing import Callable, Dict, List, Union, types, Optional, Type, Any
 
 import torch
+from pydantic import BaseModel, Field
 
 import logging
 import invokeai.backend.util.logging as logger
 from invokeai.app.services.config import get_invokeai_config
+from .cache_policy import CachePolicy, make_cache_policy
 from .lora import LoRAModel, TextualInversionModel
+from .mmap_loader import calc_mapped_size
 from .models import BaseModelType, ModelType, SubModelType, ModelBase
+from .models.base import calc_model_size_by_data
 
 # Maximum size of the cache, in gigs
 # Default is roughly enough to hold three fp16 diffusers models in RAM simultaneously
@@ -42,6 +60,10 @@ DEFAULT_MAX_VRAM_CACHE_SIZE= 2.75
 # actual size of a gig
 GIG = 1073741824
 
+class CacheFullException(Exception):
+    """A model cannot be prefetched without evicting models that were requested"""
+    pass
+
 class ModelLocker(object):
     "Forward declaration"
     pass
@@ -50,36 +72,95 @@ class ModelCache(object):
     "Forward declaration"
     pass
 
+class PrefetchStats(BaseModel):
+    """How much prefetching models saved"""
+    #fmt: off
+    prefetched: int = Field(default=0, description="Number of models loaded ahead of time")
+    hits: int = Field(default=0, description="Number of requests served by a prefetched model")
+    misses: int = Field(default=0, description="Number of requests that had to load the model")
+    time_saved: float = Field(default=0.0, description="Seconds of loading saved by prefetching")
+    #fmt: on
+
 class _CacheRecord:
     size: int
+    mapped_size: int
+    vram_size: int
     model: Any
     cache: ModelCache
+    prefetched: bool
+    load_time: float
+    device: Optional[torch.device]
+    move_lock: threading.Lock
     _locks: int
+    _locks_lock: threading.Lock
 
-    def __init__(self, cache, model: Any, size: int):
+    def __init__(self, cache, model: Any, size: int, prefetched: bool = False, load_time: float = 0.0):
         self.size = size
         self.model = model
         self.cache = cache
+        # the device the model is on, or is being moved to by the holder of move_lock
+        self.device = model.device if hasattr(model, "device") else None
+        self.move_lock = threading.Lock()
+        self.update_mapped_size()
+        self.update_vram_size()
+        # loaded ahead of time, and not requested since
+        self.prefetched = prefetched
+        self.load_time = load_time
         self._locks = 0
+        self._locks_lock = threading.Lock()
 
     def lock(self):
-        self._locks += 1
+        with self._locks_lock:
+            self._locks += 1
 
     def unlock(self):
-        self._locks -= 1
-        assert self._locks >= 0
+        with self._locks_lock:
+            assert self._locks > 0
+            self._locks -= 1
 
     @property
     def locked(self):
         return self._locks > 0
 
     @property
-    def loaded(self):
-        if self.model is not None and hasattr(self.model, "device"):
-            return self.model.device != self.cache.storage_device
+    def resident_size(self) -> int:
+        """Bytes that are not backed by a mapped file"""
+        return max(self.size - self.mapped_size, 0)
+
+    def update_mapped_size(self):
+        """Call after moving the model: moved tensors are no longer mapped"""
+        self.mapped_size = calc_mapped_size(self.model)
+
+    def update_vram_size(self):
+        """Call after moving the model between the storage and execution devices"""
+        if self.loaded:
+            # models without tensors of their own (e.g. LoRAs) count their estimated size
+            self.vram_size = calc_model_size_by_data(self.model) or self.size
         else:
-            return False
-    
+            self.vram_size = 0
+
+    @property
+    def loaded(self):
+        return self.device is not None and self.device != self.cache.storage_device
+
+
+class _PendingLoad:
+    """A model being loaded, which other requests for it wait on"""
+    size: int
+    prefetch: bool
+    started: float
+    done: threading.Event
+    cache_entry: Optional[_CacheRecord]
+    error: Optional[BaseException]
+
+    def __init__(self, size: int, prefetch: bool):
+        self.size = size
+        self.prefetch = prefetch
+        self.started = time.time()
+        self.done = threading.Event()
+        self.cache_entry = None
+        self.error = None
+
 
 class ModelCache(object):
     def __init__(
@@ -91,7 +172,8 @@ class ModelCache(object):
         precision: torch.dtype=torch.float16,
         sequential_offload: bool=False,
         lazy_offloading: bool=True,
-        sha_chunksize: int = 16777216,
+        cache_policy: Union[str, Callable[[], CachePolicy]] = 'lrfu',
+        trace_path: Optional[Path] = None,
         logger: types.ModuleType = logger
     ):
         '''
@@ -101,7 +183,8 @@ class ModelCache(object):
         :param precision: Precision for loaded models [torch.float16]
         :param lazy_offloading: Keep model in VRAM until another model needs to be loaded
         :param sequential_offload: Conserve VRAM by loading and unloading each stage of the pipeline sequentially
-        :param sha_chunksize: Chunksize to use when calculating sha256 model hash
+        :param cache_policy: Eviction policy of the RAM and VRAM tiers, a name in CACHE_POLICIES or a CachePolicy class ['lrfu']
+        :param trace_path: File to record each model request to, for scripts/simulate_model_cache.py [None]
         '''
         self.model_infos: Dict[str, ModelBase] = dict()
         self.lazy_offloading = lazy_offloading
@@ -110,11 +193,18 @@ class ModelCache(object):
         self.max_vram_cache_size: float=max_vram_cache_size
         self.execution_device: torch.device=execution_device
         self.storage_device: torch.device=storage_device
-        self.sha_chunksize=sha_chunksize
         self.logger = logger
 
+        self.trace_path = trace_path
+
         self._cached_models = dict()
-        self._cache_stack = list()
+        self._ram_policy = make_cache_policy(cache_policy)
+        self._vram_policy = make_cache_policy(cache_policy)
+        self._pending_loads: Dict[str, _PendingLoad] = dict()
+        self._prefetch_stats = PrefetchStats()
+        # guards the cached models, the policies and the devices models are
+        # assigned to. Models are moved outside of it (see _apply_moves)
+        self._lock = threading.RLock()
 
     def get_key(
         self,
@@ -143,14 +233,15 @@ class ModelCache(object):
             submodel_type=None,
         )
 
-        if model_info_key not in self.model_infos:
-            self.model_infos[model_info_key] = model_class(
-                model_path,
-                base_model,
-                model_type,
-            )
+        with self._lock:
+            if model_info_key not in self.model_infos:
+                self.model_infos[model_info_key] = model_class(
+                    model_path,
+                    base_model,
+                    model_type,
+                )
 
-        return self.model_infos[model_info_key]
+            return self.model_infos[model_info_key]
 
     # TODO: args
     def get_model(
@@ -161,7 +252,11 @@ class ModelCache(object):
         model_type: ModelType,
         submodel: Optional[SubModelType] = None,
         gpu_load: bool = True,
+        prefetch: bool = False,
     ) -> Any:
+        '''
+        :param prefetch: The model is loaded ahead of time, rather than requested for use
+        '''
 
         if not isinstance(model_path, Path):
             model_path = Path(model_path)
@@ -181,218 +276,328 @@ class ModelCache(object):
             model_type=model_type,
             submodel_type=submodel,
         )
+        if self.trace_path and not prefetch:
+            self._trace(key, model_info.get_size(submodel), gpu_load)
+
+        return self._get_or_load(
+            key,
+            load=lambda: model_info.get_model(child_type=submodel, torch_dtype=self.precision),
+            size=model_info.get_size(submodel),
+            gpu_load=gpu_load,
+            prefetch=prefetch,
+            description=f'model {model_path}, type {base_model}:{model_type}:{submodel}',
+        )
 
-        # TODO: lock for no copies on simultaneous calls?
-        cache_entry = self._cached_models.get(key, None)
-        if cache_entry is None:
-            self.logger.info(f'Loading model {model_path}, type {base_model}:{model_type}:{submodel}')
-
-            # this will remove older cached models until
-            # there is sufficient room to load the requested model
-            self._make_cache_room(model_info.get_size(submodel))
+    def get_custom_model(
+        self,
+        key: str,
+        loader: Callable[[], Any],
+        gpu_load: bool = True,
+    ) -> ModelLocker:
+        '''
+        Gets a model that is not installed in the models directory (e.g. an image
+        annotator), calling loader() to load it into RAM if it is not cached.
+        Its size is measured once it is loaded, and it shares the RAM and VRAM
+        budgets of the other models.
+        :param key: Identifies the model in the cache
+        :param loader: Loads the model. It must have a to() method and a device attribute to be moved to the execution device
+        '''
+        return self._get_or_load(key, load=loader, size=None, gpu_load=gpu_load, prefetch=False, description=key)
 
-            # clean memory to make MemoryUsage() more accurate
-            gc.collect()
-            model = model_info.get_model(child_type=submodel, torch_dtype=self.precision)
-            if mem_used := model_info.get_size(submodel):
+    def _get_or_load(
+        self,
+        key: str,
+        load: Callable[[], Any],
+        size: Optional[int],
+        gpu_load: bool,
+        prefetch: bool,
+        description: str,
+    ) -> ModelLocker:
+        '''
+        :param size: Expected size of the model, or None to measure it once loaded
+        '''
+        with self._lock:
+            cache_entry = self._cached_models.get(key, None)
+            pending = self._pending_loads.get(key, None)
+            if cache_entry is not None:
+                self._touch(key)
+                if not prefetch and cache_entry.prefetched:
+                    cache_entry.prefetched = False
+                    self._prefetch_stats.hits += 1
+                    self._prefetch_stats.time_saved += cache_entry.load_time
+                return self.ModelLocker(self, key, cache_entry, gpu_load)
+
+            if pending is None:
+                self.logger.info(f'Loading {description}')
+
+                # this will remove older cached models until
+                # there is sufficient room to load the requested model
+                if not self._make_cache_room(size or 0, prefetch=prefetch) and prefetch:
+                    raise CacheFullException(f'No room to prefetch {description}')
+                pending = self._pending_loads[key] = _PendingLoad(size or 0, prefetch)
+                is_loader = True
+            else:
+                is_loader = False
+                # the time the prefetch has already spent loading is saved
+                saved = time.time() - pending.started if pending.prefetch and not prefetch else None
+
+        if not is_loader:
+            # another thread is loading the model: wait for it instead of loading a copy
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            with self._lock:
+                if key in self._cached_models:
+                    self._touch(key)
+                if saved is not None and pending.cache_entry.prefetched:
+                    pending.cache_entry.prefetched = False
+                    self._prefetch_stats.hits += 1
+                    self._prefetch_stats.time_saved += saved
+            return self.ModelLocker(self, key, pending.cache_entry, gpu_load)
+
+        try:
+            model = load()
+            mem_used = size if size is not None else calc_model_size_by_data(model)
+            if mem_used:
                 self.logger.debug(f'CPU RAM used for load: {(mem_used/GIG):.2f} GB')
-
-            cache_entry = _CacheRecord(self, model, mem_used)
-            self._cached_models[key] = cache_entry
-
-        with suppress(Exception):
-            self._cache_stack.remove(key)
-        self._cache_stack.append(key)
-
-        return self.ModelLocker(self, key, cache_entry.model, gpu_load, cache_entry.size)
+            pending.cache_entry = _CacheRecord(
+                self, model, mem_used, prefetched=prefetch, load_time=time.time() - pending.started
+            )
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending_loads[key]
+                if pending.cache_entry is not None:
+                    if size is None:
+                        # the room for models of unknown size is made once they are loaded
+                        self._make_cache_room(pending.cache_entry.size)
+                    self._cached_models[key] = pending.cache_entry
+                    self._touch(key)
+                    if prefetch:
+                        self._prefetch_stats.prefetched += 1
+                    else:
+                        self._prefetch_stats.misses += 1
+            pending.done.set()
+
+        return self.ModelLocker(self, key, pending.cache_entry, gpu_load)
+
+    def get_prefetch_stats(self) -> PrefetchStats:
+        with self._lock:
+            return self._prefetch_stats.copy()
+
+    def _touch(self, key: str):
+        """Records an access to a cached model"""
+        self._ram_policy.touch(key)
+
+    def _trace(self, key: str, size: int, gpu_load: bool):
+        record = dict(time=time.time(), key=key, size=size, gpu_load=gpu_load)
+        with self._lock, open(self.trace_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
 
     class ModelLocker(object):
-        def __init__(self, cache, key, model, gpu_load, size_needed):
+        def __init__(self, cache, key, cache_entry, gpu_load):
             '''
             :param cache: The model_cache object
             :param key: The key of the model to lock in GPU
-            :param model: The model to lock
+            :param cache_entry: The cache record of the model to lock
             :param gpu_load: True if load into gpu
-            :param size_needed: Size of the model to load
             '''
             self.gpu_load = gpu_load
             self.cache = cache
             self.key = key
-            self.model = model
-            self.size_needed = size_needed
-            self.cache_entry = self.cache._cached_models[self.key]
+            self.cache_entry = cache_entry
+            self.model = cache_entry.model
+            self.size_needed = cache_entry.size
 
         def __enter__(self) -> Any:
-            if not hasattr(self.model, 'to'):
-                return self.model
-
-            # NOTE that the model has to have the to() method in order for this
-            # code to move it into GPU!
-            if self.gpu_load:
+            # models are assigned their devices under the cache lock, and
+            # moved once it is released: copies take seconds
+            moves = list()
+            with self.cache._lock:
+                # in the event that the caller wants the model in RAM, we
+                # move it into CPU if it is in GPU and not locked
+                if not self.gpu_load and self.cache_entry.loaded and not self.cache_entry.locked \
+                   and hasattr(self.model, 'to'):
+                    self.cache._move_model(self.key, self.cache_entry, self.cache.storage_device)
+                    moves.append(self.cache_entry)
+
+                # locked models are pinned: they are neither evicted nor offloaded
                 self.cache_entry.lock()
 
-                try:
-                    if self.cache.lazy_offloading:
-                       self.cache._offload_unlocked_models(self.size_needed)
-                       
-                    if self.model.device != self.cache.execution_device:
-                        self.cache.logger.debug(f'Moving {self.key} into {self.cache.execution_device}')
-                        with VRAMUsage() as mem:
-                            self.model.to(self.cache.execution_device)  # move into GPU
-                        self.cache.logger.debug(f'GPU VRAM used for load: {(mem.vram_used/GIG):.2f} GB')
-                        
-                    self.cache.logger.debug(f'Locking {self.key} in {self.cache.execution_device}')                
-                    self.cache._print_cuda_stats()
+                # NOTE that the model has to have the to() method in order for this
+                # code to move it into GPU!
+                if self.gpu_load and hasattr(self.model, 'to'):
+                    try:
+                        if self.cache_entry.device != self.cache.execution_device:
+                            if self.cache.lazy_offloading:
+                                moves.extend(self.cache._offload_unlocked_models(self.size_needed))
+
+                            self.cache.logger.debug(f'Moving {self.key} into {self.cache.execution_device}')
+                            self.cache._move_model(self.key, self.cache_entry, self.cache.execution_device)
+                            self.cache.logger.debug(f'VRAM used for load: {(self.cache_entry.vram_size/GIG):.2f} GB')
+                        if self.cache_entry.loaded:
+                            self.cache._vram_policy.touch(self.key)
+
+                        self.cache.logger.debug(f'Locking {self.key} in {self.cache.execution_device}')
+                        self.cache._print_cuda_stats()
 
-                except:
-                    self.cache_entry.unlock()
-                    raise
+                    except:
+                        self.cache_entry.unlock()
+                        raise
 
-            
-            # TODO: not fully understand
-            # in the event that the caller wants the model in RAM, we
-            # move it into CPU if it is in GPU and not locked
-            elif self.cache_entry.loaded and not self.cache_entry.locked:
-                self.model.to(self.cache.storage_device)
+                    # another request may still be moving it
+                    moves.append(self.cache_entry)
+
+            try:
+                self.cache._apply_moves(moves)
+            except:
+                self.cache_entry.unlock()
+                raise
 
             return self.model
 
         def __exit__(self, type, value, traceback):
+            self.cache_entry.unlock()
             if not hasattr(self.model, 'to'):
                 return
 
-            self.cache_entry.unlock()
             if not self.cache.lazy_offloading:
-                self.cache._offload_unlocked_models()
-                self.cache._print_cuda_stats()
+                with self.cache._lock:
+                    moves = self.cache._offload_unlocked_models()
+                    self.cache._print_cuda_stats()
+                self.cache._apply_moves(moves)
 
     # TODO: should it be called untrack_model?
     def uncache_model(self, cache_id: str):
-        with suppress(ValueError):
-            self._cache_stack.remove(cache_id)
-        self._cached_models.pop(cache_id, None)
-
-    def model_hash(
-        self,
-        model_path: Union[str, Path],
-    ) -> str:
-        '''
-        Given the HF repo id or path to a model on disk, returns a unique
-        hash. Works for legacy checkpoint files, HF models on disk, and HF repo IDs
-        :param model_path: Path to model file/directory on disk.
-        '''
-        return self._local_model_hash(model_path)
+        with self._lock:
+            self._ram_policy.remove(cache_id)
+            self._vram_policy.remove(cache_id)
+            self._cached_models.pop(cache_id, None)
 
     def cache_size(self) -> float:
-        "Return the current size of the cache, in GB"
-        current_cache_size = sum([m.size for m in self._cached_models.values()])
+        "Return the current size of the cache, in GB, not counting memory-mapped bytes"
+        with self._lock:
+            current_cache_size = sum([m.resident_size for m in self._cached_models.values()])
         return current_cache_size / GIG
 
+    def mapped_cache_size(self) -> float:
+        "Return the size of the cached models that is backed by memory-mapped files, in GB"
+        with self._lock:
+            mapped_cache_size = sum([min(m.mapped_size, m.size) for m in self._cached_models.values()])
+        return mapped_cache_size / GIG
+
+    def vram_cache_size(self) -> float:
+        "Return the size of the cached models that are loaded into the execution device, in GB"
+        with self._lock:
+            vram_cache_size = sum([m.vram_size for m in self._cached_models.values()])
+        return vram_cache_size / GIG
+
     def _has_cuda(self) -> bool:
         return self.execution_device.type == 'cuda'
 
     def _print_cuda_stats(self):
-        vram = "%4.2fG" % (torch.cuda.memory_allocated() / GIG)
+        vram = "%4.2fG" % self.vram_cache_size()
         ram = "%4.2fG" % self.cache_size()
+        mapped = "%4.2fG" % self.mapped_cache_size()
 
         cached_models = 0
         loaded_models = 0
         locked_models = 0
-        for model_info in self._cached_models.values():
+        for model_info in list(self._cached_models.values()):
             cached_models += 1
             if model_info.loaded:
                 loaded_models += 1
             if model_info.locked:
                 locked_models += 1
 
-        self.logger.debug(f"Current VRAM/RAM usage: {vram}/{ram}; cached_models/loaded_models/locked_models/ = {cached_models}/{loaded_models}/{locked_models}")
+        self.logger.debug(f"Current VRAM/RAM/mapped usage: {vram}/{ram}/{mapped}; cached_models/loaded_models/locked_models/ = {cached_models}/{loaded_models}/{locked_models}")
 
 
-    def _make_cache_room(self, model_size):
+    def _make_cache_room(self, model_size, prefetch: bool = False) -> bool:
+        """
+        Evicts unlocked models until model_size fits, returning whether it does.
+        Room for a prefetch is only made by evicting other prefetched models, so
+        that prefetching never evicts models that running sessions need.
+        """
         # calculate how much memory this model will require
         #multiplier = 2 if self.precision==torch.float32 else 1
         bytes_needed = model_size
         maximum_size = self.max_cache_size * GIG  # stored in GB, convert to bytes
-        current_size = sum([m.size for m in self._cached_models.values()])
+        current_size = sum([m.resident_size for m in self._cached_models.values()])
+        # models being loaded by other threads will need their room too
+        current_size += sum([p.size for p in self._pending_loads.values()])
 
         if current_size + bytes_needed > maximum_size:
             self.logger.debug(f'Max cache size exceeded: {(current_size/GIG):.2f}/{self.max_cache_size:.2f} GB, need an additional {(bytes_needed/GIG):.2f} GB')
 
         self.logger.debug(f"Before unloading: cached_models={len(self._cached_models)}")
 
-        pos = 0
-        while current_size + bytes_needed > maximum_size and pos < len(self._cache_stack):
-            model_key = self._cache_stack[pos]
+        evicted = False
+        for model_key in self._ram_policy.victims():
+            if current_size + bytes_needed <= maximum_size:
+                break
             cache_entry = self._cached_models[model_key]
 
-            refs = sys.getrefcount(cache_entry.model)
-
             device = cache_entry.model.device if hasattr(cache_entry.model, "device") else None
-            self.logger.debug(f"Model: {model_key}, locks: {cache_entry._locks}, device: {device}, loaded: {cache_entry.loaded}, refs: {refs}")
-
-            # 2 refs:
-            # 1 from cache_entry
-            # 1 from getrefcount function
-            if not cache_entry.locked and refs <= 2:
-                self.logger.debug(f'Unloading model {model_key} to free {(model_size/GIG):.2f} GB (-{(cache_entry.size/GIG):.2f} GB)')
-                current_size -= cache_entry.size
-                del self._cache_stack[pos]
+            self.logger.debug(f"Model: {model_key}, locks: {cache_entry._locks}, device: {device}, loaded: {cache_entry.loaded}")
+
+            # models are locked while they are in use
+            if not cache_entry.locked and (cache_entry.prefetched or not prefetch):
+                self.logger.debug(f'Unloading model {model_key} to free {(model_size/GIG):.2f} GB (-{(cache_entry.resident_size/GIG):.2f} GB)')
+                current_size -= cache_entry.resident_size
+                self._ram_policy.remove(model_key)
+                self._vram_policy.remove(model_key)
                 del self._cached_models[model_key]
                 del cache_entry
+                evicted = True
 
-            else:
-                pos += 1
-
-        gc.collect()
-        torch.cuda.empty_cache()
+        # only worth the time when there is memory to give back
+        if evicted:
+            gc.collect()
+            if self._has_cuda():
+                torch.cuda.empty_cache()
 
         self.logger.debug(f"After unloading: cached_models={len(self._cached_models)}")
+        return current_size + bytes_needed <= maximum_size
 
-    def _offload_unlocked_models(self, size_needed: int=0):
+    def _offload_unlocked_models(self, size_needed: int=0) -> List[_CacheRecord]:
+        """Assigns unlocked models to the storage device until there is VRAM for size_needed, returning them to be moved"""
+        offloaded = list()
         reserved = self.max_vram_cache_size * GIG
-        vram_in_use = torch.cuda.memory_allocated()
+        vram_in_use = sum([m.vram_size for m in self._cached_models.values()])
         self.logger.debug(f'{(vram_in_use/GIG):.2f}GB VRAM used for models; max allowed={(reserved/GIG):.2f}GB')
-        for model_key, cache_entry in sorted(self._cached_models.items(), key=lambda x:x[1].size):
-            if vram_in_use <= reserved:
+        for model_key in self._vram_policy.victims():
+            if vram_in_use + size_needed <= reserved:
                 break
-            if not cache_entry.locked and cache_entry.loaded:
+            cache_entry = self._cached_models.get(model_key, None)
+            if cache_entry is not None and not cache_entry.locked and cache_entry.loaded:
                 self.logger.debug(f'Offloading {model_key} from {self.execution_device} into {self.storage_device}')
-                with VRAMUsage() as mem:
-                    cache_entry.model.to(self.storage_device)
-                self.logger.debug(f'GPU VRAM freed: {(mem.vram_used/GIG):.2f} GB')
-                vram_in_use += mem.vram_used  # note vram_used is negative
+                vram_freed = cache_entry.vram_size
+                self._move_model(model_key, cache_entry, self.storage_device)
+                offloaded.append(cache_entry)
+                self.logger.debug(f'VRAM freed: {(vram_freed/GIG):.2f} GB')
+                vram_in_use -= vram_freed
                 self.logger.debug(f'{(vram_in_use/GIG):.2f}GB VRAM used for models; max allowed={(reserved/GIG):.2f}GB')
-        
-    def _local_model_hash(self, model_path: Union[str, Path]) -> str:
-        sha = hashlib.sha256()
-        path = Path(model_path)
-        
-        hashpath = path / "checksum.sha256"
-        if hashpath.exists() and path.stat().st_mtime <= hashpath.stat().st_mtime:
-            with open(hashpath) as f:
-                hash = f.read()
-            return hash
-        
-        self.logger.debug(f'computing hash of model {path.name}')
-        for file in list(path.rglob("*.ckpt")) \
-            + list(path.rglob("*.safetensors")) \
-            + list(path.rglob("*.pth")):
-            with open(file, "rb") as f:
-                while chunk := f.read(self.sha_chunksize):
-                    sha.update(chunk)
-        hash = sha.hexdigest()
-        with open(hashpath, "w") as f:
-            f.write(hash)
-        return hash
-
-class VRAMUsage(object):
-    def __init__(self):
-        self.vram = None
-        self.vram_used = 0
-        
-    def __enter__(self):
-        self.vram = torch.cuda.memory_allocated()
-        return self
-
-    def __exit__(self, *args):
-        self.vram_used = torch.cuda.memory_allocated() - self.vram
+        return offloaded
+
+    def _move_model(self, key: str, cache_entry: _CacheRecord, device: torch.device):
+        """Assigns a model to a device, accounting for its VRAM. Call _apply_moves() once the lock is released"""
+        cache_entry.device = device
+        cache_entry.update_vram_size()
+        if not cache_entry.loaded:
+            self._vram_policy.remove(key)
+
+    def _apply_moves(self, cache_entries: List[_CacheRecord]):
+        """Moves models to the devices they were assigned to, without holding the cache lock"""
+        for cache_entry in cache_entries:
+            with cache_entry.move_lock:
+                # the latest assignment wins, whichever request made it
+                device = cache_entry.device
+                if cache_entry.model.device == device:
+                    continue
+                cache_entry.model.to(device)
+            # moved tensors are no longer mapped
+            with self._lock:
+                cache_entry.update_mapped_size()
@@ -0,0 +1,170 @@
+"""
+Conversion of checkpoint models to diffusers, away from the invocation thread.
+
+Converting a checkpoint takes a minute or more, and used to run in the
+thread that requested the model, holding a lock that every other model
+request waited on. Conversions now run in a separate process, one job per
+output path: requests for a model that is being converted wait for the
+same job, and requests for other models are not held up.
+
+The converted model is written to a temporary folder next to its final
+location, and renamed once complete, so that an interrupted conversion
+never leaves a partial model in the conversion cache. Listeners are told
+when each job starts, periodically while it runs, and when it ends.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from shutil import rmtree
+from typing import Callable, Dict, List, Literal, Optional, Tuple, Union
+
+import invokeai.backend.util.logging as logger
+from invokeai.app.services.config import InvokeAIAppConfig
+
+ConversionEvent = Literal["started", "progress", "completed", "error"]
+
+
+@dataclass
+class ConversionJob:
+    name: str
+    output_path: Path
+    started: float
+    finished: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+
+ConversionListener = Callable[[ConversionEvent, ConversionJob], None]
+
+
+class ModelConverter:
+    """Runs model conversions in a separate process, at most once at a time per output path"""
+
+    _converter: Optional["ModelConverter"] = None
+    _converter_lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        progress_interval: float = 5.0,
+        mp_context: str = "spawn",
+    ):
+        """
+        :param max_workers: Number of models converted at once [1]
+        :param progress_interval: Seconds between two progress events of a job [5]
+        :param mp_context: How the conversion process is started. Forking a process that runs threads is unsafe ["spawn"]
+        """
+        self.max_workers = max_workers
+        self.progress_interval = progress_interval
+        self._mp_context = multiprocessing.get_context(mp_context)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, Tuple[ConversionJob, Future]] = dict()
+        self._listeners: List[ConversionListener] = list()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_converter(cls) -> "ModelConverter":
+        with cls._converter_lock:
+            if cls._converter is None:
+                cls._converter = cls()
+            return cls._converter
+
+    def add_listener(self, listener: ConversionListener) -> None:
+        self._listeners.append(listener)
+
+    def jobs(self) -> List[ConversionJob]:
+        """Returns the conversions in progress"""
+        with self._lock:
+            return [job for job, _ in self._pending.values()]
+
+    def convert(self, output_path: Union[str, Path], function: Callable, *args, name: Optional[str] = None) -> Path:
+        """
+        Converts a model unless it was already converted, and waits for the
+        conversion to complete. function(path, *args) must write the converted
+        model to path; it is called in another process, so it must be a
+        module-level function, and its arguments must be picklable.
+        """
+        return self.submit(output_path, function, *args, name=name).result()
+
+    def submit(self, output_path: Union[str, Path], function: Callable, *args, name: Optional[str] = None) -> Future:
+        """Like convert(), but returns a Future of the converted model's path"""
+        output_path = Path(output_path)
+        with self._lock:
+            if output_path.exists():
+                future = Future()
+                future.set_result(output_path)
+                return future
+            if pending := self._pending.get(str(output_path)):
+                return pending[1]
+            job = ConversionJob(name=name or output_path.name, output_path=output_path, started=time.time())
+            future = Future()
+            self._pending[str(output_path)] = (job, future)
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._mp_context)
+            process = self._pool.submit(
+                _convert, InvokeAIAppConfig.get_config().root_path, function, output_path, args
+            )
+
+        self._emit("started", job)
+        threading.Thread(
+            target=self._watch, args=(job, future, process), name="model_conversion", daemon=True
+        ).start()
+        return future
+
+    def _watch(self, job: ConversionJob, future: Future, process: Future) -> None:
+        while not wait([process], timeout=self.progress_interval).done:
+            self._emit("progress", job)
+        job.finished = time.time()
+
+        with self._lock:
+            del self._pending[str(job.output_path)]
+            # the conversion process holds on to the memory of the last model it converted
+            if not self._pending:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+        if error := process.exception():
+            job.error = str(error) or type(error).__name__
+            logger.error(f"Could not convert {job.name}: {job.error}")
+            self._emit("error", job)
+            future.set_exception(error)
+        else:
+            logger.info(f"Converted {job.name} in {job.elapsed:.1f}s")
+            self._emit("completed", job)
+            future.set_result(job.output_path)
+
+    def _emit(self, event: ConversionEvent, job: ConversionJob) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event, job)
+            except Exception as e:
+                logger.warning(f"Model conversion listener failed: {e}")
+
+
+def _convert(root: Path, function: Callable, output_path: Path, args: tuple) -> None:
+    # a spawned process starts with the default configuration
+    InvokeAIAppConfig.get_config().root = root
+    # same folder, so that the rename is atomic
+    tmp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        function(tmp_path, *args)
+        try:
+            os.replace(tmp_path, output_path)
+        except OSError:
+            # another process may have converted the model first
+            if not output_path.exists():
+                raise
+    finally:
+        if tmp_path.is_dir():
+            rmtree(tmp_path, ignore_errors=True)
+        elif tmp_path.exists():
+            tmp_path.unlink()
@@ -0,0 +1,181 @@
+"""
+Content hashes of models.
+
+The hash of a model file is the SHA256 of its contents, so it can be
+compared with the hashes published by model repositories. The hash of a
+model folder (e.g. a diffusers model) is the SHA256 of the relative paths
+and hashes of the weight files it contains.
+
+Hashing a large file takes seconds, so the hash of every file is kept in
+a SQLite index with the file's size and modification time: a file is only
+hashed again once it changes. Files are hashed in parallel, and a model
+requested by several threads at once is only hashed once.
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from invokeai.app.services.sqlite import SqliteDatabase, get_database, sqlite_memory
+
+# files holding weights: the configs and tokenizers of a folder do not change what a model generates
+WEIGHT_SUFFIXES = {".ckpt", ".safetensors", ".pth", ".pt", ".bin"}
+
+DEFAULT_CHUNK_SIZE = 16 * 2**20
+
+
+class ModelHashIndex:
+    """Keeps the hashes of files, keyed by their path, size and modification time.
+
+    The index lives in the app's database, which it shares with the other
+    storages through `get_database()`.
+    """
+
+    _db: SqliteDatabase
+
+    def __init__(self, filename: Union[str, Path] = sqlite_memory):
+        filename = str(filename)
+        if filename != sqlite_memory:
+            Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self._db = get_database(filename)
+        with self._db.lock:
+            self._db.conn.execute(
+                """--sql
+                CREATE TABLE IF NOT EXISTS model_file_hashes (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    hash TEXT NOT NULL
+                );
+                """
+            )
+            self._db.conn.execute(
+                """--sql
+                CREATE INDEX IF NOT EXISTS idx_model_file_hashes_hash ON model_file_hashes(hash);
+                """
+            )
+            self._db.conn.commit()
+
+    def get(self, path: Union[str, Path], size: int, mtime: int) -> Optional[str]:
+        """Gets the hash of a file, unless it changed since it was hashed"""
+        with self._db.reader() as cursor:
+            row = cursor.execute(
+                "SELECT hash FROM model_file_hashes WHERE path = ? AND size = ? AND mtime = ?;",
+                (str(path), size, mtime),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, path: Union[str, Path], size: int, mtime: int, hash: str) -> None:
+        with self._db.lock:
+            self._db.conn.execute(
+                "INSERT OR REPLACE INTO model_file_hashes (path, size, mtime, hash) VALUES (?, ?, ?, ?);",
+                (str(path), size, mtime, hash),
+            )
+            self._db.conn.commit()
+
+    def get_duplicates(self) -> List[List[str]]:
+        """Gets the paths of the indexed files that have the same contents"""
+        with self._db.reader() as cursor:
+            rows = cursor.execute(
+                """--sql
+                SELECT hash, path FROM model_file_hashes
+                WHERE hash IN (SELECT hash FROM model_file_hashes GROUP BY hash HAVING COUNT(*) > 1)
+                ORDER BY hash, path;
+                """
+            ).fetchall()
+        duplicates: Dict[str, List[str]] = dict()
+        for hash, path in rows:
+            duplicates.setdefault(hash, []).append(path)
+        return list(duplicates.values())
+
+    def prune(self) -> int:
+        """Forgets the files that no longer exist, and returns how many there were"""
+        with self._db.lock:
+            paths = [row[0] for row in self._db.conn.execute("SELECT path FROM model_file_hashes;")]
+            missing = [(p,) for p in paths if not os.path.exists(p)]
+            self._db.conn.executemany("DELETE FROM model_file_hashes WHERE path = ?;", missing)
+            self._db.conn.commit()
+        return len(missing)
+
+
+class ModelHasher:
+    """Hashes model files and folders, using an index to skip the files that did not change"""
+
+    index: ModelHashIndex
+    chunk_size: int
+    _pool: ThreadPoolExecutor
+    _pending: Dict[str, Future]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        index: Optional[ModelHashIndex] = None,
+        max_workers: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        :param index: Index of the known hashes [an index in memory]
+        :param max_workers: Number of files hashed at once [min(4, number of CPUs)]
+        :param chunk_size: Number of bytes read at a time [16 MB]
+        """
+        self.index = index or ModelHashIndex()
+        self.chunk_size = chunk_size
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers or min(4, os.cpu_count() or 1), thread_name_prefix="model_hash"
+        )
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+    def hash_model(self, path: Union[str, Path]) -> str:
+        """Gets the hash of a model file or folder"""
+        path = Path(path)
+        if path.is_file():
+            return self.hash_file(path)
+
+        files = sorted(p for p in path.rglob("*") if p.suffix in WEIGHT_SUFFIXES and p.is_file())
+        # hashlib releases the GIL, so the files are really hashed in parallel
+        hashes = list(self._pool.map(self.hash_file, files))
+        sha = hashlib.sha256()
+        for file, hash in zip(files, hashes):
+            sha.update(f"{file.relative_to(path).as_posix()}:{hash}\n".encode("utf-8"))
+        return sha.hexdigest()
+
+    def hash_file(self, path: Union[str, Path]) -> str:
+        """Gets the hash of a file, from the index unless the file changed"""
+        path = Path(path).absolute()
+        stat = path.stat()
+        if hash := self.index.get(path, stat.st_size, stat.st_mtime_ns):
+            return hash
+
+        with self._lock:
+            # another thread may already be hashing it
+            pending = self._pending.get(str(path))
+            if is_hasher := pending is None:
+                pending = self._pending[str(path)] = Future()
+
+        if not is_hasher:
+            return pending.result()
+
+        try:
+            hash = self._sha256(path)
+            self.index.set(path, stat.st_size, stat.st_mtime_ns, hash)
+            pending.set_result(hash)
+            return hash
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[str(path)]
+
+    def _sha256(self, path: Path) -> str:
+        sha = hashlib.sha256()
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        with open(path, "rb", buffering=0) as f:
+            while size := f.readinto(buffer):
+                sha.update(view[:size])
+        return sha.hexdigest()
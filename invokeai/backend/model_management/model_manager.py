@@ -64,7 +64,7 @@ model, including:
    type -- model type (ModelType)
    location -- path to the model file
    precision -- torch precision of the model
-   hash -- unique sha256 checksum for this model
+   hash -- sha256 checksum of the model's contents (see model_hash.py)
 
 SUBMODELS:
 
@@ -166,7 +166,9 @@ class ConfigMeta(BaseModel):Loras, textual_inversion and controlnet models are n
 explicitly in models.yaml, but are added to the in-memory data
 structure at initialization time by scanning the models directory. The
 in-memory data structure can be resynchronized by calling
-`manager.scan_models_directory()`.
+`manager.scan_models_directory()`. Folders are only listed again once
+their contents change (see model_scan_index.py), and a model that was
+not found is not looked for again for a few seconds.
 
 Files and folders placed inside the `autoimport` paths (paths
 defined in `invokeai.yaml`) will also be scanned for new models at
@@ -231,10 +233,13 @@ from __future__ import annotations
 import os
 import hashlib
 import textwrap
+import threading
+import time
 import yaml
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
-from typing import Optional, List, Tuple, Union, Dict, Set, Callable, types
+from typing import Optional, List, Tuple, Type, Union, Dict, Set, Callable, types
 from shutil import rmtree, move
 
 import torch
@@ -247,11 +252,14 @@ import invokeai.backend.util.logging as logger
 from invokeai.app.services.config import InvokeAIAppConfig
 from invokeai.backend.util import CUDA_DEVICE, Chdir
 from .model_cache import ModelCache, ModelLocker
+from .model_conversion import ModelConverter
+from .model_hash import ModelHasher, ModelHashIndex
+from .model_scan_index import ModelScanIndex
 from .model_search import ModelSearch
 from .models import (
     BaseModelType, ModelType, SubModelType,
     ModelError, SchedulerPredictionType, MODEL_CLASSES,
-    ModelConfigBase, ModelNotFoundException, InvalidModelException,
+    ModelBase, ModelConfigBase, ModelNotFoundException, InvalidModelException,
 )
 
 # We are only starting to number the config file with release 3.
@@ -265,10 +273,19 @@ class ModelInfo():
     name: str
     base_model: BaseModelType
     type: ModelType
-    hash: str
     location: Union[Path, str]
     precision: torch.dtype
     _cache: ModelCache = None
+    # hashing reads every weight of a model that is not in the hash index
+    # yet, so models are only hashed when their hash is asked for
+    _get_hash: Optional[Callable[[], str]] = field(default=None, repr=False)
+    _hash: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def hash(self) -> Optional[str]:
+        if self._hash is None and self._get_hash is not None:
+            self._hash = self._get_hash()
+        return self._hash
 
     def __enter__(self):
         return self.context.__enter__()
@@ -284,6 +301,9 @@ class AddModelResult(BaseModel):
 
 MAX_CACHE_SIZE = 6.0  # GB
 
+# seconds during which a model that was not found is not looked for again
+MISSING_MODEL_TTL = 10.0
+
 class ConfigMeta(BaseModel):
     version: str
 
@@ -332,8 +352,16 @@ class ModelManager(object):
             execution_device = device_type,
             precision = precision,
             sequential_offload = sequential_offload,
+            cache_policy = self.app_config.model_cache_policy,
+            trace_path = self.app_config.model_cache_trace_path,
             logger = logger,
         )
+        self.converter = ModelConverter.get_converter()
+        db_path = ':memory:' if self.app_config.use_memory_db else self.app_config.db_path
+        self.hasher = ModelHasher(ModelHashIndex(db_path))
+        self.scan_index = ModelScanIndex(db_path)
+        # model key -> time until which it is known to be missing
+        self._missing_models: Dict[str, float] = dict()
 
         self._read_models(config)
 
@@ -424,7 +452,8 @@ class ModelManager(object):
         model_name: str,
         base_model: BaseModelType,
         model_type: ModelType,
-        submodel_type: Optional[SubModelType] = None
+        submodel_type: Optional[SubModelType] = None,
+        prefetch: bool = False,
     )->ModelInfo:
         """Given a model named identified in models.yaml, return
         an ModelInfo object describing it.
@@ -433,14 +462,17 @@ class ModelManager(object):
         :param base_model: BaseModelType enum indicating the base model used by this model
         :param submode_typel: an ModelType enum indicating the portion of 
                the model to retrieve (e.g. ModelType.Vae)
+        :param prefetch: load the model into the RAM cache ahead of its use
         """
         model_class = MODEL_CLASSES[base_model][model_type]
         model_key = self.create_key(model_name, base_model, model_type)
 
         # if model not found try to find it (maybe file just pasted)
         if model_key not in self.models:
-            self.scan_models_directory(base_model=base_model, model_type=model_type)
+            if self._missing_models.get(model_key, 0) < time.time():
+                self.scan_models_directory(base_model=base_model, model_type=model_type)
             if model_key not in self.models:
+                self._missing_models[model_key] = time.time() + MISSING_MODEL_TTL
                 raise ModelNotFoundException(f"Model not found - {model_key}")
 
         model_config = self.models[model_key]
@@ -465,16 +497,10 @@ class ModelManager(object):
                 submodel_type = None
                 model_class = MODEL_CLASSES[base_model][model_type]
 
-        # TODO: path
-        # TODO: is it accurate to use path as id
-        dst_convert_path = self._get_model_cache_path(model_path)
+        # the hash of the model as installed, rather than of its converted copy
+        get_hash = partial(self.hasher.hash_model, model_path)
 
-        model_path = model_class.convert_if_required(
-            base_model=base_model,
-            model_path=str(model_path), # TODO: refactor str/Path types logic
-            output_path=dst_convert_path,
-            config=model_config,
-        )
+        model_path = self._convert_if_required(model_class, base_model, model_path, model_config)
 
         model_context = self.cache.get_model(
             model_path=model_path,
@@ -482,25 +508,62 @@ class ModelManager(object):
             base_model=base_model,
             model_type=model_type,
             submodel=submodel_type,
+            prefetch=prefetch,
         )
 
         if model_key not in self.cache_keys:
             self.cache_keys[model_key] = set()
         self.cache_keys[model_key].add(model_context.key)
 
-        model_hash = "<NO_HASH>" # TODO:
-            
         return ModelInfo(
             context = model_context,
             name = model_name,
             base_model = base_model,
             type = submodel_type or model_type,
-            hash = model_hash,
             location = model_path, # TODO:
             precision = self.cache.precision,
             _cache = self.cache,
+            _get_hash = get_hash,
+        )
+
+    def _convert_if_required(
+        self,
+        model_class: Type[ModelBase],
+        base_model: BaseModelType,
+        model_path: Path,
+        model_config: ModelConfigBase,
+    ) -> str:
+        # TODO: path
+        # TODO: is it accurate to use path as id
+        dst_convert_path = self._get_model_cache_path(model_path)
+
+        # checkpoints are converted in another process, once even if requested by several threads
+        return model_class.convert_if_required(
+            base_model=base_model,
+            model_path=str(model_path), # TODO: refactor str/Path types logic
+            output_path=dst_convert_path,
+            config=model_config,
         )
 
+    def _convert_in_background(
+        self,
+        model_name: str,
+        base_model: BaseModelType,
+        model_type: ModelType,
+    ):
+        """Convert a checkpoint model ahead of its first use"""
+        model_class = MODEL_CLASSES[base_model][model_type]
+        model_config = self.models[self.create_key(model_name, base_model, model_type)]
+        model_path = self.app_config.root_path / model_config.path
+
+        def convert():
+            try:
+                self._convert_if_required(model_class, base_model, model_path, model_config)
+            except Exception as e:
+                self.logger.warning(f'Could not convert {model_name}: {e}')
+
+        threading.Thread(target=convert, name='model_conversion', daemon=True).start()
+
     def model_info(
         self,
         model_name: str,
@@ -516,6 +579,40 @@ class ModelManager(object):
         else:
             return None # TODO: None or empty dict on not found
 
+    def get_model_hash(
+        self,
+        model_name: str,
+        base_model: BaseModelType,
+        model_type: ModelType,
+    ) -> str:
+        """
+        Return the sha256 checksum of the contents of a model. Models
+        are only hashed again once their files change.
+        """
+        model_key = self.create_key(model_name, base_model, model_type)
+        if model_key not in self.models:
+            raise ModelNotFoundException(f"Model not found - {model_key}")
+        return self.hasher.hash_model(self.app_config.root_path / self.models[model_key].path)
+
+    def find_duplicate_models(self) -> List[List[str]]:
+        """
+        Return the keys of the installed models that have the same
+        contents, grouped by model. Models that cannot be hashed (e.g.
+        their files are missing) are skipped.
+        """
+        models_by_hash: Dict[str, List[str]] = dict()
+        for model_key in sorted(self.models, key=str.casefold):
+            model_path = self.app_config.root_path / self.models[model_key].path
+            if not model_path.exists():
+                continue
+            try:
+                model_hash = self.hasher.hash_model(model_path)
+            except OSError as e:
+                self.logger.warning(f'Could not hash {model_key}: {e}')
+                continue
+            models_by_hash.setdefault(model_hash, []).append(model_key)
+        return [keys for keys in models_by_hash.values() if len(keys) > 1]
+
     def model_names(self) -> List[Tuple[str, BaseModelType, ModelType]]:
         """
         Return a list of (str, BaseModelType, ModelType) corresponding to all models 
@@ -664,6 +761,12 @@ class ModelManager(object):
 
         self.models[model_key] = model_config
         self.commit()
+
+        if self.app_config.eager_model_conversion \
+           and model_type == ModelType.Main \
+           and model_config.model_format == 'checkpoint':
+            self._convert_in_background(model_name, base_model, model_type)
+
         return AddModelResult(
             name = model_name,
             model_type = model_type,
@@ -848,10 +951,11 @@ class ModelManager(object):
         new_models_found = False
 
         self.logger.info(f'scanning {self.app_config.models_path} for new models')
+        root_path = self.app_config.root_path.absolute()
         with Chdir(self.app_config.root_path):
             for model_key, model_config in list(self.models.items()):
                 model_name, cur_base_model, cur_model_type = self.parse_key(model_key)
-                model_path = self.app_config.root_path.absolute() / model_config.path
+                model_path = root_path / model_config.path
                 if not model_path.exists():
                     model_class = MODEL_CLASSES[cur_base_model][cur_model_type]
                     if model_class.save_to_config:
@@ -875,8 +979,10 @@ class ModelManager(object):
                     if not models_dir.exists():
                         continue # TODO: or create all folders?
 
-                    for model_path in models_dir.iterdir():
-                        if model_path not in loaded_files: # TODO: check
+                    # only lists the folder again if models were added or removed since
+                    for entry_path in self.scan_index.list_folder(models_dir):
+                        if entry_path not in loaded_files and not self.scan_index.is_invalid(entry_path):
+                            model_path = entry_path
                             model_name = model_path.name if model_path.is_dir() else model_path.stem
                             model_key = self.create_key(model_name, cur_base_model, cur_model_type)
 
@@ -891,19 +997,34 @@ class ModelManager(object):
                                 new_models_found = True
                             except InvalidModelException:
                                 self.logger.warning(f"Not a valid model: {model_path}")
+                                self.scan_index.set_invalid(entry_path)
                             except NotImplementedError as e:
                                 self.logger.warning(e)
+                                self.scan_index.set_invalid(entry_path)
 
         imported_models = self.autoimport()
 
-        if (new_models_found or imported_models) and self.config_path:
-            self.commit()
+        if new_models_found or imported_models:
+            self._missing_models.clear()
+            if self.config_path:
+                self.commit()
 
 
     def autoimport(self)->Dict[str, AddModelResult]:
         '''
         Scan the autoimport directory (if defined) and import new models, delete defunct models.
         '''
+        config = self.app_config
+        directories = {config.root_path / x for x in [config.autoimport_dir,
+                                                      config.lora_dir,
+                                                      config.embedding_dir,
+                                                      config.controlnet_dir]
+                       }
+        # nothing can have been added to folders that did not change since they were searched
+        directories = {x for x in directories if x.is_dir() and self.scan_index.tree_changed(x)}
+        if not directories:
+            return dict()
+
         # avoid circular import
         from invokeai.backend.install.model_install_backend import ModelInstall
         from invokeai.frontend.install.model_install import ask_user_for_prediction_type
@@ -917,12 +1038,15 @@ class ModelManager(object):
 
             def on_search_started(self):
                 self.new_models_found = dict()
+                self.paths_found = list()
 
             def on_model_found(self, model: Path):
                 if model not in self.ignore:
-                    self.new_models_found.update(self.installer.heuristic_import(model))
+                    self.paths_found.append(model)
 
             def on_search_completed(self):
+                # the models are probed together, in parallel
+                self.new_models_found.update(self.installer._install_paths(self.paths_found))
                 self.logger.info(f'Scanned {self._items_scanned} files and directories, imported {len(self.new_models_found)} models')
 
             def models_found(self):
@@ -933,15 +1057,13 @@ class ModelManager(object):
                                  model_manager = self,
                                  prediction_type_helper = ask_user_for_prediction_type,
                                  )
-        config = self.app_config
         known_paths = {config.root_path / x['path'] for x in self.list_models()}
-        directories = {config.root_path / x for x in [config.autoimport_dir,
-                                                      config.lora_dir,
-                                                      config.embedding_dir,
-                                                      config.controlnet_dir]
-                       }
+        # taken before the search, so that files still being copied while it runs are searched again
+        tree_states = {x: self.scan_index.tree_state(x) for x in directories}
         scanner = ScanAndImport(directories, self.logger, ignore=known_paths, installer=installer)
         scanner.search()
+        for directory, state in tree_states.items():
+            self.scan_index.record_tree(directory, state)
         return scanner.models_found()
 
     def heuristic_import(self,
@@ -1,20 +1,28 @@
 import json
+import multiprocessing
+import os
+import threading
 import torch
-import safetensors.torch
 
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
 
 from diffusers import ModelMixin, ConfigMixin
 from pathlib import Path
-from typing import Callable, Literal, Union, Dict, Optional
-from picklescan.scanner import scan_file_path
+from typing import Callable, List, Literal, Tuple, Union, Dict, Optional
 
+import invokeai.backend.util.logging as logger
+from invokeai.app.services.config import InvokeAIAppConfig
+from invokeai.app.services.sqlite import SqliteDatabase, get_database, sqlite_memory
 from .models import (
     BaseModelType, ModelType, ModelVariantType,
     SchedulerPredictionType, SilenceWarnings,
 )
 from .models.base import read_checkpoint_meta
 
+# suffixes of the files that hold checkpoints
+CHECKPOINT_SUFFIXES = ('.bin','.pt','.ckpt','.safetensors','.pth')
+
 @dataclass
 class ModelProbeInfo(object):
     model_type: ModelType
@@ -25,6 +33,82 @@ class ModelProbeInfo(object):
     format: Literal['diffusers','checkpoint', 'lycoris']
     image_size: int
 
+class ModelProbeCache(object):
+    '''
+    Remembers the results of probing model files and folders, keyed by
+    their path, size and modification time (for a folder, the total size
+    and the latest modification time of the files it contains), so that
+    they are only probed again once they change. The results live in the
+    app's database, which the cache shares with the other storages through
+    `get_database()`.
+    '''
+    _db: SqliteDatabase
+
+    def __init__(self, filename: Union[str, Path] = sqlite_memory):
+        filename = str(filename)
+        if filename != sqlite_memory:
+            Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self._db = get_database(filename)
+        with self._db.lock:
+            self._db.conn.execute(
+                """--sql
+                CREATE TABLE IF NOT EXISTS model_probe_results (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    info TEXT
+                );
+                """
+            )
+            self._db.conn.commit()
+
+    @classmethod
+    def get_identity(cls, path: Path) -> Tuple[int, int]:
+        '''Returns the size and modification time of a file or folder'''
+        if not path.is_dir():
+            stat = path.stat()
+            return stat.st_size, stat.st_mtime_ns
+        size, mtime = 0, path.stat().st_mtime_ns
+        for root, _, files in os.walk(path):
+            for file in files:
+                stat = os.stat(os.path.join(root, file))
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime_ns)
+        return size, mtime
+
+    def get(self, path: Path, identity: Tuple[int, int]) -> Tuple[bool, Optional[ModelProbeInfo]]:
+        '''Returns whether the model was probed since it last changed, and the result of the probe'''
+        with self._db.reader() as cursor:
+            row = cursor.execute(
+                "SELECT info FROM model_probe_results WHERE path = ? AND size = ? AND mtime = ?;",
+                (str(path.absolute()), *identity),
+            ).fetchone()
+        if row is None:
+            return False, None
+        if row[0] is None:
+            return True, None
+        fields = json.loads(row[0])
+        return True, ModelProbeInfo(
+            model_type = ModelType(fields['model_type']),
+            base_type = BaseModelType(fields['base_type']) if fields['base_type'] else None,
+            variant_type = ModelVariantType(fields['variant_type']) if fields['variant_type'] else None,
+            prediction_type = SchedulerPredictionType(fields['prediction_type']) if fields['prediction_type'] else None,
+            upcast_attention = fields['upcast_attention'],
+            format = fields['format'],
+            image_size = fields['image_size'],
+        )
+
+    def set(self, path: Path, identity: Tuple[int, int], info: Optional[ModelProbeInfo]):
+        value = None
+        if info is not None:
+            value = json.dumps({k: v.value if hasattr(v, 'value') else v for k, v in asdict(info).items()})
+        with self._db.lock:
+            self._db.conn.execute(
+                "INSERT OR REPLACE INTO model_probe_results (path, size, mtime, info) VALUES (?, ?, ?, ?);",
+                (str(path.absolute()), *identity, value),
+            )
+            self._db.conn.commit()
+
 class ProbeBase(object):
     '''forward declaration'''
     pass
@@ -41,6 +125,20 @@ class ModelProbe(object):
         'AutoencoderKL' : ModelType.Vae,
         'ControlNetModel' : ModelType.ControlNet,
     }
+
+    # fewer models than this are not worth starting processes for
+    MIN_PARALLEL_PROBES = 4
+
+    _cache: Optional[ModelProbeCache] = None
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def get_cache(cls) -> ModelProbeCache:
+        with cls._cache_lock:
+            if cls._cache is None:
+                config = InvokeAIAppConfig.get_config()
+                cls._cache = ModelProbeCache(sqlite_memory if config.use_memory_db else config.db_path)
+            return cls._cache
     
     @classmethod
     def register_probe(cls,
@@ -73,11 +171,94 @@ class ModelProbe(object):
         opening it a second time. The prediction_type_helper callable is a function that receives
         the path to the model and returns the BaseModelType. It is called to distinguish
         between V2-Base and V2-768 SD models.
+
+        The results of probing files and folders are cached until they change.
         '''
+        if model is not None or not model_path:
+            return cls._probe(model_path, model, prediction_type_helper)
+
+        cache = cls.get_cache()
+        identity = cache.get_identity(model_path)
+        found, model_info = cache.get(model_path, identity)
+        if not found:
+            model_info = cls._probe(model_path, None, prediction_type_helper)
+            if not cls._needs_helper(model_info):
+                cache.set(model_path, identity, model_info)
+        return model_info
+
+    @classmethod
+    def probe_many(cls,
+                   model_paths: List[Path],
+                   prediction_type_helper: Optional[Callable[[Path],SchedulerPredictionType]] = None,
+                   max_workers: Optional[int] = None,
+                   )->Dict[Path, Optional[ModelProbeInfo]]:
+        '''
+        Probe several models, in parallel processes. Models that could not be
+        probed are left out of the returned dict; probe() them to get the error.
+        '''
+        cache = cls.get_cache()
+        results = dict()
+        uncached = list()
+        for model_path in model_paths:
+            try:
+                identity = cache.get_identity(model_path)
+            except OSError:
+                continue
+            found, model_info = cache.get(model_path, identity)
+            if found:
+                results[model_path] = model_info
+            else:
+                uncached.append((model_path, identity))
+
+        if len(uncached) < cls.MIN_PARALLEL_PROBES:
+            probed = [(p, i, cls._try_probe(p)) for p, i in uncached]
+        else:
+            max_workers = max_workers or min(8, os.cpu_count() or 1)
+            logger.info(f'Probing {len(uncached)} models in {max_workers} processes')
+            # forking would copy the locks and cuda state of this process' threads
+            spawn = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=spawn) as pool:
+                infos = pool.map(cls._try_probe, [p for p, _ in uncached])
+                probed = [(p, i, info) for (p, i), info in zip(uncached, infos)]
+
+        for model_path, identity, (ok, model_info) in probed:
+            if not ok:
+                continue
+            if cls._needs_helper(model_info):
+                # the helper may ask the user, which only this process can do
+                model_info = cls._probe(model_path, None, prediction_type_helper)
+            else:
+                cache.set(model_path, identity, model_info)
+            results[model_path] = model_info
+        return results
+
+    @classmethod
+    def _try_probe(cls, model_path: Path) -> Tuple[bool, Optional[ModelProbeInfo]]:
+        try:
+            return True, cls._probe(model_path)
+        except Exception:
+            return False, None
+
+    @classmethod
+    def _needs_helper(cls, model_info: Optional[ModelProbeInfo]) -> bool:
+        '''Whether SD2 checkpoints need to be told their prediction type'''
+        return model_info is not None \
+            and model_info.model_type == ModelType.Main \
+            and model_info.base_type == BaseModelType.StableDiffusion2 \
+            and model_info.prediction_type is None
+
+    @classmethod
+    def _probe(cls,
+               model_path: Path,
+               model: Optional[Union[Dict, ModelMixin]] = None,
+               prediction_type_helper: Optional[Callable[[Path],SchedulerPredictionType]] = None)->ModelProbeInfo:
         if model_path:
             format_type = 'diffusers' if model_path.is_dir() else 'checkpoint'
         else:
             format_type = 'diffusers' if isinstance(model,(ConfigMixin,ModelMixin)) else 'checkpoint'
+        if format_type == 'checkpoint' and model is None and model_path.suffix in CHECKPOINT_SUFFIXES:
+            # read once for both the model type and the probe
+            model = cls._scan_and_load_checkpoint(model_path)
         model_info = None
         try:
             model_type = cls.get_model_type_from_folder(model_path, model) \
@@ -110,13 +291,13 @@ class ModelProbe(object):
 
     @classmethod
     def get_model_type_from_checkpoint(cls, model_path: Path, checkpoint: dict) -> ModelType:
-        if model_path.suffix not in ('.bin','.pt','.ckpt','.safetensors','.pth'):
+        if model_path.suffix not in CHECKPOINT_SUFFIXES:
             return None
 
         if model_path.name == "learned_embeds.bin":
             return ModelType.TextualInversion
 
-        ckpt = checkpoint if checkpoint else read_checkpoint_meta(model_path, scan=True)
+        ckpt = checkpoint if checkpoint else cls._scan_and_load_checkpoint(model_path)
         ckpt = ckpt.get("state_dict", ckpt)
 
         for key in ckpt.keys():
@@ -172,23 +353,13 @@ class ModelProbe(object):
 
     @classmethod
     def _scan_and_load_checkpoint(cls,model_path: Path)->dict:
+        '''
+        Load a checkpoint for probing. Pickles are scanned for malware first.
+        Tensors are created on the meta device: probes only need their shapes,
+        which the header of a safetensors file holds.
+        '''
         with SilenceWarnings():
-            if model_path.suffix.endswith((".ckpt", ".pt", ".bin")):
-                cls._scan_model(model_path, model_path)
-                return torch.load(model_path)
-            else:
-                return safetensors.torch.load_file(model_path)
-
-    @classmethod
-    def _scan_model(cls, model_name, checkpoint):
-            """
-            Apply picklescanner to the indicated checkpoint and issue a warning
-            and option to exit if an infected file is identified.
-            """
-            # scan model
-            scan_result = scan_file_path(checkpoint)
-            if scan_result.infected_files != 0:
-                raise "The model {model_name} is potentially infected by malware. Aborting import."
+            return read_checkpoint_meta(model_path, scan=True)
 
 ###################################################3
 # Checkpoint probing
@@ -0,0 +1,176 @@
+"""
+Index of the folders that are scanned for models.
+
+Scanning the models directory used to list every folder and probe every
+entry that was not a known model, each time a model could not be found.
+The index remembers the entries of each scanned folder with the folder's
+modification time, which changes whenever an entry is added, removed or
+renamed: folders that did not change are not listed again, and entries
+that did not change since they failed to probe are not probed again.
+
+The folders and entries are kept in a SQLite table, so that they outlive
+the process; entries that failed to probe are only remembered by the
+process, since a model that was still being copied would otherwise be
+ignored until its folder changes.
+
+The trees searched by autoimport are recorded with the modification time
+and size of every folder and file: copying a file into a folder changes
+the folder once, when the file is created, but the file itself until the
+copy completes.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from invokeai.app.services.sqlite import SqliteDatabase, get_database, sqlite_memory
+
+
+class ModelScanIndex:
+    """Remembers the entries of scanned folders, keyed by their path, modification time and size.
+
+    The index lives in the app's database, which it shares with the other
+    storages through `get_database()`.
+    """
+
+    _db: SqliteDatabase
+    _lock: threading.Lock
+    # path -> (mtime, size) of the entries that are not models
+    _invalid: Dict[str, Tuple[int, int]]
+
+    def __init__(self, filename: Union[str, Path] = sqlite_memory):
+        filename = str(filename)
+        if filename != sqlite_memory:
+            Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._invalid = dict()
+        self._db = get_database(filename)
+        with self._db.lock:
+            self._db.conn.execute(
+                """--sql
+                CREATE TABLE IF NOT EXISTS model_scan_folders (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    mtime INTEGER NOT NULL
+                );
+                """
+            )
+            self._db.conn.execute(
+                """--sql
+                CREATE TABLE IF NOT EXISTS model_scan_entries (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                """
+            )
+            self._db.conn.execute(
+                """--sql
+                CREATE TABLE IF NOT EXISTS model_scan_trees (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    mtime INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                """
+            )
+            self._db.conn.execute(
+                """--sql
+                CREATE INDEX IF NOT EXISTS idx_model_scan_entries_folder ON model_scan_entries(folder);
+                """
+            )
+            self._db.conn.commit()
+
+    def list_folder(self, folder: Path) -> List[Path]:
+        """Gets the entries of a folder, only listing it again if it changed since it was last listed"""
+        mtime = folder.stat().st_mtime_ns
+        with self._db.reader() as cursor:
+            row = cursor.execute("SELECT mtime FROM model_scan_folders WHERE path = ?;", (str(folder),)).fetchone()
+            if row and row[0] == mtime:
+                rows = cursor.execute(
+                    "SELECT path FROM model_scan_entries WHERE folder = ? ORDER BY path;", (str(folder),)
+                ).fetchall()
+                return [Path(r[0]) for r in rows]
+
+        entries = list()
+        for entry in os.scandir(folder):
+            stat = entry.stat()
+            entries.append((entry.path, str(folder), stat.st_mtime_ns, stat.st_size))
+        with self._db.lock:
+            self._db.conn.execute("DELETE FROM model_scan_entries WHERE folder = ?;", (str(folder),))
+            self._db.conn.executemany(
+                "INSERT OR REPLACE INTO model_scan_entries (path, folder, mtime, size) VALUES (?, ?, ?, ?);", entries
+            )
+            self._db.conn.execute(
+                "INSERT OR REPLACE INTO model_scan_folders (path, mtime) VALUES (?, ?);", (str(folder), mtime)
+            )
+            self._db.conn.commit()
+        return sorted(Path(e[0]) for e in entries)
+
+    def is_invalid(self, path: Path) -> bool:
+        """Whether an entry failed to probe, and did not change since"""
+        with self._lock:
+            if str(path) not in self._invalid:
+                return False
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+        with self._lock:
+            return self._invalid.get(str(path)) == (stat.st_mtime_ns, stat.st_size)
+
+    def set_invalid(self, path: Path) -> None:
+        """Remembers that an entry failed to probe"""
+        stat = path.stat()
+        with self._lock:
+            self._invalid[str(path)] = (stat.st_mtime_ns, stat.st_size)
+
+    def tree_state(self, root: Path) -> Dict[str, Tuple[int, int]]:
+        """Gets the modification time and size of a folder and of every folder and file below it"""
+        state = dict()
+        for dirpath, _, filenames in os.walk(root):
+            for path in [dirpath] + [os.path.join(dirpath, f) for f in filenames]:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                state[path] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def tree_changed(self, root: Path) -> bool:
+        """Whether a folder, or any folder or file below it, changed since record_tree() was called"""
+        with self._db.reader() as cursor:
+            rows = cursor.execute(
+                "SELECT path, mtime, size FROM model_scan_trees WHERE path = ? OR path LIKE ? ESCAPE '\\';",
+                (str(root), _escape_like(str(root) + os.sep) + "%"),
+            ).fetchall()
+        if not rows:
+            return True
+        # entries that were added or removed change the modification time of their folder
+        for path, mtime, size in rows:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return True
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                return True
+        return False
+
+    def record_tree(self, root: Path, state: Optional[Dict[str, Tuple[int, int]]] = None) -> None:
+        """Remembers the state of a tree, as returned by tree_state() before it was searched"""
+        if state is None:
+            state = self.tree_state(root)
+        with self._db.lock:
+            self._db.conn.execute(
+                "DELETE FROM model_scan_trees WHERE path = ? OR path LIKE ? ESCAPE '\\';",
+                (str(root), _escape_like(str(root) + os.sep) + "%"),
+            )
+            self._db.conn.executemany(
+                "INSERT OR REPLACE INTO model_scan_trees (path, mtime, size) VALUES (?, ?, ?);",
+                [(path, mtime, size) for path, (mtime, size) in state.items()],
+            )
+            self._db.conn.commit()
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
@@ -380,11 +380,14 @@ def _fast_safetensors_reader(path: str):
 
         for key, info in definition.items():
             dtype = {
+                "BOOL": torch.bool,
+                "U8": torch.uint8,
                 "I8": torch.int8,
                 "I16": torch.int16,
                 "I32": torch.int32,
                 "I64": torch.int64,
                 "F16": torch.float16,
+                "BF16": torch.bfloat16,
                 "F32": torch.float32,
                 "F64": torch.float64,
             }[info["dtype"]]
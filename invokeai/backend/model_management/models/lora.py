@@ -11,6 +11,7 @@ from .base import (
     classproperty,
     InvalidModelException,
 )
+from invokeai.app.services.config import InvokeAIAppConfig
 # TODO: naming
 from ..lora import LoRAModel as LoRAModelRaw
 
@@ -46,6 +47,7 @@ class LoRAModel(ModelBase):
         model = LoRAModelRaw.from_checkpoint(
             file_path=self.model_path,
             dtype=torch_dtype,
+            mmap=InvokeAIAppConfig.get_config().mmap_models,
         )
 
         self.model_size = model.calc_size()
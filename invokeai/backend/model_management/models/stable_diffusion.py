@@ -18,6 +18,7 @@ from .base import (
     classproperty,
     InvalidModelException,
 )
+from ..model_conversion import ModelConverter
 from invokeai.app.services.config import InvokeAIAppConfig
 from omegaconf import OmegaConf
 
@@ -283,16 +284,33 @@ def _convert_ckpt_and_cache(
     if output_path.exists():
         return output_path
 
+    # converted in another process, so as not to hold up other models
+    return ModelConverter.get_converter().convert(
+        output_path,
+        _convert_ckpt,
+        weights,
+        config_file,
+        version,
+        model_config.variant,
+        name=f"{version.value} model {weights.name}",
+    )
+
+def _convert_ckpt(
+    output_path: Path,
+    weights: Path,
+    config_file: Path,
+    version: BaseModelType,
+    variant: ModelVariantType,
+):
     # to avoid circular import errors
     from ..convert_ckpt_to_diffusers import convert_ckpt_to_diffusers
-    with SilenceWarnings():        
+    with SilenceWarnings():
         convert_ckpt_to_diffusers(
             weights,
             output_path,
             model_version=version,
-            model_variant=model_config.variant,
+            model_variant=variant,
             original_config_file=config_file,
             extract_ema=True,
             scan_needed=True,
         )
-    return output_path
@@ -11,6 +11,7 @@ from .base import (
     ModelNotFoundException,
     InvalidModelException,
 )
+from invokeai.app.services.config import InvokeAIAppConfig
 # TODO: naming
 from ..lora import TextualInversionModel as TextualInversionModelRaw
 
@@ -49,6 +50,7 @@ class TextualInversionModel(ModelBase):
         model = TextualInversionModelRaw.from_checkpoint(
             file_path=checkpoint_path,
             dtype=torch_dtype,
+            mmap=InvokeAIAppConfig.get_config().mmap_models,
         )
 
         self.model_size = model.embedding.nelement() * model.embedding.element_size()
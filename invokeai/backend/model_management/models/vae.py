@@ -17,6 +17,7 @@ from .base import (
     classproperty,
     InvalidModelException,
 )
+from ..model_conversion import ModelConverter
 from invokeai.app.services.config import InvokeAIAppConfig
 from diffusers.utils import is_safetensors_available
 from omegaconf import OmegaConf
@@ -149,6 +150,22 @@ def _convert_vae_ckpt_and_cache(
     else:
         raise Exception(f"Vae conversion not supported for model type: {base_model}")
 
+    # converted in another process, so as not to hold up other models
+    return ModelConverter.get_converter().convert(
+        output_path,
+        _convert_vae_ckpt,
+        weights_path,
+        app_config.root_path / config_file,
+        image_size,
+        name=f"{base_model.value} VAE {weights_path.name}",
+    )
+
+def _convert_vae_ckpt(
+    output_path: Path,
+    weights_path: Path,
+    config_file: Path,
+    image_size: int,
+):
     # this avoids circular import error
     from ..convert_ckpt_to_diffusers import convert_ldm_vae_to_diffusers
     if weights_path.suffix == '.safetensors':
@@ -160,7 +177,7 @@ def _convert_vae_ckpt_and_cache(
     if "state_dict" in checkpoint:
         checkpoint = checkpoint["state_dict"]
 
-    config = OmegaConf.load(app_config.root_path/config_file)
+    config = OmegaConf.load(config_file)
 
     vae_model = convert_ldm_vae_to_diffusers(
         checkpoint = checkpoint,
@@ -171,4 +188,3 @@ def _convert_vae_ckpt_and_cache(
         output_path,
         safe_serialization=is_safetensors_available()
     )
-    return output_path
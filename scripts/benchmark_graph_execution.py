@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+'''
+Measure the scheduling overhead of GraphExecutionState on synthetic
+iterate/collect graphs. Each graph fans a RangeInvocation out through an
+IterateInvocation into a short chain of math nodes and collects the results:
+
+   range -> iterate -> mul -> add -> collect
+
+The invocations themselves are trivial, so the reported times are almost
+entirely spent preparing nodes and looking for the next node to run.
+
+The second table isolates the preparation of the fan-out: the time taken
+to create every prepared mul/add node once the iterator has run, and the
+time to copy the same number of nodes with copy.deepcopy() for comparison.
+
+Usage:
+   python scripts/benchmark_graph_execution.py --sizes 10 100 1000
+'''
+
+import argparse
+import copy
+import time
+
+from invokeai.app.invocations.baseinvocation import InvocationContext
+from invokeai.app.invocations.collections import RangeInvocation
+from invokeai.app.invocations.math import AddInvocation, MultiplyInvocation
+from invokeai.app.services.graph import (
+    CollectInvocation,
+    Edge,
+    EdgeConnection,
+    Graph,
+    GraphExecutionState,
+    IterateInvocation,
+    _copy_node,
+)
+
+
+def create_edge(from_id: str, from_field: str, to_id: str, to_field: str) -> Edge:
+    return Edge(
+        source=EdgeConnection(node_id=from_id, field=from_field),
+        destination=EdgeConnection(node_id=to_id, field=to_field),
+    )
+
+
+def create_graph(size: int) -> Graph:
+    graph = Graph()
+    graph.add_node(RangeInvocation(id="range", start=0, stop=size, step=1))
+    graph.add_node(IterateInvocation(id="iterate"))
+    graph.add_node(MultiplyInvocation(id="mul", b=10))
+    graph.add_node(AddInvocation(id="add", b=1))
+    graph.add_node(CollectInvocation(id="collect"))
+    graph.add_edge(create_edge("range", "collection", "iterate", "collection"))
+    graph.add_edge(create_edge("iterate", "item", "mul", "a"))
+    graph.add_edge(create_edge("mul", "a", "add", "a"))
+    graph.add_edge(create_edge("add", "a", "collect", "item"))
+    return graph
+
+
+def run_sequential(state: GraphExecutionState, context: InvocationContext) -> int:
+    count = 0
+    while (node := state.next()) is not None:
+        state.complete(node.id, node.invoke(context))
+        count += 1
+    return count
+
+
+def run_ready_sets(state: GraphExecutionState, context: InvocationContext) -> int:
+    count = 0
+    while ready := state.next_ready():
+        for node in ready:
+            state.complete(node.id, node.invoke(context))
+            count += 1
+    return count
+
+
+def benchmark(size: int, runner) -> tuple[int, float]:
+    state = GraphExecutionState(graph=create_graph(size))
+    context = InvocationContext(services=None, graph_execution_state_id=state.id)  # type: ignore
+
+    start = time.perf_counter()
+    count = runner(state, context)
+    elapsed = time.perf_counter() - start
+
+    assert state.is_complete() and not state.has_error()
+    return count, elapsed
+
+
+def benchmark_prepare(size: int) -> tuple[int, float, float, float]:
+    state = GraphExecutionState(graph=create_graph(size))
+    context = InvocationContext(services=None, graph_execution_state_id=state.id)  # type: ignore
+
+    # Run the range and iterate nodes
+    while "iterate" not in state.executed:
+        for node in state.next_ready():
+            state.complete(node.id, node.invoke(context))
+
+    prepared_count = len(state.execution_graph.nodes)
+    start = time.perf_counter()
+    state.next_ready()
+    prepare_elapsed = time.perf_counter() - start
+    prepared_count = len(state.execution_graph.nodes) - prepared_count
+
+    node = state.graph.get_node("mul")
+    start = time.perf_counter()
+    for _ in range(prepared_count):
+        copy.deepcopy(node)
+    deepcopy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(prepared_count):
+        _copy_node(node, str(i))
+    copy_elapsed = time.perf_counter() - start
+
+    return prepared_count, prepare_elapsed, deepcopy_elapsed, copy_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="number of iterations to fan out")
+    opt = parser.parse_args()
+
+    print(f"{'iterations':>10} {'mode':>10} {'nodes':>7} {'total (s)':>10} {'per node (ms)':>14}")
+    for size in opt.sizes:
+        for mode, runner in (("next", run_sequential), ("next_ready", run_ready_sets)):
+            count, elapsed = benchmark(size, runner)
+            print(f"{size:>10} {mode:>10} {count:>7} {elapsed:>10.3f} {1000 * elapsed / count:>14.3f}")
+
+    print()
+    print(f"{'iterations':>10} {'prepared':>9} {'prepare (s)':>12} {'deepcopy (s)':>13} {'copy (s)':>9}")
+    for size in opt.sizes:
+        count, prepare_elapsed, deepcopy_elapsed, copy_elapsed = benchmark_prepare(size)
+        print(f"{size:>10} {count:>9} {prepare_elapsed:>12.3f} {deepcopy_elapsed:>13.3f} {copy_elapsed:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+Measure how long fusing LoRAs into a model's weights takes.
+
+A synthetic model of linear layers named like the UNet's attention blocks
+is patched with synthetic LoRAs that each touch a number of its layers.
+For each LoRA size the script reports:
+
+- the time to resolve every layer key by walking the module tree, which is
+  what patching used to do on every application;
+- the time to build the per-model key index that replaces it;
+- the time to fuse all the LoRAs into the weights the first time;
+- the time to apply the same LoRAs again, which reuses the fused weights.
+
+   python scripts/benchmark_lora_patching.py --layers 100 300 1000 --loras 3 --dim 320
+'''
+
+import argparse
+import time
+
+import torch
+
+from invokeai.backend.model_management.lora import LoRALayer, LoRAModel, ModelPatcher
+
+PREFIX = "lora_unet_"
+
+
+class Block(torch.nn.Module):
+    def __init__(self, dim: int):
+        super().__init__()
+        self.to_q = torch.nn.Linear(dim, dim, bias=False)
+        self.to_k = torch.nn.Linear(dim, dim, bias=False)
+        self.to_v = torch.nn.Linear(dim, dim, bias=False)
+        self.proj_out = torch.nn.Linear(dim, dim, bias=False)
+
+
+def make_model(layers: int, dim: int, device: torch.device, dtype: torch.dtype) -> torch.nn.Module:
+    model = torch.nn.Module()
+    model.down_blocks = torch.nn.ModuleList([Block(dim) for _ in range((layers + 3) // 4)])
+    return model.to(device=device, dtype=dtype)
+
+
+def make_lora(name: str, model: torch.nn.Module, layers: int, rank: int, dtype: torch.dtype) -> LoRAModel:
+    lora_layers = dict()
+    for module_key, module in model.named_modules():
+        if not isinstance(module, torch.nn.Linear) or len(lora_layers) == layers:
+            continue
+        layer_key = PREFIX + module_key.replace(".", "_")
+        out_features, in_features = module.weight.shape
+        lora_layers[layer_key] = LoRALayer(
+            layer_key,
+            {
+                "lora_down.weight": torch.randn(rank, in_features, dtype=dtype),
+                "lora_up.weight": torch.randn(out_features, rank, dtype=dtype),
+                "alpha": torch.tensor(float(rank)),
+            },
+        )
+    return LoRAModel(name=name, layers=lora_layers, device=torch.device("cpu"), dtype=dtype)
+
+
+def timed(f) -> float:
+    start = time.perf_counter()
+    f()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start)
+
+
+def apply(model: torch.nn.Module, loras: list):
+    with ModelPatcher.apply_lora_unet(model, loras):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, nargs="+", default=[100, 300, 1000], help="number of layers of each LoRA")
+    parser.add_argument("--loras", type=int, default=3, help="number of LoRAs applied together")
+    parser.add_argument("--dim", type=int, default=320, help="width of the linear layers")
+    parser.add_argument("--rank", type=int, default=8, help="rank of the LoRA layers")
+    opt = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.float16 if device.type == "cuda" else torch.float32
+
+    print(f"{'layers':>6} {'resolve (ms)':>13} {'index (ms)':>11} {'first apply (ms)':>17} {'reapply (ms)':>13}")
+    for layers in opt.layers:
+        model = make_model(layers, opt.dim, device, dtype)
+        loras = [(make_lora(str(i), model, layers, opt.rank, dtype), 0.5) for i in range(opt.loras)]
+        layer_keys = list(loras[0][0].layers)
+
+        resolve = timed(lambda: [ModelPatcher._resolve_lora_key(model, k, PREFIX) for k in layer_keys])
+        index = timed(lambda: ModelPatcher._build_lora_key_index(model, PREFIX))
+        first = timed(lambda: apply(model, loras))
+        again = timed(lambda: apply(model, loras))
+        print(f"{layers:>6} {resolve:>13.1f} {index:>11.1f} {first:>17.1f} {again:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
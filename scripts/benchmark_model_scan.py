@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+'''
+Measure how long scanning the models directory takes with many models.
+
+A runtime root is filled with synthetic LoRA model folders, plus files
+that are not models, and the script reports the time taken by:
+
+- the first scan, which lists every folder and probes every entry;
+- a rescan without the scan index, which is what every lookup of an
+  unknown model used to cost;
+- a rescan with the scan index, when nothing changed;
+- a rescan by a new ModelManager, which reuses the index saved in the
+  database;
+- lookups of a model that does not exist, with the missing model cached
+  and without it.
+
+   python scripts/benchmark_model_scan.py --models 1000 --invalid 100 --lookups 100
+'''
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from invokeai.app.services.config import InvokeAIAppConfig
+from invokeai.backend.model_management import BaseModelType, ModelManager, ModelType
+from invokeai.backend.model_management.model_manager import ModelNotFoundException
+from invokeai.backend.model_management.model_scan_index import ModelScanIndex
+
+
+def make_root(root: Path, models: int, invalid: int):
+    loras = root / "models" / BaseModelType.StableDiffusion1.value / ModelType.Lora.value
+    for i in range(models):
+        (loras / f"lora{i:05d}").mkdir(parents=True)
+        (loras / f"lora{i:05d}" / "pytorch_lora_weights.bin").touch()
+    for i in range(invalid):
+        (loras / f"notes{i:05d}.txt").touch()
+    (root / "configs").mkdir()
+
+
+def timed(f) -> float:
+    start = time.perf_counter()
+    f()
+    return 1000 * (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", type=int, default=1000, help="number of model folders")
+    parser.add_argument("--invalid", type=int, default=100, help="number of entries that are not models")
+    parser.add_argument("--lookups", type=int, default=100, help="number of lookups of a missing model")
+    opt = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        make_root(root, opt.models, opt.invalid)
+        config = InvokeAIAppConfig.get_config()
+        config.parse_args(argv=["--root", str(root), "--log_level", "error"])
+        models_yaml = root / "configs" / "models.yaml"
+
+        managers = []
+        first = timed(lambda: managers.append(ModelManager(models_yaml)))
+        mgr = managers[0]
+        print(f"{len(mgr.models)} models found")
+
+        index = mgr.scan_index
+
+        def scan_without_index():
+            mgr.scan_index = ModelScanIndex()
+            mgr.scan_models_directory()
+
+        without_index = timed(scan_without_index)
+        mgr.scan_index = index
+        with_index = timed(mgr.scan_models_directory)
+        restart = timed(lambda: ModelManager(models_yaml))
+
+        def lookups(clear: bool):
+            for _ in range(opt.lookups):
+                if clear:
+                    mgr._missing_models.clear()
+                try:
+                    mgr.get_model("no-such-model", BaseModelType.StableDiffusion1, ModelType.Lora)
+                except ModelNotFoundException:
+                    pass
+
+        cached = timed(lambda: lookups(False)) / opt.lookups
+        uncached = timed(lambda: lookups(True)) / opt.lookups
+
+    print(f"{'first scan':<32} {first:>9.1f} ms")
+    print(f"{'rescan without index':<32} {without_index:>9.1f} ms")
+    print(f"{'rescan with index':<32} {with_index:>9.1f} ms")
+    print(f"{'new ModelManager with index':<32} {restart:>9.1f} ms")
+    print(f"{'missing model lookup':<32} {uncached:>9.3f} ms")
+    print(f"{'missing model lookup, cached':<32} {cached:>9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+'''
+Measure how sqlite storage reads hold up while other threads write.
+
+Reader threads call `list()`/`get()` on a session storage and `get_many()`
+on the image records, the way the web UI polls the gallery, while writer
+threads save sessions and images, the way the processor does during
+generation. Each run uses a fresh database file in a temporary directory.
+
+For every `synchronous` setting the script runs once without writers and
+once with them, and reports the throughput and read latencies:
+
+   python scripts/benchmark_sqlite_concurrency.py --readers 4 --writers 2 --seconds 5
+'''
+
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from invokeai.app.models.image import ImageCategory, ResourceOrigin
+from invokeai.app.services.board_image_record_storage import SqliteBoardImageRecordStorage
+from invokeai.app.services.board_record_storage import SqliteBoardRecordStorage
+from invokeai.app.services.image_record_storage import SqliteImageRecordStorage
+from invokeai.app.services.sqlite import SqliteItemStorage, get_database
+
+
+class Session(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    payload: str = Field(default="x" * 4096)
+
+
+def run(db_path: Path, synchronous: str, readers: int, writers: int, seconds: float, rows: int):
+    get_database(db_path, synchronous=synchronous)
+    sessions = SqliteItemStorage[Session](db_path, "sessions")
+    images = SqliteImageRecordStorage(db_path)
+    # the image queries join the board tables
+    SqliteBoardRecordStorage(db_path)
+    SqliteBoardImageRecordStorage(db_path)
+
+    session_ids = []
+    for _ in range(rows):
+        session = Session()
+        sessions.set(session)
+        session_ids.append(session.id)
+
+    stop = threading.Event()
+    read_latencies: list[list[float]] = [list() for _ in range(readers)]
+    write_counts = [0] * writers
+
+    def read(latencies: list[float]):
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            sessions.list(page=0, per_page=20)
+            sessions.get(session_ids[i % len(session_ids)])
+            images.get_many(offset=0, limit=20)
+            latencies.append(time.perf_counter() - start)
+            i += 1
+
+    def write(index: int):
+        while not stop.is_set():
+            sessions.set(Session())
+            images.save(
+                image_name=f"{uuid.uuid4()}.png",
+                image_origin=ResourceOrigin.INTERNAL,
+                image_category=ImageCategory.GENERAL,
+                session_id=None,
+                width=512,
+                height=512,
+                node_id=None,
+                metadata=None,
+            )
+            write_counts[index] += 1
+
+    threads = [threading.Thread(target=read, args=(l,)) for l in read_latencies]
+    threads += [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(l for ls in read_latencies for l in ls)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return (
+        len(latencies) / seconds,
+        sum(write_counts) / seconds,
+        1000 * statistics.median(latencies),
+        1000 * p99,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=4, help="number of reader threads")
+    parser.add_argument("--writers", type=int, default=2, help="number of writer threads")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each run")
+    parser.add_argument("--rows", type=int, default=500, help="number of sessions stored before starting")
+    parser.add_argument("--synchronous", nargs="+", default=["NORMAL", "FULL"], help="synchronous settings to compare")
+    opt = parser.parse_args()
+
+    print(f"{'synchronous':>11} {'writers':>7} {'reads/s':>9} {'writes/s':>9} {'read p50 (ms)':>14} {'read p99 (ms)':>14}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for synchronous in opt.synchronous:
+            for writers in (0, opt.writers):
+                db_path = Path(tmpdir) / f"{synchronous}-{writers}.db"
+                reads, writes, p50, p99 = run(db_path, synchronous, opt.readers, writers, opt.seconds, opt.rows)
+                print(f"{synchronous:>11} {writers:>7} {reads:>9.0f} {writes:>9.0f} {p50:>14.2f} {p99:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
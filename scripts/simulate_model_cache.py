@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+'''
+Replay a trace of model requests against the model cache with each
+eviction policy, and report how often each tier of the cache was hit.
+
+Traces are recorded by setting `model_cache_trace` in invokeai.yaml: every
+model request is appended to the file as a line of JSON with the model's
+key, its size in bytes and whether it was requested on the execution
+device. Without a trace, a synthetic one is generated: sessions that use a
+few popular and many rarely used main models, with random LoRAs.
+
+The models are stand-ins without tensors and the "GPU" is the meta
+device, so replays run on any machine and take no memory. A RAM hit is a
+request that did not load the model from disk, and a VRAM hit one that
+did not move it into the execution device.
+
+   python scripts/simulate_model_cache.py --trace model_requests.jsonl --ram 6 --vram 2.75
+   python scripts/simulate_model_cache.py --sessions 500 --policies lru lrfu
+'''
+
+import argparse
+import gc
+import json
+import logging
+import random
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+
+from invokeai.backend.model_management.cache_policy import CACHE_POLICIES
+from invokeai.backend.model_management.model_cache import GIG, ModelCache
+from invokeai.backend.model_management.models import BaseModelType, ModelBase, ModelType, SubModelType
+
+EXECUTION_DEVICE = torch.device("meta")
+
+
+class TraceModel:
+    def __init__(self, counts: Counter):
+        self.counts = counts
+        self.device = torch.device("cpu")
+
+    def to(self, device: torch.device):
+        if device == EXECUTION_DEVICE and self.device != device:
+            self.counts["moves"] += 1
+        self.device = device
+        return self
+
+
+class TraceModelInfo(ModelBase):
+    # path of the stand-in of each model -> size in bytes
+    sizes: Dict[str, int] = dict()
+    counts = Counter()
+
+    @classmethod
+    def detect_format(cls, path: str) -> str:
+        return "trace"
+
+    @classmethod
+    def save_to_config(cls) -> bool:
+        return False
+
+    def get_size(self, child_type: Optional[SubModelType] = None) -> int:
+        return self.sizes[str(self.model_path)]
+
+    def get_model(self, torch_dtype: Optional[torch.dtype], child_type: Optional[SubModelType] = None):
+        self.counts["loads"] += 1
+        self.counts["loaded_bytes"] += self.get_size()
+        return TraceModel(self.counts)
+
+
+def read_trace(path: Path) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_trace(sessions: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    main_models = [f"main{i}" for i in range(8)]
+    # a few main models are used much more often than the others
+    weights = [1 / (i + 1) ** 1.2 for i in range(len(main_models))]
+    submodels = dict(text_encoder=int(0.25 * GIG), unet=int(1.6 * GIG), vae=int(0.16 * GIG))
+    loras = [f"lora{i}" for i in range(20)]
+
+    trace = list()
+    for _ in range(sessions):
+        main = rng.choices(main_models, weights)[0]
+        for lora in rng.sample(loras, rng.randint(0, 2)):
+            trace.append(dict(key=lora, size=int(0.15 * GIG), gpu_load=False))
+        for submodel, size in submodels.items():
+            trace.append(dict(key=f"{main}:{submodel}", size=size, gpu_load=True))
+    return trace
+
+
+def replay(trace: List[dict], policy: str, ram: float, vram: float, root: Path) -> Counter:
+    TraceModelInfo.counts.clear()
+    TraceModelInfo.sizes.clear()
+    paths = dict()
+    for request in trace:
+        if request["key"] not in paths:
+            paths[request["key"]] = path = root / f"model{len(paths)}"
+            path.mkdir(exist_ok=True)
+            TraceModelInfo.sizes[str(path)] = request["size"]
+
+    quiet = logging.getLogger("simulate_model_cache")
+    quiet.setLevel(logging.WARNING)
+    cache = ModelCache(
+        max_cache_size=ram,
+        max_vram_cache_size=vram,
+        execution_device=EXECUTION_DEVICE,
+        storage_device=torch.device("cpu"),
+        cache_policy=policy,
+        logger=quiet,
+    )
+
+    counts = TraceModelInfo.counts
+    for request in trace:
+        loads, moves = counts["loads"], counts["moves"]
+        locker = cache.get_model(
+            paths[request["key"]],
+            TraceModelInfo,
+            BaseModelType.StableDiffusion1,
+            ModelType.Main,
+            gpu_load=request["gpu_load"],
+        )
+        with locker:
+            pass
+        counts["requests"] += 1
+        counts["ram_hits"] += counts["loads"] == loads
+        if request["gpu_load"]:
+            counts["gpu_requests"] += 1
+            counts["vram_hits"] += counts["moves"] == moves
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", type=Path, help="trace recorded with model_cache_trace")
+    parser.add_argument("--sessions", type=int, default=300, help="number of sessions of the synthetic trace")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic trace")
+    parser.add_argument("--ram", type=float, default=6.0, help="size of the RAM cache, in GB")
+    parser.add_argument("--vram", type=float, default=2.75, help="size of the VRAM cache, in GB")
+    parser.add_argument("--policies", nargs="+", default=list(CACHE_POLICIES), choices=list(CACHE_POLICIES))
+    opt = parser.parse_args()
+
+    trace = read_trace(opt.trace) if opt.trace else make_trace(opt.sessions, opt.seed)
+    # the cache collects garbage after evictions: leave out the objects of the imported libraries
+    gc.freeze()
+    print(f"{len(trace)} requests of {len({r['key'] for r in trace})} models, RAM {opt.ram} GB, VRAM {opt.vram} GB")
+    print(f"{'policy':>6} {'RAM hits':>9} {'VRAM hits':>10} {'loaded (GB)':>12} {'moves':>6}")
+    with tempfile.TemporaryDirectory() as root:
+        for policy in opt.policies:
+            counts = replay(trace, policy, opt.ram, opt.vram, Path(root))
+            ram_hits = counts["ram_hits"] / max(counts["requests"], 1)
+            vram_hits = counts["vram_hits"] / max(counts["gpu_requests"], 1)
+            loaded = counts["loaded_bytes"] / GIG
+            print(f"{policy:>6} {ram_hits:>9.1%} {vram_hits:>10.1%} {loaded:>12.1f} {counts['moves']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+import torch
+from compel import Compel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+from invokeai.app.invocations.compel import encode_plain_prompts, encode_prompts, get_conditioning_name, is_plain_prompt
+from invokeai.app.invocations.model import ClipField, LoraInfo, ModelInfo
+from invokeai.app.services.latent_storage import DiskLatentsStorage
+from invokeai.backend.model_management import BaseModelType, ModelType, SubModelType
+
+
+@pytest.fixture(scope="module")
+def compel(tmp_path_factory):
+    # a tiny CLIP, with a vocabulary of single letters
+    path = tmp_path_factory.mktemp("clip")
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for c in "abcdefghijklmnopqrstuvwxyz":
+        vocab[c] = len(vocab)
+        vocab[c + "</w>"] = len(vocab)
+    (path / "vocab.json").write_text(json.dumps(vocab))
+    (path / "merges.txt").write_text("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(path / "vocab.json", path / "merges.txt", pad_token="<|endoftext|>", model_max_length=8)
+
+    torch.manual_seed(0)
+    config = CLIPTextConfig(
+        vocab_size=len(vocab),
+        hidden_size=16,
+        intermediate_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        max_position_embeddings=8,
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+    )
+    text_encoder = CLIPTextModel(config).eval()
+    return Compel(tokenizer=tokenizer, text_encoder=text_encoder, truncate_long_prompts=False)
+
+
+@torch.no_grad()
+def test_batched_prompts_are_encoded_as_compel_does(compel):
+    # the longer prompts take several chunks of tokens
+    prompts = ["a cat", "a (red)++ house", "a dog and a cat in a blue house", ""]
+    flattened = [Compel.parse_prompt_string(prompt).prompts[0] for prompt in prompts]
+    assert all(is_plain_prompt(prompt) for prompt in flattened)
+
+    for prompt, c in zip(flattened, encode_plain_prompts(compel, flattened)):
+        expected, _ = compel.build_conditioning_tensor_for_prompt_object(prompt)
+        assert torch.allclose(c, expected)
+
+
+def test_prompts_with_downweighted_fragments_are_not_plain():
+    assert not is_plain_prompt(Compel.parse_prompt_string("a (red)-- house").prompts[0])
+    assert not is_plain_prompt(Compel.parse_prompt_string('("a cat", "a dog").blend(1, 1)').prompts[0])
+    assert not is_plain_prompt(Compel.parse_prompt_string('a "cat".swap("dog")').prompts[0])
+
+
+class MockModelManager:
+    def __init__(self):
+        self.hashes = dict(embedding="embedding weights")
+
+    def get_model_hash(self, model_name, base_model, model_type):
+        return self.hashes.get(model_name, model_name)
+
+    def model_exists(self, model_name, base_model, model_type):
+        return model_name in self.hashes
+
+
+def clip_field() -> ClipField:
+    def model_info(submodel):
+        return ModelInfo(
+            model_name="sd-1.5",
+            base_model=BaseModelType.StableDiffusion1,
+            model_type=ModelType.Main,
+            submodel=submodel,
+        )
+
+    return ClipField(
+        tokenizer=model_info(SubModelType.Tokenizer),
+        text_encoder=model_info(SubModelType.TextEncoder),
+        skipped_layers=0,
+        loras=[],
+    )
+
+
+def test_conditioning_names_follow_what_conditioning_depends_on():
+    context = SimpleNamespace(services=SimpleNamespace(model_manager=MockModelManager()))
+    clip = clip_field()
+    name = get_conditioning_name(context, clip, "a <embedding> cat")
+    assert get_conditioning_name(context, clip.copy(deep=True), "a <embedding> cat") == name
+    assert get_conditioning_name(context, clip, "a <embedding> dog") != name
+    assert get_conditioning_name(context, clip.copy(update=dict(skipped_layers=1)), "a <embedding> cat") != name
+
+    lora = LoraInfo(model_name="lora", base_model=BaseModelType.StableDiffusion1, model_type=ModelType.Lora, weight=0.5)
+    assert get_conditioning_name(context, clip.copy(update=dict(loras=[lora])), "a <embedding> cat") != name
+
+    context.services.model_manager.hashes["embedding"] = "retrained embedding weights"
+    assert get_conditioning_name(context, clip, "a <embedding> cat") != name
+
+
+def test_reused_conditioning_does_not_expire(tmp_path):
+    latents = DiskLatentsStorage(tmp_path)
+    context = SimpleNamespace(services=SimpleNamespace(model_manager=MockModelManager(), latents=latents))
+    clip = clip_field()
+    name = get_conditioning_name(context, clip, "a cat")
+    latents.save(name, torch.zeros(1))
+    os.utime(latents.get_path(name), (time.time() - 100, time.time() - 100))
+    assert latents.get_names_older_than(50) == [name]
+
+    # encoded by an earlier session
+    assert encode_prompts(context, clip, ["a cat"]) == [name]
+    assert latents.get_names_older_than(50) == []
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from invokeai.app.api import events as api_events
+from invokeai.app.api.events import FastAPIEventService
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(api_events, "dispatch", lambda event_name, payload, **kwargs: dispatched.append(payload))
+    return dispatched
+
+
+def session_event(event: str, **data) -> dict:
+    return dict(event=event, data=dict(graph_execution_state_id="session", **data))
+
+
+def progress(step: int, node: str = "node") -> dict:
+    return session_event("generator_progress", source_node_id=node, step=step)
+
+
+def run(send, **kwargs) -> FastAPIEventService:
+    """Sends events from another thread, and waits for them to be dispatched"""
+    async def main():
+        service = FastAPIEventService(event_handler_id=0, **kwargs)
+        await asyncio.to_thread(send, service)
+        while service.get_stats().depth:
+            await asyncio.sleep(0.01)
+        return service
+
+    return asyncio.run(main())
+
+
+def test_events_are_dispatched_in_order(dispatched):
+    def send(service):
+        for i in range(250):
+            service.dispatch("session_event", session_event("invocation_complete", i=i))
+
+    service = run(send, max_batch_size=100)
+    assert [payload["data"]["i"] for payload in dispatched] == list(range(250))
+    assert service.get_stats().dispatched == 250
+
+
+def test_progress_events_are_coalesced(dispatched):
+    def send(service):
+        # the loop cannot dispatch before this thread is done
+        with service._FastAPIEventService__condition:
+            for step in range(3):
+                service.dispatch("session_event", progress(step))
+                service.dispatch("session_event", progress(step, node="other node"))
+            service.dispatch("session_event", session_event("invocation_complete"))
+
+    service = run(send)
+    assert [(p["event"], p["data"].get("source_node_id"), p["data"].get("step")) for p in dispatched] == [
+        ("generator_progress", "node", 2),
+        ("generator_progress", "other node", 2),
+        ("invocation_complete", None, None),
+    ]
+    assert service.get_stats().coalesced == 4
+
+
+def test_senders_wait_for_a_full_queue(dispatched):
+    def send(service):
+        for i in range(20):
+            service.dispatch("session_event", session_event("invocation_complete", i=i))
+
+    service = run(send, max_queue_size=4)
+    assert len(dispatched) == 20
+    assert service.get_stats().max_depth <= 4
+
+
+def test_full_queue_drops_progress_first(dispatched):
+    def send(service):
+        with service._FastAPIEventService__condition:
+            service.dispatch("session_event", progress(0))
+            service.dispatch("session_event", session_event("invocation_complete", i=0))
+            service.dispatch("session_event", session_event("invocation_complete", i=1))
+
+    service = run(send, max_queue_size=2)
+    assert [p["event"] for p in dispatched] == ["invocation_complete", "invocation_complete"]
+    assert service.get_stats().dropped == 1
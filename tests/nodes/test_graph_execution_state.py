@@ -1,6 +1,7 @@
 from .test_invoker import create_edge
 from .test_nodes import (
     TestEventService,
+    ImageToImageTestInvocation,
     TextToImageTestInvocation,
     PromptTestInvocation,
     PromptCollectionTestInvocation,
@@ -14,6 +15,7 @@ from invokeai.app.invocations.baseinvocation import (
     InvocationContext,
 )
 from invokeai.app.invocations.collections import RangeInvocation
+from invokeai.app.invocations.image import ImageField
 from invokeai.app.invocations.math import AddInvocation, MultiplyInvocation
 from invokeai.app.services.invocation_services import InvocationServices
 from invokeai.app.services.graph import (
@@ -241,3 +243,104 @@ def test_graph_executes_depth_first(mock_services):
 
     assert get_completed_count(g, "prompt_iterated") == 2
     assert get_completed_count(g, "prompt_successor") == 2
+
+
+def test_graph_state_does_not_return_executing_nodes(simple_graph, mock_services):
+    g = GraphExecutionState(graph=simple_graph)
+    n1 = g.next()
+
+    assert n1 is not None
+    assert n1.id in g.executing
+    assert g.next() is None
+
+    g.complete(n1.id, n1.invoke(InvocationContext(mock_services, "1")))
+    n2 = g.next()
+
+    assert n1.id not in g.executing
+    assert g.prepared_source_mapping[n2.id] == "2"
+
+
+def test_graph_state_returns_all_ready_nodes(mock_services):
+    graph = Graph()
+    graph.add_node(RangeInvocation(id="0", start=0, stop=4, step=1))
+    graph.add_node(IterateInvocation(id="1"))
+    graph.add_node(MultiplyInvocation(id="2", b=10))
+    graph.add_node(AddInvocation(id="3", b=1))
+    graph.add_edge(create_edge("0", "collection", "1", "collection"))
+    graph.add_edge(create_edge("1", "item", "2", "a"))
+    graph.add_edge(create_edge("2", "a", "3", "a"))
+
+    g = GraphExecutionState(graph=graph)
+
+    def invoke_ready() -> list[BaseInvocation]:
+        ready = g.next_ready()
+        for n in ready:
+            g.complete(n.id, n.invoke(InvocationContext(mock_services, "1")))
+        return ready
+
+    assert [g.prepared_source_mapping[n.id] for n in invoke_ready()] == ["0"]
+    assert len(invoke_ready()) == 4 # all iterations are ready at once
+    assert len(invoke_ready()) == 4 # as are all the multiply branches
+    assert len(invoke_ready()) == 4
+    assert g.next_ready() == []
+    assert g.is_complete()
+
+    results = set([g.results[n].a for n in g.source_prepared_mapping["3"]])
+    assert results == set([1, 11, 21, 31])
+
+
+def test_graph_state_executes_after_reload(mock_services):
+    """Tests that execution continues correctly when the state is reloaded between nodes"""
+    graph = Graph()
+    graph.add_node(RangeInvocation(id="0", start=0, stop=3, step=1))
+    graph.add_node(IterateInvocation(id="1"))
+    graph.add_node(MultiplyInvocation(id="2", b=10))
+    graph.add_node(AddInvocation(id="3", b=1))
+    graph.add_node(CollectInvocation(id="4"))
+    graph.add_edge(create_edge("0", "collection", "1", "collection"))
+    graph.add_edge(create_edge("1", "item", "2", "a"))
+    graph.add_edge(create_edge("2", "a", "3", "a"))
+    graph.add_edge(create_edge("3", "a", "4", "item"))
+
+    g = GraphExecutionState(graph=graph)
+    while not g.is_complete():
+        g = GraphExecutionState.parse_raw(g.json())
+        n, _ = invoke_next(g, mock_services)
+        assert n is not None
+
+    assert len(g.executed_history) == 5
+    collect_node = next(iter(g.source_prepared_mapping["4"]))
+    assert sorted(g.results[collect_node].collection) == [1, 11, 21]
+
+
+def test_prepared_nodes_do_not_share_mutable_fields(mock_services):
+    """Tests that nodes prepared for each iteration get their own copies of mutable field values"""
+    graph = Graph()
+    graph.add_node(PromptCollectionTestInvocation(id="1", collection=["Banana sushi", "Cat sushi"]))
+    graph.add_node(IterateInvocation(id="2"))
+    graph.add_node(ImageToImageTestInvocation(id="3", image=ImageField(image_name="source")))
+    graph.add_node(CollectInvocation(id="4"))
+    graph.add_edge(create_edge("1", "collection", "2", "collection"))
+    graph.add_edge(create_edge("2", "item", "3", "prompt"))
+    graph.add_edge(create_edge("3", "image", "4", "item"))
+
+    g = GraphExecutionState(graph=graph)
+    while not g.is_complete():
+        invoke_next(g, mock_services)
+
+    source = g.graph.get_node("3")
+    prepared = [g.execution_graph.get_node(n) for n in g.source_prepared_mapping["3"]]
+    assert len(prepared) == 2
+    assert all(n.image is not source.image for n in prepared)
+    assert prepared[0].image is not prepared[1].image
+    prepared[0].image.image_name = "changed"
+    assert source.image.image_name == "source"
+    assert prepared[1].image.image_name == "source"
+
+    prepared_collect = g.execution_graph.get_node(next(iter(g.source_prepared_mapping["4"])))
+    assert prepared_collect.collection is not g.graph.get_node("4").collection
+    assert g.graph.get_node("4").collection == []
+
+    # the iterations and their collection are unchanged
+    assert sorted(n.prompt for n in prepared) == ["Banana sushi", "Cat sushi"]
+    assert sorted(i.image_name for i in g.results[prepared_collect.id].collection) == sorted(n.id for n in prepared)
@@ -0,0 +1,112 @@
+from .test_invoker import create_edge
+from invokeai.app.invocations.baseinvocation import InvocationContext
+from invokeai.app.invocations.collections import RangeInvocation
+from invokeai.app.invocations.math import AddInvocation, MultiplyInvocation
+from invokeai.app.services.graph import (
+    CollectInvocation,
+    Graph,
+    GraphExecutionState,
+    IterateInvocation,
+)
+from invokeai.app.services.graph_execution_storage import SqliteGraphExecutionStateStorage
+from invokeai.app.services.sqlite import sqlite_memory
+import pytest
+
+
+@pytest.fixture
+def iterate_graph() -> Graph:
+    g = Graph()
+    g.add_node(RangeInvocation(id="range", start=0, stop=10, step=1))
+    g.add_node(IterateInvocation(id="iterate"))
+    g.add_node(MultiplyInvocation(id="mul", b=10))
+    g.add_node(AddInvocation(id="add", b=1))
+    g.add_node(CollectInvocation(id="collect"))
+    g.add_edge(create_edge("range", "collection", "iterate", "collection"))
+    g.add_edge(create_edge("iterate", "item", "mul", "a"))
+    g.add_edge(create_edge("mul", "a", "add", "a"))
+    g.add_edge(create_edge("add", "a", "collect", "item"))
+    return g
+
+
+def count_deltas(storage: SqliteGraphExecutionStateStorage) -> int:
+    storage._cursor.execute(f"SELECT count(*) FROM {storage._deltas_table_name};")
+    return storage._cursor.fetchone()[0]
+
+
+def run_through_storage(storage: SqliteGraphExecutionStateStorage, state: GraphExecutionState) -> GraphExecutionState:
+    storage.set(state)
+    context = InvocationContext(services=None, graph_execution_state_id=state.id)  # type: ignore
+    while True:
+        state = storage.get(state.id)
+        node = state.next()
+        if node is None:
+            return state
+        storage.set(state)
+        state = storage.get(state.id)
+        state.complete(node.id, node.invoke(context))
+        storage.set(state)
+
+
+def test_storage_round_trips_execution(iterate_graph):
+    storage = SqliteGraphExecutionStateStorage(sqlite_memory)
+    state = run_through_storage(storage, GraphExecutionState(graph=iterate_graph))
+
+    assert state.is_complete()
+    collect_id = next(iter(state.source_prepared_mapping["collect"]))
+    assert sorted(state.results[collect_id].collection) == [i * 10 + 1 for i in range(10)]
+
+    stored = storage.get(state.id)
+    assert stored == state
+    assert GraphExecutionState.parse_raw(storage.get_raw(state.id)) == state
+
+
+def test_storage_writes_deltas(iterate_graph):
+    storage = SqliteGraphExecutionStateStorage(sqlite_memory)
+    state = GraphExecutionState(graph=iterate_graph)
+    storage.set(state)
+    assert count_deltas(storage) == 0
+
+    state.next()
+    storage.set(state)
+    assert count_deltas(storage) == 1
+
+    # Changing the source graph writes a snapshot
+    state.graph.add_node(AddInvocation(id="other", b=2))
+    storage.set(state)
+    assert count_deltas(storage) == 0
+    assert storage.get(state.id) == state
+
+
+def test_storage_reads_states_written_by_another_instance(iterate_graph, tmp_path):
+    filename = str(tmp_path / "sessions.db")
+    storage = SqliteGraphExecutionStateStorage(filename)
+    state = GraphExecutionState(graph=iterate_graph)
+    storage.set(state)
+    node = state.next()
+    storage.set(state)
+
+    storage = SqliteGraphExecutionStateStorage(filename)
+    assert storage.get(state.id) == state
+    state = storage.get(state.id)
+    state.complete(node.id, node.invoke(InvocationContext(services=None, graph_execution_state_id=state.id)))  # type: ignore
+    state = run_through_storage(storage, state)
+    assert state.is_complete()
+
+
+def test_storage_lists_searches_and_deletes(iterate_graph):
+    storage = SqliteGraphExecutionStateStorage(sqlite_memory)
+    state = GraphExecutionState(graph=iterate_graph)
+    storage.set(state)
+    state.next()
+    storage.set(state)
+
+    assert storage.list().items == [state]
+    assert storage.list_after().items == [state]
+    assert storage.search(state.id).total == 1
+    assert storage.search("iterate").total == 1
+    assert storage.search("not in any session").total == 0
+    assert [s.id for s in storage.list_summaries(query="collect").items] == [state.id]
+
+    storage.delete(state.id)
+    assert storage.get(state.id) is None
+    assert count_deltas(storage) == 0
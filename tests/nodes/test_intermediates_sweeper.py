@@ -0,0 +1,186 @@
+import datetime
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+import torch
+
+from invokeai.app.invocations.image import ImageOutput, LoadImageInvocation
+from invokeai.app.invocations.latent import LatentsField, LatentsOutput
+from invokeai.app.invocations.math import AddInvocation
+from invokeai.app.models.image import ImageField
+from invokeai.app.services.graph import Edge, EdgeConnection, Graph, GraphExecutionState
+from invokeai.app.services.graph_execution_storage import SqliteGraphExecutionStateStorage
+from invokeai.app.services.image_record_storage import OffsetPaginatedResults
+from invokeai.app.services.intermediates_sweeper import IntermediatesSweeper, get_result_references
+from invokeai.app.services.invocation_cache import MemoryInvocationCache
+from invokeai.app.services.latent_storage import DiskLatentsStorage
+from invokeai.app.services.sqlite import sqlite_memory
+import pytest
+
+
+class MockImages:
+    def __init__(self, folder):
+        self.folder = folder
+        self.records = dict()
+
+    def add(self, image_name, session_id, is_intermediate=True, age=0.0):
+        created_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=age)
+        self.records[image_name] = SimpleNamespace(
+            image_name=image_name, session_id=session_id, is_intermediate=is_intermediate, created_at=created_at
+        )
+        with open(self.get_path(image_name), "wb") as f:
+            f.write(b"x" * 100)
+
+    def get_record(self, image_name):
+        return self.records[image_name]
+
+    def get_path(self, image_name, thumbnail=False):
+        return os.path.join(self.folder, image_name)
+
+    def get_many(self, offset=0, limit=10, is_intermediate=None):
+        items = [r for r in self.records.values() if is_intermediate is None or r.is_intermediate == is_intermediate]
+        return OffsetPaginatedResults.construct(items=items[offset:offset + limit], offset=offset, limit=limit, total=len(items))
+
+    def delete(self, image_name):
+        del self.records[image_name]
+        os.remove(self.get_path(image_name))
+
+
+@pytest.fixture
+def services(tmp_path):
+    return SimpleNamespace(
+        graph_execution_manager=SqliteGraphExecutionStateStorage(sqlite_memory),
+        images=MockImages(tmp_path),
+        latents=DiskLatentsStorage(tmp_path / "latents"),
+        logger=logging.getLogger(__name__),
+    )
+
+
+@pytest.fixture
+def sweeper(services):
+    sweeper = IntermediatesSweeper(delay=0, ttl=3600, interval=3600)
+    sweeper.start(SimpleNamespace(services=services))
+    yield sweeper
+    sweeper.stop()
+
+
+def run_session(services) -> GraphExecutionState:
+    g = Graph()
+    g.add_node(AddInvocation(id="latents"))
+    # only passed to the next node
+    g.add_node(LoadImageInvocation(id="intermediate"))
+    g.add_node(LoadImageInvocation(id="gallery"))
+    g.add_edge(
+        Edge(
+            source=EdgeConnection(node_id="intermediate", field="image"),
+            destination=EdgeConnection(node_id="gallery", field="image"),
+        )
+    )
+    # e.g. a canvas staging result, which is saved to the gallery later
+    g.add_node(AddInvocation(id="staged"))
+    state = GraphExecutionState(graph=g)
+    services.latents.save(f"{state.id}__latents", torch.zeros(16))
+    services.latents.save("other session__latents", torch.zeros(16))
+    services.images.add("intermediate.png", state.id)
+    services.images.add("gallery.png", state.id, is_intermediate=False)
+    services.images.add("staged.png", state.id)
+    outputs = {
+        "latents": LatentsOutput(
+            latents=LatentsField(latents_name=f"{state.id}__latents"), width=8, height=8
+        ),
+        "intermediate": ImageOutput(image=ImageField(image_name="intermediate.png"), width=8, height=8),
+        "gallery": ImageOutput(image=ImageField(image_name="gallery.png"), width=8, height=8),
+        "staged": ImageOutput(image=ImageField(image_name="staged.png"), width=8, height=8),
+    }
+    while (node := state.next()) is not None:
+        state.complete(node.id, outputs[state.prepared_source_mapping[node.id]])
+    services.graph_execution_manager.set(state)
+    return state
+
+
+def test_get_result_references(services):
+    state = run_session(services)
+    assert get_result_references(state) == (
+        {f"{state.id}__latents"},
+        {"intermediate.png", "gallery.png", "staged.png"},
+    )
+
+
+def test_sweeps_completed_session(services, sweeper):
+    state = run_session(services)
+    sweeper.sweep_session(state.id)
+
+    # only intermediates created by the session are deleted
+    assert not services.latents.get_path(f"{state.id}__latents").exists()
+    assert services.latents.get_path("other session__latents").exists()
+    # clients still use the intermediate images of terminal nodes
+    assert set(services.images.records) == {"gallery.png", "staged.png"}
+
+    stats = sweeper.get_stats()
+    assert (stats.sessions, stats.latents, stats.images) == (1, 1, 1)
+    assert stats.bytes > 100
+
+
+def test_keeps_cached_outputs(services, sweeper):
+    state = run_session(services)
+    services.invocation_cache = SimpleNamespace(get_references=lambda: ({f"{state.id}__latents"}, set()))
+    sweeper.sweep_session(state.id)
+
+    # other sessions may reuse them
+    assert services.latents.get_path(f"{state.id}__latents").exists()
+    assert set(services.images.records) == {"gallery.png", "staged.png"}
+
+
+def test_keeps_outputs_reused_by_other_sessions(services, sweeper):
+    state = run_session(services)
+    outputs = {state.prepared_source_mapping[node_id]: output for node_id, output in state.results.items()}
+    services.invocation_cache = MemoryInvocationCache(max_entries=len(outputs))
+    for node_id, output in outputs.items():
+        services.invocation_cache.save(node_id, output)
+
+    # another session reuses the cached outputs, and has nodes left to run
+    other = GraphExecutionState(graph=Graph())
+    for node_id in outputs:
+        other.graph.add_node(AddInvocation(id=node_id))
+    while (node := other.next()) is not None:
+        other.complete(node.id, outputs[other.prepared_source_mapping[node.id]])
+    other.graph.add_node(AddInvocation(id="pending"))
+    services.graph_execution_manager.set(other)
+
+    # the outputs leave the cache
+    for i in range(len(outputs)):
+        services.invocation_cache.save(str(i), AddInvocation(id="unused").invoke(None))
+    assert services.invocation_cache.get_references() == (set(), set())
+
+    sweeper.sweep_session(state.id)
+    assert services.latents.get_path(f"{state.id}__latents").exists()
+    assert set(services.images.records) == {"intermediate.png", "gallery.png", "staged.png"}
+
+
+def test_skips_incomplete_session(services, sweeper):
+    state = GraphExecutionState(graph=Graph())
+    state.graph.add_node(AddInvocation(id="a"))
+    services.graph_execution_manager.set(state)
+    sweeper.sweep_session(state.id)
+    assert sweeper.get_stats().sessions == 0
+
+
+def test_sweeps_expired_intermediates(services, sweeper):
+    services.latents.save("old", torch.zeros(16))
+    services.latents.save("new", torch.zeros(16))
+    past = time.time() - 7200
+    os.utime(services.latents.get_path("old"), (past, past))
+    state = run_session(services)
+    for record in services.images.records.values():
+        record.created_at -= datetime.timedelta(seconds=7200)
+    services.images.add("new.png", state.id)
+    # e.g. an image uploaded to the canvas
+    services.images.add("upload.png", None, age=7200)
+
+    sweeper.sweep_expired()
+
+    assert not services.latents.get_path("old").exists()
+    assert services.latents.get_path("new").exists()
+    assert set(services.images.records) == {"gallery.png", "staged.png", "new.png", "upload.png"}
@@ -0,0 +1,111 @@
+import logging
+from types import SimpleNamespace
+
+import torch
+
+from invokeai.app.invocations.compel import CompelInvocation, CompelOutput, ConditioningField
+from invokeai.app.invocations.latent import LatentsField
+from invokeai.app.invocations.model import ClipField, ModelInfo
+from invokeai.app.invocations.noise import NoiseInvocation, NoiseOutput
+from invokeai.app.services.invocation_cache import MemoryInvocationCache, get_model_references
+from invokeai.app.services.latent_storage import DiskLatentsStorage
+from invokeai.backend.model_management import BaseModelType, ModelType, SubModelType
+import pytest
+
+
+class MockModelManager:
+    def __init__(self):
+        self.hashes = dict()
+
+    def get_model_hash(self, model_name, base_model, model_type):
+        return self.hashes.get(model_name, model_name)
+
+
+@pytest.fixture
+def services(tmp_path):
+    return SimpleNamespace(
+        latents=DiskLatentsStorage(tmp_path / "latents"),
+        model_manager=MockModelManager(),
+        logger=logging.getLogger(__name__),
+    )
+
+
+def make_cache(services, **kwargs) -> MemoryInvocationCache:
+    cache = MemoryInvocationCache(**kwargs)
+    cache.start(SimpleNamespace(services=services))
+    return cache
+
+
+def make_compel(id: str, prompt: str) -> CompelInvocation:
+    def model_info(submodel):
+        return ModelInfo(
+            model_name="sd-1.5",
+            base_model=BaseModelType.StableDiffusion1,
+            model_type=ModelType.Main,
+            submodel=submodel,
+        )
+
+    clip = ClipField(
+        tokenizer=model_info(SubModelType.Tokenizer),
+        text_encoder=model_info(SubModelType.TextEncoder),
+        skipped_layers=0,
+        loras=[],
+    )
+    return CompelInvocation(id=id, prompt=prompt, clip=clip)
+
+
+def save_noise(services, name: str) -> NoiseOutput:
+    services.latents.save(name, torch.zeros(4, 8, 8))
+    return NoiseOutput(noise=LatentsField(latents_name=name), width=64, height=64)
+
+
+def test_keys(services):
+    cache = make_cache(services)
+    key = cache.create_key(NoiseInvocation(id="1", seed=1))
+    # ids do not matter
+    assert cache.create_key(NoiseInvocation(id="2", seed=1)) == key
+    assert cache.create_key(NoiseInvocation(id="1", seed=2)) != key
+    assert make_cache(services, node_types=["compel"]).create_key(NoiseInvocation(id="1", seed=1)) is None
+
+
+def test_keys_follow_model_contents(services):
+    cache = make_cache(services)
+    assert get_model_references(make_compel("1", "a cat")) == {
+        ("sd-1.5", BaseModelType.StableDiffusion1, ModelType.Main)
+    }
+
+    key = cache.create_key(make_compel("1", "a cat"))
+    assert cache.create_key(make_compel("1", "a cat")) == key
+    # e.g. the model was replaced by another one with the same name
+    services.model_manager.hashes["sd-1.5"] = "other weights"
+    assert cache.create_key(make_compel("1", "a cat")) != key
+
+
+def test_hits_and_eviction(services):
+    cache = make_cache(services, max_entries=2)
+    keys = [cache.create_key(NoiseInvocation(id="1", seed=seed)) for seed in range(3)]
+    assert cache.get(keys[0]) is None
+
+    for seed, key in enumerate(keys[:2]):
+        cache.save(key, save_noise(services, f"noise{seed}"))
+    assert cache.get(keys[0]).noise.latents_name == "noise0"
+    # the least recently used output makes room
+    cache.save(keys[2], save_noise(services, "noise2"))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.entries) == (2, 2, 1, 2)
+    assert stats.hit_rate == 0.5
+
+
+def test_outputs_whose_latents_were_deleted_are_not_reused(services):
+    cache = make_cache(services)
+    key = cache.create_key(make_compel("1", "a cat"))
+    services.latents.save("conditioning", torch.zeros(1, 77, 768))
+    cache.save(key, CompelOutput(conditioning=ConditioningField(conditioning_name="conditioning")))
+    assert cache.get_references() == ({"conditioning"}, set())
+
+    services.latents.delete("conditioning")
+    assert cache.get(key) is None
+    assert cache.get_references() == (set(), set())
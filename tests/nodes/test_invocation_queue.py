@@ -0,0 +1,90 @@
+from invokeai.app.services.invocation_queue import InvocationQueueItem, SqliteInvocationQueue
+from invokeai.app.services.sqlite import sqlite_memory
+
+
+def item(session_id: str, invocation_id: str, priority: int = 0) -> InvocationQueueItem:
+    return InvocationQueueItem(graph_execution_state_id = session_id, invocation_id = invocation_id, priority = priority)
+
+def ids(i: InvocationQueueItem) -> tuple[str, str]:
+    return (i.graph_execution_state_id, i.invocation_id)
+
+
+def test_sqlite_queue_is_fifo_within_session():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    queue.put(item('1', 'a'))
+    queue.put(item('1', 'b'))
+    assert ids(queue.get()) == ('1', 'a')
+    assert ids(queue.get()) == ('1', 'b')
+
+def test_sqlite_queue_gets_higher_priority_first():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    queue.put(item('1', 'a'))
+    queue.put(item('2', 'b', priority = 10))
+    assert ids(queue.get()) == ('2', 'b')
+    assert ids(queue.get()) == ('1', 'a')
+
+def test_sqlite_queue_round_robins_sessions():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    for i in range(3):
+        queue.put(item('1', f'a{i}'))
+    queue.put(item('2', 'b0'))
+    queue.put(item('2', 'b1'))
+
+    order = [ids(queue.get()) for _ in range(5)]
+    assert order == [('1', 'a0'), ('2', 'b0'), ('1', 'a1'), ('2', 'b1'), ('1', 'a2')]
+
+def test_sqlite_queue_gets_items_a_worker_can_run():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    queue.put(item('1', 'a', priority = 10))
+    queue.put(item('1', 'b').copy(update = dict(cpu_only = True)))
+    queue.put(item('2', 'c').copy(update = dict(cpu_only = True)))
+    assert ids(queue.get(cpu_only = True)) == ('1', 'b')
+    assert ids(queue.get(cpu_only = False)) == ('1', 'a')
+    assert queue.get().cpu_only
+
+def test_sqlite_queue_lists_sessions_in_order():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    queue.put(item('1', 'a'))
+    queue.put(item('2', 'b'))
+    queue.put(item('3', 'c', priority = 10))
+    queue.put(item('4', 'd'))
+    assert queue.get_session_ids(3) == ['3', '1', '2']
+    # running sessions come first
+    queue.get()
+    queue.get()
+    assert queue.get_session_ids(2) == ['3', '1']
+
+def test_sqlite_queue_cancel_removes_pending_items():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    queue.put(item('1', 'a'))
+    queue.put(item('2', 'b'))
+    queue.cancel('1')
+    assert queue.is_canceled('1')
+    assert ids(queue.get()) == ('2', 'b')
+
+def test_sqlite_queue_wakes_up_on_none():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    queue.put(None)
+    assert queue.get() is None
+
+def test_sqlite_queue_reports_full():
+    queue = SqliteInvocationQueue(sqlite_memory, max_size = 2)
+    queue.put(item('1', 'a'))
+    assert not queue.is_full()
+    queue.put(item('1', 'b'))
+    assert queue.is_full()
+    queue.task_done(queue.get())
+    assert not queue.is_full()
+
+def test_sqlite_queue_survives_restart(tmp_path):
+    filename = str(tmp_path / 'queue.db')
+    queue = SqliteInvocationQueue(filename)
+    queue.put(item('1', 'a'))
+    queue.put(item('1', 'b'))
+    queue.put(item('1', 'c'))
+    queue.task_done(queue.get())
+    queue.get() # taken but never done
+
+    queue = SqliteInvocationQueue(filename)
+    assert ids(queue.get()) == ('1', 'b')
+    assert ids(queue.get()) == ('1', 'c')
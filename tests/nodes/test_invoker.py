@@ -6,8 +6,11 @@ from .test_nodes import (
     create_edge,
     wait_until,
 )
-from invokeai.app.services.invocation_queue import MemoryInvocationQueue
-from invokeai.app.services.processor import DefaultInvocationProcessor
+from invokeai.app.invocations.math import AddInvocation
+from invokeai.app.services.config import InvokeAIAppConfig
+from invokeai.app.services.invocation_cache import MemoryInvocationCache
+from invokeai.app.services.invocation_queue import MemoryInvocationQueue, SqliteInvocationQueue, is_cpu_invocation
+from invokeai.app.services.processor import DefaultInvocationProcessor, check_worker_devices
 from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
 from invokeai.app.services.invoker import Invoker
 from invokeai.app.services.invocation_services import InvocationServices
@@ -16,6 +19,8 @@ from invokeai.app.services.graph import (
     GraphExecutionState,
     LibraryGraph,
 )
+import threading
+
 import pytest
 
 
@@ -128,3 +133,139 @@ def test_handles_errors(mock_invoker: Invoker):
     assert g.is_complete()
 
     assert all((i in g.errors for i in g.source_prepared_mapping["1"]))
+
+
+def test_is_cpu_invocation():
+    assert is_cpu_invocation(AddInvocation(id="1"))
+    assert not is_cpu_invocation(TextToImageTestInvocation(id="2"))
+
+
+def test_workers_run_on_one_gpu():
+    check_worker_devices([None])
+    check_worker_devices(["cpu", "cuda", "cuda:0", "cpu"])
+    with pytest.raises(ValueError):
+        check_worker_devices(["cuda:0", "cuda:1"])
+
+
+def test_can_invoke_all_with_worker_pool(mock_services: InvocationServices, simple_graph):
+    mock_services.configuration = InvokeAIAppConfig(worker_devices=["cpu", "cuda", "cpu"])
+    invoker = Invoker(services=mock_services)
+
+    g = invoker.create_execution_state(graph=simple_graph)
+    invocation_id = invoker.invoke(g, invoke_all=True)
+    assert invocation_id is not None
+
+    def has_executed_all(g: GraphExecutionState):
+        g = invoker.services.graph_execution_manager.get(g.id)
+        return g.is_complete()
+
+    wait_until(lambda: has_executed_all(g), timeout=5, interval=1)
+    invoker.stop()
+
+    g = invoker.services.graph_execution_manager.get(g.id)
+    assert g.is_complete()
+    assert not g.has_error()
+
+
+class BlockingEventService(TestEventService):
+    """Keeps the worker that starts the first invocation busy until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = list()
+        self.release = threading.Event()
+
+    def emit_invocation_started(self, graph_execution_state_id, node, source_node_id):
+        self.started.append(graph_execution_state_id)
+        self.release.wait(5)
+
+
+def test_busy_workers_leave_items_in_the_queue(mock_services: InvocationServices, simple_graph):
+    mock_services.events = BlockingEventService()
+    mock_services.queue = SqliteInvocationQueue(filename=sqlite_memory)
+    invoker = Invoker(services=mock_services)
+
+    busy = invoker.create_execution_state(graph=simple_graph)
+    invoker.invoke(busy)
+    wait_until(lambda: mock_services.events.started, timeout=5)
+
+    # queued after, but with a higher priority than, another session
+    low = invoker.create_execution_state(graph=simple_graph)
+    invoker.invoke(low, priority=0)
+    high = invoker.create_execution_state(graph=simple_graph)
+    invoker.invoke(high, priority=1)
+    mock_services.events.release.set()
+
+    wait_until(lambda: len(mock_services.events.started) == 3, timeout=5)
+    invoker.stop()
+    assert mock_services.events.started == [busy.id, high.id, low.id]
+
+
+def test_cpu_items_do_not_wait_behind_busy_workers(mock_services: InvocationServices, simple_graph):
+    mock_services.configuration = InvokeAIAppConfig(worker_devices=["cpu", "cuda"])
+    mock_services.events = BlockingEventService()
+    invoker = Invoker(services=mock_services)
+
+    busy = invoker.create_execution_state(graph=simple_graph)
+    invoker.invoke(busy)
+    wait_until(lambda: mock_services.events.started, timeout=5)
+
+    # an item for the busy worker is ahead of one for the idle cpu worker
+    waiting = invoker.create_execution_state(graph=simple_graph)
+    invoker.invoke(waiting)
+    g = Graph()
+    g.add_node(AddInvocation(id="1", a=1, b=2))
+    cpu = invoker.create_execution_state(graph=g)
+    invoker.invoke(cpu)
+
+    wait_until(lambda: len(mock_services.events.started) == 2, timeout=5)
+    assert mock_services.events.started == [busy.id, cpu.id]
+    mock_services.events.release.set()
+    invoker.stop()
+
+
+def test_reuses_cached_outputs(mock_services: InvocationServices, simple_graph):
+    mock_services.invocation_cache = MemoryInvocationCache(node_types=["test_prompt"])
+    invoker = Invoker(services=mock_services)
+
+    for _ in range(2):
+        g = invoker.create_execution_state(graph=simple_graph)
+        invoker.invoke(g, invoke_all=True)
+        wait_until(lambda: invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout=5, interval=1)
+        g = invoker.services.graph_execution_manager.get(g.id)
+        assert g.results[g.source_prepared_mapping["1"].pop()].prompt == "Banana sushi"
+    invoker.stop()
+
+    stats = mock_services.invocation_cache.get_stats()
+    assert (stats.hits, stats.misses) == (1, 1)
+
+
+
+def test_keeps_the_state_of_running_sessions(mock_services: InvocationServices):
+    manager = mock_services.graph_execution_manager
+    worker_gets = list()
+    get = manager.get
+
+    def counting_get(id):
+        if threading.current_thread().name.startswith("invoker_worker"):
+            worker_gets.append(id)
+        return get(id)
+
+    manager.get = counting_get
+    invoker = Invoker(services=mock_services)
+
+    g = Graph()
+    g.add_node(AddInvocation(id="1", a=1, b=2))
+    g.add_node(AddInvocation(id="2", b=3))
+    g.add_node(AddInvocation(id="3", b=4))
+    g.add_edge(create_edge("1", "a", "2", "a"))
+    g.add_edge(create_edge("2", "a", "3", "a"))
+    state = invoker.create_execution_state(graph=g)
+    invoker.invoke(state, invoke_all=True)
+    wait_until(lambda: manager.get(state.id).is_complete(), timeout=5, interval=0.1)
+    invoker.stop()
+
+    state = manager.get(state.id)
+    assert state.results[state.source_prepared_mapping["3"].pop()].a == 10
+    # read once, when its first node started
+    assert worker_gets == [state.id]
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+
+from invokeai.app.services.latent_storage import DiskLatentsStorage, ForwardCacheLatentsStorage
+import torch
+
+
+def latents(value: float, size: int = 16) -> torch.Tensor:
+    # 4 bytes per element
+    return torch.full((size,), value, dtype=torch.float32)
+
+
+def test_disk_latents_storage_round_trips(tmp_path):
+    storage = DiskLatentsStorage(tmp_path)
+    storage.save('a', latents(1))
+    storage.save('b', (latents(2), 'extra info'))
+    assert torch.equal(storage.get('a'), latents(1))
+    c, ec = storage.get('b')
+    assert torch.equal(c, latents(2)) and ec == 'extra info'
+
+    storage.delete('a')
+    assert not storage.get_path('a').exists()
+
+def test_disk_latents_storage_reads_pickled_latents(tmp_path):
+    storage = DiskLatentsStorage(tmp_path)
+    torch.save(latents(1), storage.get_path('a'))
+    assert torch.equal(storage.get('a'), latents(1))
+
+def test_latents_cache_evicts_least_recently_used(tmp_path):
+    disk = DiskLatentsStorage(tmp_path)
+    cache = ForwardCacheLatentsStorage(disk, max_cache_size = 3 * 64)
+    cache.save('a', latents(1))
+    cache.save('b', latents(2))
+    cache.save('c', latents(3))
+    assert not any(disk.get_path(n).exists() for n in 'abc')
+
+    cache.get('a')
+    cache.save('d', latents(4))
+
+    # b was the least recently used, and is spilled to disk
+    assert disk.get_path('b').exists()
+    assert not disk.get_path('a').exists()
+    stats = cache.get_stats()
+    assert (stats.hits, stats.evictions, stats.spills, stats.count, stats.size) == (1, 1, 1, 3, 3 * 64)
+
+    assert torch.equal(cache.get('b'), latents(2))
+    assert cache.get_stats().misses == 1
+
+def test_latents_cache_counts_bytes(tmp_path):
+    cache = ForwardCacheLatentsStorage(DiskLatentsStorage(tmp_path), max_cache_size = 100 * 4)
+    cache.save('small', latents(1, size = 10))
+    cache.save('large', latents(2, size = 90))
+    assert cache.get_stats().count == 2
+    cache.save('larger', latents(3, size = 50))
+    assert cache.get_stats().count == 1
+
+    # too large to cache at all
+    cache.save('huge', latents(4, size = 200))
+    assert cache.get_stats().count == 1
+    assert torch.equal(cache.get('huge'), latents(4, size = 200))
+
+def test_latents_cache_deletes_and_flushes(tmp_path):
+    disk = DiskLatentsStorage(tmp_path)
+    cache = ForwardCacheLatentsStorage(disk)
+    cache.save('a', latents(1))
+    cache.save('b', latents(2))
+    cache.delete('a')
+    cache.stop()
+
+    assert not disk.get_path('a').exists()
+    assert torch.equal(disk.get('b'), latents(2))
+
+def test_latents_cache_flushes_named_latents(tmp_path):
+    disk = DiskLatentsStorage(tmp_path)
+    cache = ForwardCacheLatentsStorage(disk)
+    cache.save('a', latents(1))
+    cache.save('b', latents(2))
+    cache.flush(['a', 'missing'], wait = True)
+
+    # still cached, but saved for a restart
+    assert torch.equal(disk.get('a'), latents(1))
+    assert not disk.get_path('b').exists()
+    assert cache.get_stats().count == 2
+
+class BlockingDiskLatentsStorage(DiskLatentsStorage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def save(self, name, data):
+        self.started.set()
+        assert self.release.wait(5)
+        super().save(name, data)
+
+def test_latents_cache_flushes_in_the_background(tmp_path):
+    disk = BlockingDiskLatentsStorage(tmp_path)
+    cache = ForwardCacheLatentsStorage(disk, max_cache_size = 2 * 64)
+    cache.save('a', latents(1))
+    cache.flush(['a'])
+    assert disk.started.wait(5)
+
+    # the cache can be used while the latents are written
+    cache.save('b', latents(2))
+    cache.save('c', latents(3))
+    assert torch.equal(cache.get('a'), latents(1))
+    assert cache.get_size('a') == 64
+    # flushed while being written, and deleted before they were written
+    cache.flush(['a', 'b'])
+    cache.delete('b')
+
+    disk.release.set()
+    cache.stop()
+    assert torch.equal(disk.get('a'), latents(1))
+    assert not disk.get_path('b').exists()
+    assert torch.equal(disk.get('c'), latents(3))
+
+def test_latents_storage_sizes_and_ages(tmp_path):
+    disk = DiskLatentsStorage(tmp_path)
+    cache = ForwardCacheLatentsStorage(disk)
+    cache.save('a', latents(1))
+    assert cache.get_size('a') == 64
+    assert cache.get_size('missing') == 0
+
+    disk.save('b', latents(2))
+    os.utime(disk.get_path('b'), (time.time() - 100, time.time() - 100))
+    assert cache.get_names_older_than(50) == ['b']
+    assert cache.get_size('b') == disk.get_path('b').stat().st_size
+
+def test_disk_latents_storage_stores_conditioning_as_safetensors(tmp_path):
+    from invokeai.backend.stable_diffusion.diffusion import InvokeAIDiffuserComponent
+
+    storage = DiskLatentsStorage(tmp_path)
+    ec = InvokeAIDiffuserComponent.ExtraConditioningInfo(tokens_count_including_eos_bos=7)
+    storage.save('conditioning', (latents(1), ec))
+    with open(storage.get_path('conditioning'), 'rb') as f:
+        assert f.read(2) != b'PK'  # not a pickle archive
+
+    c, loaded_ec = storage.get('conditioning')
+    assert torch.equal(c, latents(1))
+    assert loaded_ec == ec
@@ -0,0 +1,34 @@
+from invokeai.app.invocations.math import AddInvocation
+from invokeai.app.invocations.model import (
+    LoRAModelField,
+    LoraLoaderInvocation,
+    MainModelField,
+    MainModelLoaderInvocation,
+    VAEModelField,
+    VaeLoaderInvocation,
+)
+from invokeai.app.services.graph import Graph, GraphInvocation
+from invokeai.app.services.model_manager_service import get_graph_models
+from invokeai.backend.model_management import BaseModelType, ModelType, SubModelType
+
+
+def test_get_graph_models():
+    sd1 = BaseModelType.StableDiffusion1
+    subgraph = Graph()
+    subgraph.add_node(VaeLoaderInvocation(id="vae", vae_model=VAEModelField(model_name="vae", base_model=sd1)))
+    subgraph.add_node(MainModelLoaderInvocation(id="model", model=MainModelField(model_name="sd", base_model=sd1)))
+
+    g = Graph()
+    g.add_node(MainModelLoaderInvocation(id="model", model=MainModelField(model_name="sd", base_model=sd1)))
+    g.add_node(LoraLoaderInvocation(id="lora", lora=LoRAModelField(model_name="lora", base_model=sd1)))
+    g.add_node(LoraLoaderInvocation(id="no lora"))
+    g.add_node(AddInvocation(id="add"))
+    g.add_node(GraphInvocation(id="subgraph", graph=subgraph))
+
+    assert get_graph_models(g) == [
+        ("sd", sd1, ModelType.Main, SubModelType.TextEncoder),
+        ("sd", sd1, ModelType.Main, SubModelType.UNet),
+        ("sd", sd1, ModelType.Main, SubModelType.Vae),
+        ("lora", sd1, ModelType.Lora, None),
+        ("vae", sd1, ModelType.Vae, None),
+    ]
@@ -1,5 +1,6 @@
-from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
+from invokeai.app.services.sqlite import SqliteItemStorage, get_database, sqlite_memory
 from pydantic import BaseModel, Field
+import threading
 
 
 class TestModel(BaseModel):
@@ -110,3 +111,69 @@ def test_sqlite_service_can_search_with_pagination_and_offset():
     assert results.per_page == 2
     assert results.total == 3
     assert results.items == [TestModel(id = '3', name = 'Test')]
+
+def test_sqlite_service_shares_database_file(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    db1 = SqliteItemStorage[TestModel](filename, 'test1', 'id')
+    db2 = SqliteItemStorage[TestModel](filename, 'test2', 'id')
+    assert db1._db is db2._db
+    assert get_database(sqlite_memory) is not get_database(sqlite_memory)
+
+def test_sqlite_service_reads_while_writing(tmp_path):
+    db = SqliteItemStorage[TestModel](str(tmp_path / 'test.db'), 'test', 'id')
+    db.set(TestModel(id = '1', name = 'Test'))
+
+    results = []
+    with db._lock:
+        # A write is in progress on this thread, reads from other threads do not wait for it
+        reader = threading.Thread(target = lambda: results.append(db.get('1')))
+        reader.start()
+        reader.join(timeout = 5)
+        assert not reader.is_alive()
+
+    assert results == [TestModel(id = '1', name = 'Test')]
+
+def test_sqlite_service_can_list_after():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id')
+    for i in range(5):
+        db.set(TestModel(id = str(i), name = 'Test'))
+
+    results = db.list_after(per_page = 2)
+    assert [i.id for i in results.items] == ['0', '1']
+    results = db.list_after(results.next_cursor, per_page = 2)
+    assert [i.id for i in results.items] == ['2', '3']
+    results = db.list_after(results.next_cursor, per_page = 2)
+    assert [i.id for i in results.items] == ['4']
+    assert results.next_cursor is None
+
+def test_sqlite_service_can_search_index():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id', search_text = lambda i: i.name)
+    db.set(TestModel(id = '1', name = 'Banana sushi'))
+    db.set(TestModel(id = '2', name = 'Apple pie'))
+    db.set(TestModel(id = '3', name = 'Banana split'))
+    db.set(TestModel(id = '3', name = 'Cherry split'))
+
+    results = db.search('ban')
+    assert results.total == 1
+    assert results.items == [TestModel(id = '1', name = 'Banana sushi')]
+    assert db.list_after(query = 'split').items == [TestModel(id = '3', name = 'Cherry split')]
+    assert db.search('"sushi').total == 1
+
+    db.delete('1')
+    assert db.search('banana').total == 0
+
+def test_sqlite_service_indexes_existing_items(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id')
+    db.set(TestModel(id = '1', name = 'Banana sushi'))
+
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id', search_text = lambda i: i.name)
+    assert db.search('sushi').items == [TestModel(id = '1', name = 'Banana sushi')]
+
+def test_sqlite_service_can_list_summaries():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id', search_text = lambda i: i.name)
+    db.set(TestModel(id = '1', name = 'Banana sushi'))
+    db.set(TestModel(id = '2', name = 'Apple pie'))
+
+    results = db.list_summaries(query = 'apple')
+    assert [(i.id, i.text) for i in results.items] == [('2', 'Apple pie')]
@@ -0,0 +1,47 @@
+import threading
+
+import torch
+
+from invokeai.app.util.step_callback import ProgressImageEncoder
+
+KEY = ("session", "node")
+
+
+def test_progress_images_are_throttled():
+    encoder = ProgressImageEncoder()
+    assert [encoder.wants_image(KEY, step, interval=2, max_rate=0) for step in range(4)] == [True, False, True, False]
+    assert not encoder.wants_image(KEY, 0, interval=0, max_rate=0)
+
+    # a second image within the same quarter of a second is skipped
+    assert encoder.wants_image(("session", "other node"), 0, interval=1, max_rate=4)
+    assert not encoder.wants_image(("session", "other node"), 1, interval=1, max_rate=4)
+
+
+def test_progress_is_coalesced_and_flushed():
+    encoder = ProgressImageEncoder()
+    emitted = []
+    blocked = threading.Event()
+    release = threading.Event()
+
+    def block(progress_image):
+        blocked.set()
+        release.wait()
+        emitted.append(("blocking", progress_image))
+
+    def emitter(step):
+        return lambda progress_image: emitted.append((step, progress_image))
+
+    # keep the encoder busy while later steps come in
+    encoder.submit(KEY, block)
+    blocked.wait()
+    encoder.submit(KEY, emitter(1), torch.zeros(1, 4, 8, 8))
+    encoder.submit(KEY, emitter(2))
+    encoder.submit(KEY, emitter(3))
+    release.set()
+    encoder.flush(KEY)
+
+    assert [step for step, _ in emitted] == ["blocking", 3]
+    # the latest step reuses the image of the step it replaced
+    progress_image = emitted[-1][1]
+    assert (progress_image.width, progress_image.height) == (64, 64)
+    assert progress_image.dataURL.startswith("data:image/jpeg;base64,")
@@ -0,0 +1,89 @@
+import pytest
+import torch
+
+from invokeai.backend.model_management.lora import LoRALayer, LoRAModel, ModelPatcher
+
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.block = torch.nn.Module()
+        self.block.proj_in = torch.nn.Linear(4, 4, bias=False)
+
+
+def make_lora(name: str) -> LoRAModel:
+    layer = LoRALayer(
+        "lora_unet_block_proj_in",
+        {"lora_down.weight": torch.randn(2, 4), "lora_up.weight": torch.randn(4, 2)},
+    )
+    return LoRAModel(name=name, layers={"lora_unet_block_proj_in": layer}, device=torch.device("cpu"), dtype=torch.float32)
+
+
+def test_apply_lora_reuses_fused_weights(monkeypatch):
+    model = Model()
+    original = model.block.proj_in.weight.detach().clone()
+    lora1, lora2 = make_lora("1"), make_lora("2")
+    delta1 = lora1.layers["lora_unet_block_proj_in"].get_weight()
+
+    fuses = []
+    fuse_loras = ModelPatcher._fuse_loras.__func__
+    monkeypatch.setattr(
+        ModelPatcher, "_fuse_loras", classmethod(lambda cls, *args: fuses.append(1) or fuse_loras(cls, *args))
+    )
+
+    with ModelPatcher.apply_lora_unet(model, [(lora1, 0.5)]):
+        assert torch.allclose(model.block.proj_in.weight, original + 0.5 * delta1)
+    with ModelPatcher.apply_lora_unet(model, [(lora1, 0.5)]):
+        assert torch.allclose(model.block.proj_in.weight, original + 0.5 * delta1)
+    assert len(fuses) == 1
+
+    # another weight or another set of loras is fused from the original weights
+    with ModelPatcher.apply_lora_unet(model, [(lora1, 1.0)]):
+        assert torch.allclose(model.block.proj_in.weight, original + delta1)
+    with ModelPatcher.apply_lora_unet(model, [(lora1, 1.0), (lora2, 1.0)]):
+        delta2 = lora2.layers["lora_unet_block_proj_in"].get_weight()
+        assert torch.allclose(model.block.proj_in.weight, original + delta1 + delta2, atol=1e-6)
+    assert len(fuses) == 3
+
+    with ModelPatcher.apply_lora_unet(model, []):
+        assert torch.equal(model.block.proj_in.weight, original)
+
+
+def test_apply_lora_takes_generators():
+    model = Model()
+    original = model.block.proj_in.weight.detach().clone()
+    lora = make_lora("1")
+    delta = lora.layers["lora_unet_block_proj_in"].get_weight()
+
+    # as the invocations pass their loras
+    def lora_loader():
+        yield (lora, 1.0)
+
+    with ModelPatcher.apply_lora_unet(model, lora_loader()):
+        assert torch.allclose(model.block.proj_in.weight, original + delta)
+    with ModelPatcher.apply_lora_unet(model, lora_loader()):
+        assert torch.allclose(model.block.proj_in.weight, original + delta)
+
+
+def test_apply_lora_restores_weights_on_error():
+    model = Model()
+    original = model.block.proj_in.weight.detach().clone()
+    lora = make_lora("1")
+    bad_lora = LoRAModel(
+        name="bad",
+        layers={"lora_unet_missing": lora.layers["lora_unet_block_proj_in"]},
+        device=torch.device("cpu"),
+        dtype=torch.float32,
+    )
+
+    with pytest.raises(AttributeError):
+        with ModelPatcher.apply_lora_unet(model, [(lora, 1.0), (bad_lora, 1.0)]):
+            pass
+    assert torch.equal(model.block.proj_in.weight, original)
+
+
+def test_lora_key_index_matches_resolution():
+    model = Model()
+    index = ModelPatcher._build_lora_key_index(model, "lora_unet_")
+    key = "lora_unet_block_proj_in"
+    assert index[key] == ModelPatcher._resolve_lora_key(model, key, "lora_unet_")
@@ -0,0 +1,57 @@
+import torch
+from safetensors.torch import save_file
+
+from invokeai.backend.model_management.lora import LoRAModel
+from invokeai.backend.model_management.mmap_loader import calc_mapped_size, load_safetensors_mmap
+
+
+def test_load_safetensors_mmap(tmp_path):
+    path = tmp_path / "tensors.safetensors"
+    tensors = {
+        "f16": torch.randn(4, 3).half(),
+        "bf16": torch.randn(5).bfloat16(),
+        "i64": torch.arange(7),
+        "u8": torch.arange(3, dtype=torch.uint8),
+        "bool": torch.tensor([True, False]),
+        "scalar": torch.tensor(2.0),
+        "empty": torch.empty(0, 2),
+    }
+    save_file(tensors, path)
+
+    loaded = load_safetensors_mmap(path)
+    assert loaded.keys() == tensors.keys()
+    for key, tensor in tensors.items():
+        assert loaded[key].dtype == tensor.dtype
+        assert torch.equal(loaded[key], tensor)
+
+    # writes stay in this process
+    loaded["i64"][0] = 100
+    assert torch.equal(load_safetensors_mmap(path)["i64"], tensors["i64"])
+
+
+def test_calc_mapped_size(tmp_path):
+    path = tmp_path / "tensors.safetensors"
+    save_file({"a": torch.zeros(256, dtype=torch.float16), "b": torch.zeros(64)}, path)
+    loaded = load_safetensors_mmap(path)
+    assert calc_mapped_size(loaded) == 256 * 2 + 64 * 4
+
+    # converted tensors are copies
+    loaded["a"] = loaded["a"].float()
+    assert calc_mapped_size(loaded) == 64 * 4
+    assert calc_mapped_size({"c": torch.zeros(64)}) == 0
+
+
+def test_lora_from_mapped_checkpoint(tmp_path):
+    path = tmp_path / "lora.safetensors"
+    state_dict = {
+        "lora_unet_block.lora_down.weight": torch.randn(4, 32).half(),
+        "lora_unet_block.lora_up.weight": torch.randn(32, 4).half(),
+        "lora_unet_block.alpha": torch.tensor(4.0).half(),
+    }
+    save_file(state_dict, path)
+
+    copied = LoRAModel.from_checkpoint(path, dtype=torch.float16)
+    mapped = LoRAModel.from_checkpoint(path, dtype=torch.float16, mmap=True)
+    assert torch.equal(mapped.layers["lora_unet_block"].up, copied.layers["lora_unet_block"].up)
+    assert calc_mapped_size(copied) == 0
+    assert calc_mapped_size(mapped) == mapped.calc_size()
@@ -0,0 +1,359 @@
+import json
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import pytest
+import torch
+from safetensors.torch import save_file
+
+from invokeai.backend.model_management import model_cache
+from invokeai.backend.model_management.cache_policy import LFUPolicy, LRFUPolicy, LRUPolicy
+from invokeai.backend.model_management.mmap_loader import load_safetensors_mmap
+from invokeai.backend.model_management.model_cache import GIG, CacheFullException, ModelCache
+from invokeai.backend.model_management.models import BaseModelType, ModelBase, ModelType, SubModelType
+
+
+class FakeModel:
+    def __init__(self, name: str):
+        self.name = name
+        self.device = torch.device("cpu")
+
+    def to(self, device: torch.device):
+        self.device = device
+        return self
+
+
+class FakeModelInfo(ModelBase):
+    loads = Counter()
+    loads_lock = threading.Lock()
+
+    @classmethod
+    def detect_format(cls, path: str) -> str:
+        return "fake"
+
+    @classmethod
+    def save_to_config(cls) -> bool:
+        return False
+
+    def get_size(self, child_type: Optional[SubModelType] = None) -> int:
+        return GIG
+
+    def get_model(self, torch_dtype: Optional[torch.dtype], child_type: Optional[SubModelType] = None):
+        with self.loads_lock:
+            self.loads[str(self.model_path)] += 1
+        time.sleep(0.05)
+        if "broken" in str(self.model_path):
+            raise RuntimeError("cannot load")
+        return FakeModel(str(self.model_path))
+
+
+@pytest.fixture
+def model_paths(tmp_path):
+    FakeModelInfo.loads.clear()
+    paths = [tmp_path / f"model{i}" for i in range(5)] + [tmp_path / "broken"]
+    for path in paths:
+        path.mkdir()
+    return paths
+
+
+def get_model(cache: ModelCache, path):
+    return cache.get_model(path, FakeModelInfo, BaseModelType.StableDiffusion1, ModelType.Main)
+
+
+def make_cache(max_cache_size: float, **kwargs) -> ModelCache:
+    kwargs.setdefault("execution_device", torch.device("cpu"))
+    return ModelCache(
+        max_cache_size=max_cache_size,
+        storage_device=torch.device("cpu"),
+        **kwargs,
+    )
+
+
+def test_concurrent_requests_load_once(model_paths):
+    cache = make_cache(10)
+    lockers = []
+    threads = [threading.Thread(target=lambda: lockers.append(get_model(cache, model_paths[0]))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert FakeModelInfo.loads[str(model_paths[0])] == 1
+    assert len({id(l.model) for l in lockers}) == 1
+
+
+def test_failed_load_is_raised_to_waiters(model_paths):
+    cache = make_cache(10)
+    errors = []
+
+    def load():
+        try:
+            get_model(cache, model_paths[-1])
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+    assert FakeModelInfo.loads[str(model_paths[-1])] == 1
+    # a later request tries again
+    with pytest.raises(RuntimeError):
+        get_model(cache, model_paths[-1])
+    assert FakeModelInfo.loads[str(model_paths[-1])] == 2
+
+
+def test_locked_models_are_not_evicted(model_paths):
+    cache = make_cache(2)
+    with get_model(cache, model_paths[0]) as model:
+        get_model(cache, model_paths[1])
+        get_model(cache, model_paths[2])
+        # the least recently used model is in use, so the next one is evicted
+        assert get_model(cache, model_paths[0]).model is model
+        assert FakeModelInfo.loads[str(model_paths[0])] == 1
+    assert cache.cache_size() <= 2
+
+
+def test_stress(model_paths):
+    cache = make_cache(3)
+    errors = []
+
+    def work(seed: int):
+        try:
+            for i in range(10):
+                path = model_paths[(seed * 7 + i) % 5]
+                with get_model(cache, path) as model:
+                    assert model.name == str(path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert all(not entry.locked for entry in cache._cached_models.values())
+    assert not cache._pending_loads
+    # the cache only grows past its size while every model is in use
+    cache._make_cache_room(0)
+    assert cache.cache_size() <= 3
+
+
+def test_prefetch_stats(model_paths):
+    cache = make_cache(10)
+    cache.get_model(model_paths[0], FakeModelInfo, BaseModelType.StableDiffusion1, ModelType.Main, prefetch=True)
+    get_model(cache, model_paths[0])
+    get_model(cache, model_paths[0])  # only the first request is served by the prefetch
+    get_model(cache, model_paths[1])
+
+    stats = cache.get_prefetch_stats()
+    assert (stats.prefetched, stats.hits, stats.misses) == (1, 1, 1)
+    assert stats.time_saved >= 0.05
+
+
+def test_prefetch_in_flight_is_shared(model_paths):
+    cache = make_cache(10)
+    thread = threading.Thread(
+        target=cache.get_model,
+        args=(model_paths[0], FakeModelInfo, BaseModelType.StableDiffusion1, ModelType.Main),
+        kwargs=dict(prefetch=True),
+    )
+    thread.start()
+    while not cache._pending_loads:
+        time.sleep(0.001)
+    get_model(cache, model_paths[0])
+    thread.join()
+
+    assert FakeModelInfo.loads[str(model_paths[0])] == 1
+    stats = cache.get_prefetch_stats()
+    assert (stats.prefetched, stats.hits, stats.misses) == (1, 1, 0)
+
+
+def prefetch(cache: ModelCache, path):
+    return cache.get_model(path, FakeModelInfo, BaseModelType.StableDiffusion1, ModelType.Main, prefetch=True)
+
+
+def test_prefetches_only_evict_prefetched_models(model_paths):
+    cache = make_cache(2)
+    get_model(cache, model_paths[0])
+    prefetch(cache, model_paths[1])
+    # the prefetched model makes room for the next one, the requested one does not
+    prefetch(cache, model_paths[2])
+    assert FakeModelInfo.loads[str(model_paths[0])] == 1
+    assert str(model_paths[1]) not in [k.split(":")[0] for k in cache._cached_models]
+
+    # nor does a prefetched model once it was requested
+    get_model(cache, model_paths[2])
+    with pytest.raises(CacheFullException):
+        prefetch(cache, model_paths[3])
+    assert str(model_paths[3]) not in FakeModelInfo.loads
+    get_model(cache, model_paths[0])
+    assert FakeModelInfo.loads[str(model_paths[0])] == 1
+
+
+class FakeMappedModelInfo(FakeModelInfo):
+    def get_size(self, child_type: Optional[SubModelType] = None) -> int:
+        return 1024 * 4
+
+    def get_model(self, torch_dtype: Optional[torch.dtype], child_type: Optional[SubModelType] = None):
+        return load_safetensors_mmap(self.model_path / "model.safetensors")
+
+
+def test_mapped_models_are_not_resident(model_paths):
+    save_file({"weight": torch.zeros(1024)}, model_paths[0] / "model.safetensors")
+    cache = make_cache(10)
+    cache.get_model(model_paths[0], FakeMappedModelInfo, BaseModelType.StableDiffusion1, ModelType.Main)
+    assert cache.cache_size() == 0
+    assert cache.mapped_cache_size() * GIG == 1024 * 4
+
+
+def touch_all(policy, keys):
+    for key in keys:
+        policy.touch(key)
+    return policy
+
+
+def test_cache_policies():
+    keys = ["a", "a", "a", "b", "c"]
+    assert touch_all(LRUPolicy(), keys).victims() == ["a", "b", "c"]
+    assert touch_all(LFUPolicy(), keys).victims() == ["b", "c", "a"]
+    assert touch_all(LRFUPolicy(half_life=10), keys).victims() == ["b", "c", "a"]
+    # a model used often long ago goes before one used recently
+    assert touch_all(LRFUPolicy(half_life=1), keys).victims() == ["a", "b", "c"]
+
+    policy = touch_all(LFUPolicy(), keys)
+    policy.remove("a")
+    assert policy.victims() == ["b", "c"]
+    # counts are kept for models that come back
+    policy.touch("a")
+    assert policy.victims() == ["b", "c", "a"]
+
+
+@pytest.mark.parametrize("policy,offloaded", [("lru", 0), ("lfu", 1)])
+def test_vram_tier_offloads_by_policy(model_paths, policy, offloaded):
+    # the meta device stands in for the GPU
+    cache = make_cache(10, max_vram_cache_size=2, execution_device=torch.device("meta"), cache_policy=policy)
+    for path in [model_paths[0], model_paths[0], model_paths[0], model_paths[1]]:
+        with get_model(cache, path):
+            pass
+    assert cache.vram_cache_size() == 2
+
+    with get_model(cache, model_paths[2]) as model:
+        assert model.device == torch.device("meta")
+    assert cache.vram_cache_size() == 2
+    assert get_model(cache, model_paths[offloaded]).model.device == torch.device("cpu")
+    assert get_model(cache, model_paths[1 - offloaded]).model.device == torch.device("meta")
+
+
+def test_models_are_moved_outside_the_cache_lock(model_paths):
+    cache = make_cache(10, execution_device=torch.device("meta"))
+    with get_model(cache, model_paths[0]):
+        pass
+    slow = get_model(cache, model_paths[1])
+    moving, release = threading.Event(), threading.Event()
+    devices = []
+
+    def slow_to(device):
+        moving.set()
+        release.wait(5)
+        slow.model.device = device
+        return slow.model
+
+    def use(locker):
+        with locker as model:
+            devices.append(model.device)
+
+    slow.model.to = slow_to
+    mover = threading.Thread(target=use, args=(slow,))
+    mover.start()
+    moving.wait(5)
+
+    # other models are available while the copy runs
+    other = threading.Thread(target=use, args=(get_model(cache, model_paths[0]),))
+    other.start()
+    other.join(5)
+    assert devices == [torch.device("meta")]
+
+    # while the model itself is only handed out once it has been moved
+    waiter = threading.Thread(target=use, args=(get_model(cache, model_paths[1]),))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    release.set()
+    for thread in (mover, waiter):
+        thread.join(5)
+    assert devices == [torch.device("meta")] * 3
+    assert cache.vram_cache_size() == 2
+
+
+def test_garbage_is_only_collected_after_evictions(model_paths, monkeypatch):
+    collections = []
+    monkeypatch.setattr(model_cache.gc, "collect", lambda: collections.append(1))
+    cache = make_cache(2)
+    get_model(cache, model_paths[0])
+    get_model(cache, model_paths[1])
+    get_model(cache, model_paths[0])
+    assert not collections
+    get_model(cache, model_paths[2])
+    assert len(collections) == 1
+
+
+def test_trace(model_paths, tmp_path):
+    cache = make_cache(10, trace_path=tmp_path / "trace.jsonl")
+    get_model(cache, model_paths[0])
+    cache.get_model(model_paths[1], FakeModelInfo, BaseModelType.StableDiffusion1, ModelType.Main, prefetch=True)
+    cache.get_model(model_paths[1], FakeModelInfo, BaseModelType.StableDiffusion1, ModelType.Main, gpu_load=False)
+
+    with open(tmp_path / "trace.jsonl") as f:
+        trace = [json.loads(line) for line in f]
+    assert [(r["key"].split(":")[0], r["size"], r["gpu_load"]) for r in trace] == [
+        (str(model_paths[0]), GIG, True),
+        (str(model_paths[1]), GIG, False),
+    ]
+
+
+class FakeDetector:
+    """Holds its network in an estimator, as the pose detector does"""
+
+    def __init__(self):
+        self.estimator = type("Estimator", (), {})()
+        self.estimator.model = torch.nn.Linear(256, 256)
+
+    def to(self, device):
+        self.estimator.model.to(device)
+        return self
+
+    def __call__(self, x):
+        return self.estimator.model(x)
+
+
+def test_annotators_are_cached_with_the_models(model_paths):
+    from invokeai.backend.model_management.annotator import Annotator
+
+    cache = make_cache(10, execution_device=torch.device("meta"))
+    loads = []
+
+    def load():
+        loads.append(1)
+        return Annotator(FakeDetector())
+
+    with cache.get_custom_model("annotator:fake", load) as annotator:
+        # moved to the execution device, with its estimator
+        assert annotator.device == torch.device("meta")
+        assert annotator(torch.zeros(1, 256, device="meta")).shape == (1, 256)
+    assert cache.vram_cache_size() == pytest.approx((256 * 256 + 256) * 4 / GIG)
+    with cache.get_custom_model("annotator:fake", load):
+        pass
+    assert len(loads) == 1
+
+    # its size is measured from its weights
+    assert cache.cache_size() == pytest.approx((256 * 256 + 256) * 4 / GIG)
+    get_model(cache, model_paths[0])
+    assert cache.cache_size() == pytest.approx(1 + (256 * 256 + 256) * 4 / GIG)
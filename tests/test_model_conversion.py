@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from invokeai.backend.model_management.model_conversion import ModelConverter
+
+
+def write_model(path, weights: str):
+    path.mkdir()
+    (path / "diffusion_pytorch_model.bin").write_text(weights)
+
+
+def fail(path):
+    path.mkdir()
+    raise ValueError("not a checkpoint")
+
+
+@pytest.fixture(scope="module")
+def converter():
+    # forking is quicker than spawning a process per conversion
+    return ModelConverter(progress_interval=0.01, mp_context="fork")
+
+
+def test_convert(tmp_path, converter):
+    output_path = tmp_path / "converted"
+    assert converter.convert(output_path, write_model, "weights") == output_path
+    assert (output_path / "diffusion_pytorch_model.bin").read_text() == "weights"
+    # nothing but the converted model was left behind
+    assert list(tmp_path.iterdir()) == [output_path]
+
+    # converted models are not converted again
+    assert converter.convert(output_path, fail) == output_path
+
+
+def test_concurrent_requests_convert_once(tmp_path, converter):
+    output_path = tmp_path / "converted"
+    futures = []
+    threads = [
+        threading.Thread(target=lambda: futures.append(converter.submit(output_path, write_model, "weights")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(f) for f in futures}) == 1
+    assert futures[0].result() == output_path
+    assert converter.jobs() == []
+
+
+def test_events(tmp_path, converter):
+    events = []
+    converter.add_listener(lambda event, job: events.append((event, job.name, job.error)))
+
+    converter.convert(tmp_path / "converted", write_model, "weights", name="model")
+    with pytest.raises(ValueError):
+        converter.convert(tmp_path / "failed", fail, name="bad model")
+
+    assert not (tmp_path / "failed").exists()
+    assert list(tmp_path.iterdir()) == [tmp_path / "converted"]
+    events = [e for e in events if e[0] != "progress"]
+    assert events == [
+        ("started", "model", None),
+        ("completed", "model", None),
+        ("started", "bad model", None),
+        ("error", "bad model", "not a checkpoint"),
+    ]
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+from functools import partial
+
+import torch
+
+from invokeai.backend.model_management import BaseModelType, ModelType
+from invokeai.backend.model_management.model_hash import ModelHasher, ModelHashIndex
+from invokeai.backend.model_management.model_manager import ModelInfo
+
+
+def write(path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+class CountingHasher(ModelHasher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hashed = []
+
+    def _sha256(self, path):
+        self.hashed.append(path.name)
+        return super()._sha256(path)
+
+
+def test_file_hash_is_sha256(tmp_path):
+    data = os.urandom(100_000)
+    path = write(tmp_path / "model.safetensors", data)
+    # chunks smaller than the file
+    assert ModelHasher(chunk_size=4096).hash_model(path) == hashlib.sha256(data).hexdigest()
+
+
+def test_unchanged_files_are_not_hashed_again(tmp_path):
+    index = ModelHashIndex(tmp_path / "hashes.db")
+    path = write(tmp_path / "model.ckpt", b"weights")
+    hasher = CountingHasher(index)
+    first = hasher.hash_model(path)
+    assert hasher.hash_model(path) == first
+
+    # the index outlives the hasher
+    hasher = CountingHasher(ModelHashIndex(tmp_path / "hashes.db"))
+    assert hasher.hash_model(path) == first
+    assert hasher.hashed == []
+
+    write(path, b"other weights")
+    assert hasher.hash_model(path) != first
+    assert hasher.hashed == ["model.ckpt"]
+
+
+def test_folder_hash(tmp_path):
+    for root in [tmp_path / "a", tmp_path / "b"]:
+        write(root / "unet" / "diffusion_pytorch_model.bin", b"unet")
+        write(root / "vae" / "diffusion_pytorch_model.bin", b"vae")
+    write(tmp_path / "a" / "model_index.json", b"{}")
+    hasher = ModelHasher()
+
+    # only the weights count
+    assert hasher.hash_model(tmp_path / "a") == hasher.hash_model(tmp_path / "b")
+    write(tmp_path / "b" / "vae" / "diffusion_pytorch_model.bin", b"other vae")
+    assert hasher.hash_model(tmp_path / "a") != hasher.hash_model(tmp_path / "b")
+
+
+def test_concurrent_requests_hash_once(tmp_path):
+    path = write(tmp_path / "model.safetensors", os.urandom(1_000_000))
+    hasher = CountingHasher(chunk_size=1024)
+    hashes = []
+    threads = [threading.Thread(target=lambda: hashes.append(hasher.hash_model(path))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(hashes)) == 1
+    assert hasher.hashed == ["model.safetensors"]
+
+
+def test_duplicates(tmp_path):
+    index = ModelHashIndex()
+    hasher = ModelHasher(index)
+    paths = [
+        write(tmp_path / "a.safetensors", b"same"),
+        write(tmp_path / "copy" / "a.safetensors", b"same"),
+        write(tmp_path / "b.safetensors", b"different"),
+    ]
+    for path in paths:
+        hasher.hash_file(path)
+    assert index.get_duplicates() == [sorted(str(p.absolute()) for p in paths[:2])]
+
+    paths[1].unlink()
+    assert index.prune() == 1
+    assert index.get_duplicates() == []
+
+
+def test_model_info_is_hashed_when_asked(tmp_path):
+    hasher = CountingHasher()
+    path = write(tmp_path / "model.safetensors", b"weights")
+    info = ModelInfo(
+        context=None,
+        name="model",
+        base_model=BaseModelType.StableDiffusion1,
+        type=ModelType.Main,
+        location=path,
+        precision=torch.float32,
+        _get_hash=partial(hasher.hash_model, path),
+    )
+    assert hasher.hashed == []
+    assert info.hash == info.hash == hashlib.sha256(b"weights").hexdigest()
+    assert hasher.hashed == ["model.safetensors"]
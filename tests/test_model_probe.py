@@ -0,0 +1,92 @@
+import os
+
+import pytest
+import safetensors.torch
+import torch
+
+from invokeai.backend.model_management import BaseModelType, ModelType
+from invokeai.backend.model_management import model_probe
+from invokeai.backend.model_management.model_probe import ModelProbe, ModelProbeCache
+from invokeai.backend.model_management.models import base
+
+
+@pytest.fixture(autouse=True)
+def probe_cache(monkeypatch):
+    cache = ModelProbeCache()
+    monkeypatch.setattr(ModelProbe, "_cache", cache)
+    return cache
+
+
+def write_lora(path, token_vector_length=768, dtype=torch.float16):
+    safetensors.torch.save_file(
+        {
+            "lora_te_text_model_encoder_layers_0_mlp_fc1.lora_down.weight": torch.zeros(4, token_vector_length, dtype=dtype),
+            "lora_te_text_model_encoder_layers_0_mlp_fc1.lora_up.weight": torch.zeros(3072, 4, dtype=dtype),
+        },
+        path,
+    )
+    return path
+
+
+def bump_mtime(path):
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_safetensors_are_probed_from_their_header(tmp_path, monkeypatch):
+    path = write_lora(tmp_path / "lora.safetensors", dtype=torch.bfloat16)
+
+    def load_file(*args, **kwargs):
+        raise AssertionError("the tensors were loaded")
+
+    monkeypatch.setattr(base.safetensors.torch, "load_file", load_file)
+    info = ModelProbe.probe(path)
+    assert info.model_type == ModelType.Lora
+    assert info.base_type == BaseModelType.StableDiffusion1
+
+
+def test_unchanged_models_are_not_probed_again(tmp_path, monkeypatch):
+    path = write_lora(tmp_path / "lora.safetensors")
+    probes = []
+    probe = ModelProbe._probe.__func__
+    monkeypatch.setattr(ModelProbe, "_probe", classmethod(lambda cls, *args: probes.append(args) or probe(cls, *args)))
+
+    first = ModelProbe.probe(path)
+    assert ModelProbe.probe(path) == first
+    assert len(probes) == 1
+
+    write_lora(path, token_vector_length=1024)
+    bump_mtime(path)
+    assert ModelProbe.probe(path).base_type == BaseModelType.StableDiffusion2
+    assert len(probes) == 2
+
+
+def test_cache_outlives_the_process(tmp_path):
+    path = write_lora(tmp_path / "lora.safetensors")
+    info = ModelProbe.probe(path)
+    ModelProbeCache(tmp_path / "probes.db").set(path, ModelProbeCache.get_identity(path), info)
+    assert ModelProbeCache(tmp_path / "probes.db").get(path, ModelProbeCache.get_identity(path)) == (True, info)
+
+
+def test_folder_identity_follows_its_files(tmp_path):
+    folder = tmp_path / "model"
+    (folder / "unet").mkdir(parents=True)
+    (folder / "unet" / "config.json").write_text("{}")
+    identity = ModelProbeCache.get_identity(folder)
+    assert ModelProbeCache.get_identity(folder) == identity
+    (folder / "unet" / "config.json").write_text('{"sample_size": 96}')
+    assert ModelProbeCache.get_identity(folder) != identity
+
+
+def test_probe_many(tmp_path, monkeypatch):
+    paths = [write_lora(tmp_path / f"lora{i}.safetensors", 768 if i % 2 else 1024) for i in range(6)]
+    bad = tmp_path / "notes.bin"
+    bad.write_bytes(b"not a model")
+
+    infos = ModelProbe.probe_many(paths + [bad], max_workers=2)
+    assert bad not in infos
+    assert infos == {path: ModelProbe.probe(path) for path in paths}
+
+    # the results were cached by this process
+    monkeypatch.setattr(model_probe, "ProcessPoolExecutor", None)
+    assert ModelProbe.probe_many(paths) == infos
@@ -0,0 +1,84 @@
+import os
+
+from invokeai.backend.model_management import model_scan_index
+from invokeai.backend.model_management.model_scan_index import ModelScanIndex
+
+
+def bump_mtime(path):
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_unchanged_folders_are_not_listed_again(tmp_path, monkeypatch):
+    folder = tmp_path / "lora"
+    folder.mkdir()
+    (folder / "a.safetensors").touch()
+    listings = []
+    scandir = os.scandir
+    monkeypatch.setattr(model_scan_index.os, "scandir", lambda p: listings.append(p) or scandir(p))
+
+    index = ModelScanIndex(tmp_path / "index.db")
+    assert index.list_folder(folder) == [folder / "a.safetensors"]
+    assert index.list_folder(folder) == [folder / "a.safetensors"]
+    # the index outlives the process
+    assert ModelScanIndex(tmp_path / "index.db").list_folder(folder) == [folder / "a.safetensors"]
+    assert len(listings) == 1
+
+    (folder / "b.safetensors").touch()
+    bump_mtime(folder)
+    assert index.list_folder(folder) == [folder / "a.safetensors", folder / "b.safetensors"]
+    assert len(listings) == 2
+
+
+def test_invalid_entries_until_they_change(tmp_path):
+    index = ModelScanIndex()
+    path = tmp_path / "model"
+    path.mkdir()
+    assert not index.is_invalid(path)
+    index.set_invalid(path)
+    assert index.is_invalid(path)
+    # e.g. the rest of the model was copied
+    (path / "model_index.json").touch()
+    bump_mtime(path)
+    assert not index.is_invalid(path)
+
+
+def test_tree_changed(tmp_path):
+    index = ModelScanIndex()
+    root = tmp_path / "autoimport"
+    (root / "lora").mkdir(parents=True)
+    assert index.tree_changed(root)
+
+    index.record_tree(root)
+    assert not index.tree_changed(root)
+    # a folder whose name starts like the root is not part of its tree
+    (tmp_path / "autoimport2").mkdir()
+    index.record_tree(tmp_path / "autoimport2")
+    bump_mtime(tmp_path / "autoimport2")
+    assert not index.tree_changed(root)
+
+    (root / "lora" / "new.safetensors").touch()
+    bump_mtime(root / "lora")
+    assert index.tree_changed(root)
+    index.record_tree(root)
+    assert not index.tree_changed(root)
+
+
+def test_tree_changed_while_a_file_is_copied(tmp_path):
+    index = ModelScanIndex()
+    root = tmp_path / "autoimport"
+    root.mkdir()
+    model = root / "model.safetensors"
+    model.write_bytes(b"0" * 10)
+    # the state of the tree when it was searched, while the model was being copied
+    state = index.tree_state(root)
+    root_mtime = root.stat().st_mtime_ns
+
+    with open(model, "ab") as f:
+        f.write(b"0" * 10)
+    assert root.stat().st_mtime_ns == root_mtime
+    index.record_tree(root, state)
+    assert index.tree_changed(root)
+
+    index.record_tree(root)
+    assert not index.tree_changed(root)